@@ -12,6 +12,8 @@ class SteamProfileInline(admin.StackedInline):
 
 class UserAdmin(BaseUserAdmin):
     inlines = (SteamProfileInline, )
+    # Also backs the user autocomplete in the ladder admin, a prefix search stays on the username index
+    search_fields = ('username__startswith', )
 
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+ASGI config for elo project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Live ladder event streams are served directly, everything else goes to Django.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "elo.settings")
+
+from django.core.asgi import get_asgi_application
+django_application = get_asgi_application()
+
+from django.urls import Resolver404, resolve
+from ladder.events import ladder_events_stream
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            match = None
+
+        if match is not None and match.view_name == 'ladder:events':
+            return await ladder_events_stream(scope, receive, send, **match.kwargs)
+
+    return await django_application(scope, receive, send)
@@ -0,0 +1,67 @@
+import bisect
+import threading
+
+# Upper bounds of the histogram buckets, a last +Inf bucket is always added.
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+class MetricsRegistry(object):
+    """Per-process histograms of the request metrics, keyed by metric name and URL name."""
+    METRICS = (
+        ('elo_request_duration_seconds', "Wall time spent handling the request.", SECONDS_BUCKETS),
+        ('elo_request_db_seconds', "Time spent executing SQL queries.", SECONDS_BUCKETS),
+        ('elo_request_template_seconds', "Time spent rendering templates.", SECONDS_BUCKETS),
+        ('elo_request_queries', "Number of SQL queries executed.", QUERY_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = dict((name, {}) for name, _help, _buckets in self.METRICS)
+
+    def observe(self, view, wall, db, template, queries):
+        with self.lock:
+            for (name, _help, buckets), value in zip(self.METRICS, (wall, db, template, queries)):
+                histogram = self.histograms[name].get(view)
+                if histogram is None:
+                    histogram = self.histograms[name][view] = Histogram(buckets)
+                histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            for histograms in self.histograms.values():
+                histograms.clear()
+
+    def render(self):
+        """Returns every histogram in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            for name, help_text, buckets in self.METRICS:
+                lines.append("# HELP {0} {1}".format(name, help_text))
+                lines.append("# TYPE {0} histogram".format(name))
+                for view, histogram in sorted(self.histograms[name].items()):
+                    label = view.replace('\\', '\\\\').replace('"', '\\"')
+                    for bound, count in zip(buckets + ('+Inf',), histogram.cumulative_counts()):
+                        lines.append('{0}_bucket{{view="{1}",le="{2}"}} {3}'.format(name, label, bound, count))
+                    lines.append('{0}_sum{{view="{1}"}} {2}'.format(name, label, histogram.sum))
+                    lines.append('{0}_count{{view="{1}"}} {2}'.format(name, label, histogram.count))
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
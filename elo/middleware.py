@@ -0,0 +1,93 @@
+import contextvars
+import threading
+import time
+from django.db import connection
+from django.template.backends.django import Template
+from elo.metrics import registry
+
+_template_timer = contextvars.ContextVar('elo_template_timer', default = None)
+
+class _TemplateTimer(object):
+    """Adds up the time spent rendering templates during one request."""
+    def __init__(self):
+        self.seconds = 0.0
+        self.depth = 0
+
+def _timed_template_render(render):
+    def timed_render(self, context = None, request = None):
+        timer = _template_timer.get()
+        if timer is None:
+            return render(self, context, request)
+
+        # A template rendered from inside another one (render_to_string in a tag) is already being timed.
+        timer.depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timer.depth -= 1
+            if timer.depth == 0:
+                timer.seconds += time.perf_counter() - started
+
+    timed_render._elo_timed = True
+    return timed_render
+
+_install_lock = threading.Lock()
+
+def _install_template_timer():
+    """Wraps Django's template rendering once for the whole process, the backend has no hook for render time.
+
+        Only done once the middleware is set up, so a process that doesn't use it renders untouched.
+        Templates rendered outside a timed request pass straight through.
+    """
+    with _install_lock:
+        if not getattr(Template.render, '_elo_timed', False):
+            Template.render = _timed_template_render(Template.render)
+
+class _QueryTimer(object):
+    """A database execute wrapper counting the queries of one request and the time spent in them."""
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+class RequestMetricsMiddleware(object):
+    """Records the query count, database time, template time and wall time of every request.
+
+        The numbers go out on the response as a Server-Timing header (readable in the browser's
+        network panel) plus X-DB-Queries, and are added to per URL name histograms served by the
+        metrics view. The histograms live in the worker process, so each worker reports its own.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _install_template_timer()
+
+    def __call__(self, request):
+        query_timer = _QueryTimer()
+        template_timer = _TemplateTimer()
+        token = _template_timer.set(template_timer)
+
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(query_timer):
+                response = self.get_response(request)
+        finally:
+            _template_timer.reset(token)
+        wall = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else '<unresolved>'
+        registry.observe(view, wall, query_timer.seconds, template_timer.seconds, query_timer.queries)
+
+        response['Server-Timing'] = "db;dur={0:.1f}, tpl;dur={1:.1f}, total;dur={2:.1f}".format(
+            query_timer.seconds * 1000, template_timer.seconds * 1000, wall * 1000)
+        response['X-DB-Queries'] = str(query_timer.queries)
+
+        return response
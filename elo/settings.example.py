@@ -44,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Opt-in: records query count, DB, template and wall time per request, served from /metrics/.
+    # Keep it first so the time spent in the other middleware is counted too.
+    # 'elo.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +56,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Scrapers read /metrics/ by sending "Authorization: Bearer <token>", signed in staff can read it too.
+# Leave it empty to serve the metrics to staff only.
+METRICS_TOKEN = ''
+
+# Fans live ladder events out to the streams served by elo.asgi. The local broker only reaches
+# streams in the same process, run a single ASGI process or plug in a shared broker.
+LADDER_EVENTS_BROKER = 'ladder.events.LocalBroker'
+
 ROOT_URLCONF = 'elo.urls'
 
 TEMPLATES = [
@@ -85,6 +96,18 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Ladder standings are cached here. The local memory cache is per-process, use a
+# shared backend (memcached, redis) when running more than one worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.template.backends.django import Template
+from django.test import SimpleTestCase, TestCase, modify_settings, override_settings
+from django.urls import reverse
+
+from elo.metrics import registry
+from elo.middleware import RequestMetricsMiddleware
+
+@modify_settings(MIDDLEWARE = {'prepend': 'elo.middleware.RequestMetricsMiddleware'})
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_headers_and_histograms(self):
+        response = self.client.get(reverse('index'))
+
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('tpl;dur=', response['Server-Timing'])
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+
+        self.client.force_login(User.objects.create(username = 'admin', is_staff = True))
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('elo_request_duration_seconds_count{view="index"} 1', metrics)
+        self.assertIn('elo_request_queries_bucket{view="index",le="+Inf"} 1', metrics)
+
+    @override_settings(METRICS_TOKEN = 'scrape-me')
+    def test_metrics_need_the_token_or_staff(self):
+        url = reverse('metrics')
+        # Coming from localhost, through a proxy, is no longer enough
+        self.assertEqual(self.client.get(url, REMOTE_ADDR = '127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION = 'Bearer wrong').status_code, 404)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION = 'Bearer scrape-me').status_code, 200)
+
+        self.client.force_login(User.objects.create(username = 'player'))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(User.objects.create(username = 'admin', is_staff = True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_an_empty_token_lets_nobody_in(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION = 'Bearer ').status_code, 404)
+
+class TemplateTimerTests(SimpleTestCase):
+    def test_rendering_is_only_wrapped_once_the_middleware_is_used(self):
+        # A fresh process that loads every view, but leaves the middleware out of its settings
+        script = ("import django; django.setup(); import elo.urls; from django.template.backends.django import Template; "
+                  "print(getattr(Template.render, '_elo_timed', False))")
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE = 'elo.settings')
+        output = subprocess.run([sys.executable, '-c', script], cwd = settings.BASE_DIR, env = env, capture_output = True, text = True, check = True)
+        self.assertEqual(output.stdout.strip(), 'False')
+
+        RequestMetricsMiddleware(lambda request: None)
+        render = Template.render
+        RequestMetricsMiddleware(lambda request: None)
+        self.assertTrue(render._elo_timed)
+        self.assertIs(Template.render, render)
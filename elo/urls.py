@@ -10,6 +10,8 @@ urlpatterns = [
     url(r'^$',          ladder.views.index,                             name='index'),
     url(r'^l/',         include(('ladder.urls', 'ladder'),              namespace = 'ladder')),
     url(r'^u/',         include(('usercontrol.urls', 'usercontrol'),    namespace = 'user')),
+    url(r'^api/',       include(('ladder.api_urls', 'api'),             namespace = 'api')),
     url(r'^logout/$',   elo.views.logout_view,                          name='logout'),
+    url(r'^metrics/$',  elo.views.metrics,                              name='metrics'),
     url(r'^admin/',     admin.site.urls,                                name='admin'),
 ]
\ No newline at end of file
@@ -1,40 +1,31 @@
-﻿from django.conf import settings
+﻿import hmac
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import logout
+from django.http import Http404, HttpResponse
 from django.http.response import HttpResponseRedirect
-from django.shortcuts import render
-from django.template import RequestContext
-
-from itertools import chain
 
 from django.urls.base import reverse
 
-from ladder.models import Game, Match, Rank, Ladder, Challenge
-
-def index(request):
-
-    game_list = Game.objects.all()
+from elo.metrics import registry
 
-    match_list = Match.objects.all().order_by('-date_complete')
-
-    rank_list = Rank.objects.all()
-
-    ladder_list = Ladder.objects.all()
+def logout_view(request):
+    logout(request)
+    messages.success(request, "You have been signed out!")
+    return HttpResponseRedirect(reverse('index'))
 
-    try:
-        challenger_list = Challenge.objects.filter(match__challenger = request.user, accepted=False)
-    except Exception:
-        challenger_list = []
-    try:
-        challengee_list = Challenge.objects.filter(match__challengee = request.user, accepted=False)
-    except Exception:
-        challengee_list = []
+def _metrics_allowed(request):
+    """Staff who are signed in, or a scraper sending the METRICS_TOKEN as a bearer token."""
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
 
-    your_challenges = list(chain(challenger_list, challengee_list))
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    scheme, _space, sent = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(token) and scheme.lower() == 'bearer' and hmac.compare_digest(sent.strip().encode(), token.encode())
 
-    return render(request, 'home.html', {'game_list':game_list, 'match_list':match_list, 'rank_list':rank_list, 'ladder_list':ladder_list, 'your_challenges':your_challenges}, context_instance=RequestContext(request))
+def metrics(request):
+    """Request metrics collected by RequestMetricsMiddleware, in the Prometheus text format. Hidden from everyone else."""
+    if not _metrics_allowed(request):
+        raise Http404
 
-def logout_view(request):
-    logout(request)
-    messages.success(request, "You have been signed out!")
-    return HttpResponseRedirect(reverse('index'))
\ No newline at end of file
+    return HttpResponse(registry.render(), content_type = 'text/plain; version=0.0.4; charset=utf-8')
\ No newline at end of file
@@ -1,46 +1,103 @@
+import json
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
-from elo.models import UserProfile
-from ladder.models import Match, Rank, Game, Challenge, Ladder
+from ladder.models import Match, Rank, Rating, Game, Challenge, Ladder
+
+ESTIMATED_COUNT_THRESHOLD = 100000    # Below this many (estimated) rows the changelist still counts them exactly
+
+class EstimatedCountPaginator( Paginator ) :
+    """Paginates using the query planner's row estimate on PostgreSQL instead of a COUNT over the whole table.
+
+        The estimate is only used for large results, where the exact number doesn't matter and counting
+        means reading every row. Other databases, and small results, are counted as usual.
+    """
+    @cached_property
+    def count( self ) :
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' :
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor :
+                cursor.execute( "EXPLAIN (FORMAT JSON) " + sql, params )
+                plan = cursor.fetchone()[0]
+            if isinstance( plan, str ) :
+                plan = json.loads( plan )
+            estimate = int( plan[0]['Plan']['Plan Rows'] )
+            if estimate >= ESTIMATED_COUNT_THRESHOLD :
+                return estimate
+
+        return super( EstimatedCountPaginator, self ).count
 
 class RankInline( admin.TabularInline ) :
     model = Rank
     verbose_name_plural = "rankings"
     ordering = ('rank',)
     fields = ('rank','player','arrow')
+    # A <select> of every user on every row doesn't scale, look the player up instead
+    autocomplete_fields = ('player',)
+
+    def get_queryset( self, request ) :
+        return super( RankInline, self ).get_queryset( request ).select_related( 'player__userprofile' )
 
 class LadderAdmin( admin.ModelAdmin ) :
     inlines = [RankInline]
-    list_display = ('__str__','created','end_date','players')
+    list_display = ('__str__','created','end_date','player_count','last_match_at')
+    list_select_related = ('game',)
+    search_fields = ('name__startswith',)
+    autocomplete_fields = ('owner',)
 
 class MatchAdmin(admin.ModelAdmin):
     list_display = ('date_challenged', 'ladder', 'challenger_name', 'challengee_name', 'winner_name')
     list_filter = ['date_challenged']
-    search_fields = ['challenger', 'challengee']
+    list_select_related = ('ladder__game', 'challenger__userprofile', 'challengee__userprofile', 'winner__userprofile')
+    # Exact usernames, so the search is answered from the username index
+    search_fields = ['challenger__username__exact', 'challengee__username__exact']
+    autocomplete_fields = ('ladder', 'challenger', 'challengee', 'winner')
+    raw_id_fields = ('related_challenge',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def _handle(self, user):
+        return user.userprofile.handle if user is not None else None
 
     def challenger_name(self, obj):
-        up = UserProfile.objects.get(user=obj.challenger)
-        return up.handle
+        return self._handle(obj.challenger)
 
     def challengee_name(self, obj):
-        up = UserProfile.objects.get(user=obj.challengee)
-        return up.handle
+        return self._handle(obj.challengee)
 
     def winner_name(self, obj):
-        up = UserProfile.objects.get(user=obj.winner)
-        return up.handle
+        return self._handle(obj.winner)
 
 class RankAdmin(admin.ModelAdmin):
     ordering = ('ladder', 'rank')
+    list_select_related = ('player__userprofile',)
+    autocomplete_fields = ('ladder', 'player')
+
+class RatingAdmin(admin.ModelAdmin):
+    list_display = ('player', 'ladder', 'rating', 'matches')
+    list_filter = ['ladder']
+    list_select_related = ('player', 'ladder__game')
+    autocomplete_fields = ('ladder', 'player')
+    ordering = ('ladder', '-rating')
 
 class GameAdmin(admin.ModelAdmin):
     readonly_fields=('slug',)
 
 class ChallengeAdmin(admin.ModelAdmin):
     fields = ('ladder', 'challenger', 'challengee', 'date_issued', 'deadline', 'accepted', 'note')
+    list_select_related = ('challenger', 'challengee')
+    search_fields = ['challenger__username__exact', 'challengee__username__exact']
+    autocomplete_fields = ('ladder', 'challenger', 'challengee')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 admin.site.register(Match, MatchAdmin)
 admin.site.register(Rank, RankAdmin)
+admin.site.register(Rating, RatingAdmin)
 admin.site.register(Game, GameAdmin)
 admin.site.register(Ladder, LadderAdmin)
-admin.site.register(Challenge, ChallengeAdmin)
\ No newline at end of file
+admin.site.register(Challenge, ChallengeAdmin)
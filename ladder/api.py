@@ -0,0 +1,162 @@
+# coding=UTF-8
+"""Read-only JSON views of a ladder for bots and stream overlays.
+
+    Every response is tagged with the ladder's cache version, which moves on whenever its ranks,
+    challenges or matches change. A conditional request for an unchanged ladder is answered from
+    the cache with a 304, without touching the database.
+"""
+import json
+from django.contrib.auth.models import User
+from django.db.models import OuterRef, Q
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, quote_etag
+from django.views.decorators.http import require_safe
+from ladder.cache import _forget_ladder_slug, _get_cached_api_response, _get_cached_ladder_id, _get_ladder_version, _set_cached_api_response, _set_cached_ladder_id
+from ladder.helpers import _count_subquery, _get_ladder_standings, _get_standings_at
+from ladder.history import _last_change, _parse_when
+from ladder.models import Ladder, Match, Rank, Rating
+from ladder.series import RANK_SERIES_MAX_POINTS, RANK_SERIES_POINTS, rank_series
+
+API_RECENT_MATCHES  = 25    # How many of the ladder's latest matches are returned
+API_PLAYER_MATCHES  = 10    # How many of a player's latest matches on the ladder are returned
+
+_ARROWS = {Rank.ARROW_UP: 'up', Rank.ARROW_DOWN: 'down'}
+
+def _date(value):
+    return value.isoformat() if value is not None else None
+
+def _player(user):
+    if user is None:
+        return None
+    return {'username': user.username, 'handle': user.userprofile.handle}
+
+def _ladder_summary(ladder):
+    return {'name': ladder.name, 'slug': ladder.slug, 'game': ladder.game.name if ladder.game else None,
+            'players': ladder.player_count, 'last_match': _date(ladder.last_match_at)}
+
+def _match_summary(match):
+    return {'id': match.pk, 'date': _date(match.date_complete), 'forfeit': match.forfeit,
+            'challenger': _player(match.challenger), 'challenger_rank': match.challenger_rank,
+            'challengee': _player(match.challengee), 'challengee_rank': match.challengee_rank,
+            'winner': _player(match.winner)}
+
+def _recent_matches(ladder):
+    matches = Match.objects.filter(ladder = ladder, date_complete__isnull = False).order_by('-date_complete', '-id')
+    return matches.select_related('challenger__userprofile', 'challengee__userprofile', 'winner__userprofile')
+
+def _standings(ladder, when = None):
+    standings = _get_ladder_standings(ladder) if when is None else _get_standings_at(ladder, when)
+    return {'ladder': _ladder_summary(ladder), 'at': _date(_last_change(ladder.pk, when)) if when is not None else None,
+            'standings': [dict(_player(rank.player), rank = rank.rank, arrow = _ARROWS.get(rank.arrow), busy = busy)
+                          for rank, busy in standings]}
+
+def _matches(ladder):
+    return {'ladder': _ladder_summary(ladder), 'matches': [_match_summary(m) for m in _recent_matches(ladder)[:API_RECENT_MATCHES]]}
+
+def _player_summary(ladder, username):
+    # The player with their results on this ladder counted in the same query
+    user = get_object_or_404(User.objects.select_related('userprofile').annotate(
+        wins   = _count_subquery(Match.objects.filter(ladder = ladder, winner = OuterRef('pk'))),
+        losses = _count_subquery(Match.objects.filter(Q(challenger = OuterRef('pk')) | Q(challengee = OuterRef('pk')), ladder = ladder, winner__isnull = False).exclude(winner = OuterRef('pk'))),
+    ), username = username)
+    rank   = Rank.objects.filter(ladder = ladder, player = user).first()
+    rating = Rating.objects.filter(ladder = ladder, player = user).first()
+    matches = _recent_matches(ladder).filter(Q(challenger = user) | Q(challengee = user))[:API_PLAYER_MATCHES]
+
+    return {'ladder': _ladder_summary(ladder),
+            'player': dict(_player(user), rank = rank.rank if rank else None, arrow = _ARROWS.get(rank.arrow) if rank else None,
+                           rating = round(rating.rating, 1) if rating else None, wins = user.wins, losses = user.losses),
+            'matches': [_match_summary(m) for m in matches]}
+
+def _player_history(ladder, username, points):
+    user = get_object_or_404(User.objects.select_related('userprofile'), username = username)
+    return {'ladder': _ladder_summary(ladder), 'player': _player(user),
+            'history': [[_date(when), rank] for when, rank in rank_series(ladder.pk, user.pk, points)]}
+
+def _ladder_resource(request, ladder_slug, resource, build):
+    """Serves `build(ladder)` as JSON, tagged with an ETag from the ladder's version.
+
+        The ladder's id and the rendered body are cached under `resource`, or the name `resource(ladder id)`
+        returns, so a conditional request for a ladder that hasn't changed costs a few cache reads and no queries.
+        There is no Last-Modified: opening or answering a challenge changes a ladder without leaving a time
+        on it, so only the ETag says for certain whether a response is still current.
+    """
+    ladder = None
+    ladder_id = _get_cached_ladder_id(ladder_slug)
+    if ladder_id is None:
+        ladder = get_object_or_404(Ladder.objects.select_related('game'), slug = ladder_slug)
+        ladder_id = ladder.pk
+        _set_cached_ladder_id(ladder_slug, ladder_id)
+
+    if callable(resource):
+        resource = resource(ladder_id)
+
+    # Read the version before the data, a change made while building moves it on and the next request rebuilds
+    version = _get_ladder_version(ladder_id)
+    etag    = quote_etag("{0}-{1}".format(ladder_id, version))
+    body    = _get_cached_api_response(ladder_id, version, resource)
+
+    if body is None:
+        not_modified = get_conditional_response(request, etag = etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+
+        if ladder is None:
+            # Renaming or deleting a ladder moves its version on, so only a stale slug ends up here
+            ladder = Ladder.objects.select_related('game').filter(pk = ladder_id, slug = ladder_slug).first()
+            if ladder is None:
+                _forget_ladder_slug(ladder_slug)
+                raise Http404("No such ladder")
+
+        body = json.dumps(build(ladder), separators = (',', ':'))
+        _set_cached_api_response(ladder_id, version, resource, body)
+
+    response = get_conditional_response(request, etag = etag)
+    if response is None:
+        response = HttpResponse(body, content_type = 'application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@require_safe
+def standings(request, ladder_slug):
+    """Every ranked player on the ladder, in rank order. With ?at=<ISO 8601 date> the standings as they were then.
+
+        Every date between two changes to the ladder shares one cached response, named after the
+        last change (returned as `at`), so the dates asked for can't grow the cache past its history.
+    """
+    if not request.GET.get('at'):
+        return _ladder_resource(request, ladder_slug, 'standings', _standings)
+
+    when = _parse_when(request.GET['at'])
+    if when is None:
+        return HttpResponseBadRequest("at must be an ISO 8601 date or datetime", content_type = 'text/plain')
+    return _ladder_resource(request, ladder_slug, lambda ladder_id: "standings:{0}".format(_date(_last_change(ladder_id, when)) or 'start'),
+                            lambda ladder: _standings(ladder, when))
+
+@require_safe
+def matches(request, ladder_slug):
+    """The ladder's latest completed matches, newest first."""
+    return _ladder_resource(request, ladder_slug, 'matches', _matches)
+
+@require_safe
+def player(request, ladder_slug, username):
+    """A player's rank, rating, record and latest matches on the ladder."""
+    return _ladder_resource(request, ladder_slug, "player:{0}".format(username), lambda ladder: _player_summary(ladder, username))
+
+@require_safe
+def player_history(request, ladder_slug, username):
+    """A player's rank over time on the ladder as [date, rank] pairs, a rank of null where they left it.
+
+        Long histories are downsampled to ?points= (default RANK_SERIES_POINTS) for charting.
+    """
+    try:
+        points = int(request.GET.get('points', RANK_SERIES_POINTS))
+    except ValueError:
+        points = 0
+    if not 2 <= points <= RANK_SERIES_MAX_POINTS:
+        return HttpResponseBadRequest("points must be a number from 2 to {0}".format(RANK_SERIES_MAX_POINTS), content_type = 'text/plain')
+
+    return _ladder_resource(request, ladder_slug, "history:{0}:{1}".format(username, points), lambda ladder: _player_history(ladder, username, points))
@@ -0,0 +1,11 @@
+﻿from django.conf.urls import include, url
+import ladder.api
+
+urlpatterns = [
+    url(r'^ladders/(?P<ladder_slug>[-\w]+)/', include([
+        url(r'^standings/$',                                ladder.api.standings,       name='standings'),
+        url(r'^matches/$',                                  ladder.api.matches,         name='matches'),
+        url(r'^players/(?P<username>[\w.@+-]+)/$',          ladder.api.player,          name='player'),
+        url(r'^players/(?P<username>[\w.@+-]+)/history/$',  ladder.api.player_history,  name='player_history'),
+    ])),
+]
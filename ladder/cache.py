@@ -0,0 +1,128 @@
+# coding=UTF-8
+import time
+from django.core.cache import cache
+from django.db import transaction
+
+STANDINGS_CACHE_TIMEOUT = 60 * 60     # How long (in seconds) a ladder's cached standings are kept
+HOME_FEED_CACHE_TIMEOUT = 10 * 60     # How long (in seconds) the home page feed is kept, it also shows profiles which aren't tracked
+API_CACHE_TIMEOUT       = 60 * 60     # How long (in seconds) a rendered API response is kept for its ladder version
+RANK_SERIES_TIMEOUT     = 60 * 60     # How long (in seconds) a player's downsampled rank history is kept for its ladder version
+
+HOME_FEED_VERSION_KEY   = "home:version"
+
+def _ladder_version_key(ladder_id):
+    return "ladder:{0}:version".format(ladder_id)
+
+def _ladder_standings_key(ladder_id, version):
+    return "ladder:{0}:standings:{1}".format(ladder_id, version)
+
+def _ladder_slug_key(ladder_slug):
+    return "ladder:slug:{0}".format(ladder_slug)
+
+def _api_response_key(ladder_id, version, resource):
+    return "ladder:{0}:api:{1}:{2}".format(ladder_id, version, resource)
+
+def _rank_series_key(ladder_id, version, player_id, points):
+    return "ladder:{0}:rank_series:{1}:{2}:{3}".format(ladder_id, version, player_id, points)
+
+def _new_ladder_version():
+    """Versions start from the clock, so a counter that was evicted never comes back with a number already used."""
+    return int(time.time() * 1000)
+
+def _get_version(key):
+    """Returns the version counter stored under key, creating it if it doesn't exist yet."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_ladder_version(), None)
+        version = cache.get(key)
+
+    return version
+
+def _incr_version(key):
+    """Moves the counter stored under key on by one and returns (old version, new version)."""
+    old_version = cache.get(key)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        # The counter was never created or has been evicted, start a new one.
+        version = _new_ladder_version()
+        cache.set(key, version, None)
+
+    return old_version, version
+
+def _get_ladder_version(ladder_id):
+    """Returns the current version of a ladder's standings, creating the counter if it doesn't exist yet."""
+    return _get_version(_ladder_version_key(ladder_id))
+
+def _bump_ladder_version(ladder_id):
+    """Moves a ladder on to a new version and evicts the standings cached under the old one."""
+    old_version, version = _incr_version(_ladder_version_key(ladder_id))
+
+    if old_version is not None:
+        cache.delete(_ladder_standings_key(ladder_id, old_version))
+
+    return version
+
+def _ladder_changed(ladder_id):
+    """Bumps the ladder's version once the current transaction commits.
+
+        Bumping any earlier would let another request cache the old standings under the new version.
+    """
+    if ladder_id is None:
+        return
+
+    transaction.on_commit(lambda: _bump_ladder_version(ladder_id))
+
+def _get_cached_standings(ladder_id):
+    """Returns (version, standings) for the ladder, standings is None when nothing is cached for the current version."""
+    version = _get_ladder_version(ladder_id)
+    return version, cache.get(_ladder_standings_key(ladder_id, version))
+
+def _set_cached_standings(ladder_id, version, standings):
+    cache.set(_ladder_standings_key(ladder_id, version), standings, STANDINGS_CACHE_TIMEOUT)
+
+def _home_feed_key(version):
+    return "home:feed:{0}".format(version)
+
+def _bump_home_feed_version():
+    old_version, version = _incr_version(HOME_FEED_VERSION_KEY)
+
+    if old_version is not None:
+        cache.delete(_home_feed_key(old_version))
+
+    return version
+
+def _home_feed_changed():
+    """Moves the home page feed on to a new version once the current transaction commits."""
+    transaction.on_commit(_bump_home_feed_version)
+
+def _get_cached_home_feed():
+    """Returns (version, feed) for the home page, feed is None when nothing is cached for the current version."""
+    version = _get_version(HOME_FEED_VERSION_KEY)
+    return version, cache.get(_home_feed_key(version))
+
+def _set_cached_home_feed(version, feed):
+    cache.set(_home_feed_key(version), feed, HOME_FEED_CACHE_TIMEOUT)
+
+def _get_cached_ladder_id(ladder_slug):
+    return cache.get(_ladder_slug_key(ladder_slug))
+
+def _set_cached_ladder_id(ladder_slug, ladder_id):
+    cache.set(_ladder_slug_key(ladder_slug), ladder_id, None)
+
+def _forget_ladder_slug(ladder_slug):
+    cache.delete(_ladder_slug_key(ladder_slug))
+
+def _get_cached_api_response(ladder_id, version, resource):
+    """Returns the body rendered for the resource at this ladder version, or None."""
+    return cache.get(_api_response_key(ladder_id, version, resource))
+
+def _set_cached_api_response(ladder_id, version, resource, body):
+    cache.set(_api_response_key(ladder_id, version, resource), body, API_CACHE_TIMEOUT)
+
+def _get_cached_rank_series(ladder_id, version, player_id, points):
+    """Returns the player's downsampled rank history at this ladder version, or None."""
+    return cache.get(_rank_series_key(ladder_id, version, player_id, points))
+
+def _set_cached_rank_series(ladder_id, version, player_id, points, series):
+    cache.set(_rank_series_key(ladder_id, version, player_id, points), series, RANK_SERIES_TIMEOUT)
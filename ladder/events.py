@@ -0,0 +1,187 @@
+# coding=UTF-8
+"""Live ladder events, pushed to browsers over Server-Sent Events.
+
+    Rank changes are published once their transaction commits and fanned out to every open stream
+    for the ladder. Each event carries only what changed, clients apply it to the standings they have:
+
+        match   {"match": id, "ranks": [[player, rank, arrow], ...]}
+                The winner and loser's new rank and arrow.
+        leave   {"player": id, "rank": rank}
+                The player left, everyone ranked below moves up one and the new last place gets an up arrow.
+        resync  {}
+                Many ranks changed at once, or the stream fell behind and dropped events,
+                the client should reload the standings.
+"""
+import asyncio
+import json
+import threading
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER          = 'ladder.events.LocalBroker'
+SUBSCRIBER_QUEUE_SIZE   = 100      # Events held for a slow client before it is told to resync instead
+KEEPALIVE_INTERVAL      = 15.0     # Seconds between comments sent on an idle stream, so proxies don't close it
+RECONNECT_DELAY         = 5000     # Milliseconds a client waits before reconnecting a dropped stream
+POLL_RECONNECT_DELAY    = 30000    # Milliseconds between reconnects when served without ASGI, where streams can't be held open
+
+def _ladder_channel(ladder_id):
+    return "ladder:{0}".format(ladder_id)
+
+def _sse_frame(event_type, data):
+    """Encodes an event the way an EventSource reads it."""
+    return "event: {0}\ndata: {1}\n\n".format(event_type, json.dumps(data, separators = (',', ':'))).encode('utf-8')
+
+RESYNC_FRAME    = _sse_frame('resync', {})
+KEEPALIVE_FRAME = b": keepalive\n\n"
+
+class Subscription(object):
+    """One stream's view of a channel, read with `await subscription.get()` on the loop that subscribed."""
+    def __init__(self, broker, channel):
+        self.broker  = broker
+        self.channel = channel
+        self.loop    = asyncio.get_running_loop()
+        self.queue   = asyncio.Queue(maxsize = SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, frame):
+        """Queues a frame, called on the subscriber's loop. A client too slow to keep up is sent a resync instead."""
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_FRAME)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class Broker(object):
+    """Fans published frames out to the subscribers of a channel.
+
+        publish() may be called from any thread, subscribe() from the event loop serving the stream.
+    """
+    def publish(self, channel, frame):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+class LocalBroker(Broker):
+    """Delivers frames to the subscribers in this process.
+
+        An idle subscriber is a small queue waiting on the event loop, so one process can hold thousands.
+        Publishers in other processes won't reach them, deployments running more than one process
+        need a broker shared between them.
+    """
+    def __init__(self):
+        self.lock        = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, channel, frame):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, frame)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+    def subscriber_count(self, channel):
+        with self.lock:
+            return len(self.subscribers.get(channel, ()))
+
+_broker      = None
+_broker_lock = threading.Lock()
+
+def get_broker():
+    """Returns the broker named by the LADDER_EVENTS_BROKER setting, created on first use."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'LADDER_EVENTS_BROKER', DEFAULT_BROKER))()
+        return _broker
+
+def _reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'LADDER_EVENTS_BROKER':
+        with _broker_lock:
+            _broker = None
+
+setting_changed.connect(_reset_broker)
+
+def _ladder_event(ladder_id, event_type, data):
+    """Publishes an event to the ladder's streams once the current transaction commits."""
+    if ladder_id is None:
+        return
+
+    frame = _sse_frame(event_type, data)
+    transaction.on_commit(lambda: get_broker().publish(_ladder_channel(ladder_id), frame))
+
+def _get_ladder_id(ladder_slug):
+    from ladder.models import Ladder
+    return Ladder.objects.filter(slug = ladder_slug).values_list('id', flat = True).first()
+
+async def _send_response(send, status, content_type, body, more_body = False):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', content_type), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+    await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def ladder_events_stream(scope, receive, send, ladder_slug):
+    """ASGI application streaming a ladder's events until the client goes away.
+
+        Django 3.2 iterates streaming responses synchronously, which would tie up the event loop,
+        so elo.asgi routes the ladder events URL here instead of through Django.
+    """
+    ladder_id = await sync_to_async(_get_ladder_id)(ladder_slug)
+    if ladder_id is None:
+        await _send_response(send, 404, b'text/plain; charset=utf-8', b'No such ladder')
+        return
+
+    subscription = get_broker().subscribe(_ladder_channel(ladder_id))
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    next_frame   = None
+    try:
+        await _send_response(send, 200, b'text/event-stream', "retry: {0}\n\n".format(RECONNECT_DELAY).encode('ascii'), more_body = True)
+
+        while True:
+            if next_frame is None:
+                next_frame = asyncio.ensure_future(subscription.get())
+
+            done, _pending = await asyncio.wait((next_frame, disconnected), timeout = KEEPALIVE_INTERVAL, return_when = asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                break
+
+            if next_frame in done:
+                frame, next_frame = next_frame.result(), None
+            else:
+                frame = KEEPALIVE_FRAME
+            await send({'type': 'http.response.body', 'body': frame, 'more_body': True})
+    finally:
+        subscription.close()
+        for task in (next_frame, disconnected):
+            if task is not None:
+                task.cancel()
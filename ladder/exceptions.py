@@ -11,9 +11,15 @@ class ChallengeeOutOfRange( ChallengeValidationError ) :
 class ParticipantBusy( ChallengeValidationError ) :
     pass
 
+class ChallengeOnCooldown( ChallengeValidationError ) :
+    pass
+
 class PlayerNotInvolved( ChallengeValidationError ) :
     pass
 
 class PlayerNotRanked( ChallengeValidationError ) :
     pass
 
+class ChallengeStatusConflict( ChallengeValidationError ) :
+    pass
+
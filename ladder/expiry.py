@@ -0,0 +1,131 @@
+# coding=UTF-8
+import datetime
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils.timezone import utc
+from ladder.cache import _home_feed_changed, _ladder_changed
+from ladder.events import _ladder_event
+from ladder.models import Challenge, Ladder, Match, Rank, RankHistory, Rating, _elo_exchange, _match_result_ranks
+
+def _lock_overdue_challenges(now, batch_size):
+    """Returns up to batch_size overdue, unanswered challenges, oldest deadline first, locked for this transaction.
+
+        Other workers skip the locked rows instead of waiting on them, where the database supports it.
+    """
+    overdue = Challenge.objects.filter( accepted = Challenge.STATUS_NOT_ACCEPTED, deadline__lt = now ).order_by( 'deadline', 'id' )
+    if connection.features.has_select_for_update_skip_locked :
+        overdue = overdue.select_for_update( skip_locked = True )
+
+    return list( overdue.only( 'id', 'ladder_id', 'challenger_id', 'challengee_id' )[:batch_size] )
+
+def _forfeit_ranks(challenges):
+    """Applies each forfeit to the players' ranks, in deadline order, and returns the Ranks that moved,
+        plus a dict of each challenge's (challenger rank, challengee rank) before its forfeit.
+    """
+    ladder_ids = set( c.ladder_id for c in challenges )
+    player_ids = set( p for c in challenges for p in (c.challenger_id, c.challengee_id) )
+
+    ranks = Rank.objects.select_for_update().filter( ladder_id__in = ladder_ids, player_id__in = player_ids ).order_by( 'ladder_id', 'player_id' )
+    ranks = dict( ((r.ladder_id, r.player_id), r) for r in ranks.only( 'id', 'ladder_id', 'player_id', 'rank', 'arrow' ) )
+    rankings = dict( Rank.objects.filter( ladder_id__in = ladder_ids ).order_by().values_list( 'ladder_id' ).annotate( Count( 'id' ) ) )
+
+    before = {}
+    moved = {}
+    for challenge in challenges :
+        winner = ranks.get( (challenge.ladder_id, challenge.challenger_id) )
+        loser  = ranks.get( (challenge.ladder_id, challenge.challengee_id) )
+        before[challenge.pk] = ( (winner.rank, winner.arrow) if winner else (None, None), (loser.rank, loser.arrow) if loser else (None, None) )
+
+        # Someone who is no longer ranked can't move
+        if winner is None or loser is None :
+            continue
+
+        winner.rank, winner.arrow, loser.rank, loser.arrow = _match_result_ranks( winner.rank, loser.rank, rankings[challenge.ladder_id] )
+        moved[winner.pk] = winner
+        moved[loser.pk] = loser
+
+    return list( moved.values() ), before
+
+def _forfeit_matches(challenges, before, now):
+    """Builds the Match recording each forfeit, the same as Challenge._record_forfeit would."""
+    matches = []
+    for challenge in challenges :
+        challenger_rank, challengee_rank = before[challenge.pk]
+        winner_rank = None
+        if challenger_rank[0] is not None and challengee_rank[0] is not None :
+            winner_rank = min( challenger_rank[0], challengee_rank[0] )
+
+        matches.append( Match( ladder_id = challenge.ladder_id, related_challenge_id = challenge.pk, forfeit = True,
+                               date_challenged = now, date_complete = now,
+                               challenger_id = challenge.challenger_id, challenger_rank = challenger_rank[0], challenger_rank_icon = challenger_rank[1],
+                               challengee_id = challenge.challengee_id, challengee_rank = challengee_rank[0], challengee_rank_icon = challengee_rank[1],
+                               winner_id = challenge.challenger_id, winner_rank = winner_rank, winner_rank_icon = Rank.ARROW_UP ) )
+    return matches
+
+def _forfeit_ratings(challenges):
+    """Exchanges rating points for each forfeit, in deadline order, and returns the Ratings to write."""
+    pairs = [(c.ladder_id, c.challenger_id, c.challengee_id) for c in challenges if c.challenger_id is not None and c.challengee_id is not None]
+    if not pairs :
+        return []
+
+    ladder_ids = set( ladder_id for ladder_id, _a, _b in pairs )
+    player_ids = set( p for _ladder_id, a, b in pairs for p in (a, b) )
+    wanted     = set( (ladder_id, p) for ladder_id, a, b in pairs for p in (a, b) )
+
+    def load_ratings():
+        ratings = Rating.objects.select_for_update().filter( ladder_id__in = ladder_ids, player_id__in = player_ids )
+        return dict( ((r.ladder_id, r.player_id), r) for r in ratings if (r.ladder_id, r.player_id) in wanted )
+
+    # A player's first match on the ladder gives them their starting rating.
+    ratings = load_ratings()
+    if len( ratings ) < len( wanted ) :
+        Rating.objects.bulk_create( [Rating( ladder_id = ladder_id, player_id = p ) for ladder_id, p in wanted - set( ratings )], ignore_conflicts = True )
+        ratings = load_ratings()
+
+    for ladder_id, challenger_id, challengee_id in pairs :
+        winner = ratings[(ladder_id, challenger_id)]
+        loser  = ratings[(ladder_id, challengee_id)]
+        points = _elo_exchange( winner.rating, loser.rating )
+        winner.rating  += points
+        winner.matches += 1
+        loser.rating   -= points
+        loser.matches  += 1
+
+    return list( ratings.values() )
+
+def expire_overdue_challenges(batch_size = 1000, now = None):
+    """Forfeits one batch of unanswered challenges whose deadline has passed to their challengers.
+
+        Does in bulk what Challenge.forfeit() and the Match signals do one challenge at a time: the
+        status change, the Match rows, the rank swaps with their RankHistory and the rating exchange,
+        each written with a handful of statements per batch. Returns the number of challenges expired.
+    """
+    if now is None :
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    with transaction.atomic():
+        challenges = _lock_overdue_challenges( now, batch_size )
+        if not challenges :
+            return 0
+
+        # Only move challenges that are still unanswered. Anything answered since it was read
+        # (possible on databases without row locks) is left for the player's own action.
+        ids = [c.pk for c in challenges]
+        if Challenge.objects.filter( pk__in = ids, accepted = Challenge.STATUS_NOT_ACCEPTED ).update( accepted = Challenge.STATUS_FORFEIT ) != len(ids) :
+            claimed = set( Challenge.objects.filter( pk__in = ids, accepted = Challenge.STATUS_FORFEIT, match__isnull = True ).values_list( 'id', flat = True ) )
+            challenges = [c for c in challenges if c.pk in claimed]
+
+        moved_ranks, before = _forfeit_ranks( challenges )
+        Match.objects.bulk_create( _forfeit_matches( challenges, before, now ) )
+        Rank.objects.bulk_update( moved_ranks, ['rank', 'arrow'] )
+        RankHistory.objects.bulk_create( [RankHistory( ladder_id = r.ladder_id, player_id = r.player_id, rank = r.rank, recorded_at = now ) for r in moved_ranks] )
+        Rating.objects.bulk_update( _forfeit_ratings( challenges ), ['rating', 'matches'] )
+
+        ladder_ids = set( c.ladder_id for c in challenges if c.ladder_id is not None )
+        Ladder.objects.filter( Q( last_match_at__isnull = True ) | Q( last_match_at__lt = now ), pk__in = ladder_ids ).update( last_match_at = now )
+        for ladder_id in ladder_ids :
+            _ladder_changed( ladder_id )
+            _ladder_event( ladder_id, 'resync', {} )
+        _home_feed_changed()
+
+    return len( challenges )
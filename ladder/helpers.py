@@ -1,8 +1,30 @@
 # coding=UTF-8
-from django.db.models import Q
-from ladder.models import Challenge, Rank
+from django.contrib.auth.models import User
+from django.db.models import F, Func, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from ladder.cache import _get_cached_home_feed, _get_cached_standings, _set_cached_home_feed, _set_cached_standings
+from ladder.history import standings_at
+from ladder.models import Challenge, Ladder, Match, Rank, _cooldown_challenges
 from math import ceil
 
+HOME_RECENT_MATCHES = 25    # How many matches to show under the "Recent Matches" header on the home page
+
+def _count_subquery(queryset):
+    """Wraps a filtered queryset (usually correlated with OuterRef) as a subquery returning its row count."""
+    return Coalesce( Subquery( queryset.order_by().annotate( c = Func( F( 'pk' ), function = 'COUNT' ) ).values( 'c' )[:1] ), 0 )
+
+def _repair_ladder_counters(ladders = None):
+    """Recomputes the stored player_count and last_match_at of the ladders (all of them by default) in one UPDATE.
+
+        Returns the number of ladders updated.
+    """
+    if ladders is None:
+        ladders = Ladder.objects.all()
+
+    last_match = Match.objects.filter( ladder = OuterRef('pk'), date_complete__isnull = False ).order_by( '-date_complete' ).values( 'date_complete' )[:1]
+
+    return ladders.update( player_count = _count_subquery( Rank.objects.filter( ladder = OuterRef('pk') ) ), last_match_at = Subquery( last_match ) )
+
 def _open_challenges_exist(user, ladder):
     """Returns True if there are challenges open in the provided ladder for the user."""
 
@@ -13,37 +35,84 @@ def _open_challenges_exist(user, ladder):
     else:
         return False
 
-def _get_valid_targets(user, user_rank, allTargets, ladder):
-    """Takes a Rank QueryObject and returns a list of challengable ranks in the ladder.
+def _get_busy_players(ladder):
+    """Returns a set of the ids of every player with an open challenge in the provided ladder."""
+
+    open_challenges = Challenge.objects.filter( Q(ladder = ladder) & (Q(accepted = Challenge.STATUS_ACCEPTED) | Q(accepted = Challenge.STATUS_NOT_ACCEPTED)) )
+
+    busy_players = set()
+    for challenger_id, challengee_id in open_challenges.values_list('challenger_id', 'challengee_id'):
+        busy_players.add(challenger_id)
+        busy_players.add(challengee_id)
+
+    return busy_players
+
+def _get_ladder_standings(ladder):
+    """Returns a list of (Rank, busy) tuples for every player on the ladder, ordered by rank.
+
+        The player and their profile are loaded along with each Rank, so building the list costs
+        two queries no matter how many players are ranked. The result is cached until the ladder's
+        version changes, so repeat views don't touch the database at all.
+    """
+    version, standings = _get_cached_standings(ladder.pk)
+    if standings is not None:
+        return standings
+
+    rank_list = Rank.objects.filter(ladder = ladder).select_related('player__userprofile').order_by('rank')
+    rank_list = rank_list.only('rank', 'arrow', 'ladder_id', 'player__username', 'player__userprofile__handle', 'player__userprofile__avatar')
+    busy_players = _get_busy_players(ladder)
+
+    standings = [(r, r.player_id in busy_players) for r in rank_list]
+    _set_cached_standings(ladder.pk, version, standings)
+
+    return standings
+
+def _get_standings_at(ladder, when):
+    """Returns the ladder's standings at `when` like _get_ladder_standings does, a list of (Rank, busy) tuples.
+
+        The Ranks are rebuilt from the ladder's history and not saved, nobody is busy in the past.
+    """
+    standings = standings_at(ladder, when)
+    players = User.objects.select_related('userprofile').only('username', 'userprofile__handle', 'userprofile__avatar').in_bulk([p for p, _arrow in standings])
+
+    return [(Rank(ladder = ladder, player = players[player_id], rank = i + 1, arrow = arrow), False)
+            for i, (player_id, arrow) in enumerate(standings) if player_id in players]
+
+def _get_home_feed():
+    """Returns a dict with the ladder_list and match_list shown on the home page.
+
+        Only what is rendered is read: the ladders with their games, and the latest completed matches
+        with their ladders, players and profiles. The feed is shared by every visitor and cached until
+        a match completes or a ladder or game changes.
+    """
+    version, feed = _get_cached_home_feed()
+    if feed is not None:
+        return feed
+
+    ladder_list = list(Ladder.objects.select_related('game').only('name', 'slug', 'game__name', 'game__abv'))
+    match_list  = Match.objects.filter(date_complete__isnull = False).order_by('-date_complete', '-id')
+    match_list  = list(match_list.select_related('ladder__game', 'challenger__userprofile', 'challengee__userprofile', 'winner__userprofile')[:HOME_RECENT_MATCHES])
+
+    feed = {'ladder_list': ladder_list, 'match_list': match_list}
+    _set_cached_home_feed(version, feed)
+
+    return feed
+
+def _get_valid_targets(user, state, ladder):
+    """Takes the ladder's LadderState and returns a list of the ranks the user can challenge on it.
 
         You are allowed to challenge if:
             - User is on the ladder. (checked beforehand)
             - User has no open challenges in this ladder.
             - User's (/w ▲) target is within current rank - UPARROW range.
             - User's (/w ▼) target is within current rank + DNARROW range.
-            - User has not challenged target since TIMEOUT time has passed. *NOT IMPLEMENTED
+            - User has not challenged target within the ladder's challenge_cooldown.
     """
-    # list of ranks player can challenge
-    challengables = []
-
-    # Get user's arrow and rank
-    user_arrow = user_rank.arrow
-    user_nrank = user_rank.rank
-
-    # get the constraints for this ladder
-    up_distance = ladder.up_arrow
-    dn_distance = ladder.down_arrow
-
-    # Get the range of ranks to search between
-    if user_arrow == Rank.ARROW_UP :
-        r_range = (user_nrank - up_distance, user_nrank - 1)
-    elif user_arrow == Rank.ARROW_DOWN :
-        r_range = (user_nrank + 1, user_nrank + dn_distance)
-    else :
-        raise ValueError( 'Rank.arrow can be either "0" (Up Arrow) or "1" (Down Arrow), but was "{}"'.format( user_arrow ) )
-
-    # Get all ranks on the ladder within our target range
-    for target_rank in Rank.objects.filter(ladder = ladder,rank__range = r_range) :
-        challengables.append(target_rank.rank)
-
-    return challengables
\ No newline at end of file
+    # The ranks within reach of the user's arrow, read straight off the state without walking the ladder
+    in_range = state.target_ranks(user.pk, ladder.up_arrow, ladder.down_arrow)
+
+    # Players the user challenged too recently, a single indexed lookup of the user's own recent challenges
+    recent_challenges = _cooldown_challenges( user, ladder )
+    cooling_down = set() if recent_challenges is None else set( recent_challenges.values_list( 'challengee_id', flat = True ) )
+
+    return [rank for rank in in_range if state.players[rank - 1] not in cooling_down]
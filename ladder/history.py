@@ -0,0 +1,231 @@
+# coding=UTF-8
+"""Rebuilds a ladder's standings as they were at any date.
+
+    Matches move ranks, and the few changes a match can't explain (players joining and leaving,
+    a rank edited by hand, the weekly arrow reset) are recorded as small StandingsEvents. The standings at a date are the
+    nearest earlier checkpoint with the matches and events since then played over it, using the
+    same rules as adjust_rank and del_user_rank_adjustment, or everything since the ladder started
+    if there is no checkpoint that old. Reading never writes: checkpoint_standings cuts a checkpoint
+    every CHECKPOINT_INTERVAL changes, so no date is more than that many changes from one.
+
+    Ladders from before events were recorded start from a seed checkpoint. Dates before a seed are
+    rebuilt backwards from it instead, undoing each match with the ranks and arrows it recorded
+    for its players.
+"""
+import datetime
+import heapq
+from django.db import transaction
+from django.db.models import Subquery
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware, utc
+from ladder.models import Ladder, Match, Rank, StandingsCheckpoint, StandingsEvent, _decode_standings, _encode_standings, _take_standings_checkpoint
+from ladder.state import _DOWN, _UP, LadderState
+
+CHECKPOINT_INTERVAL = 250   # Most matches and events replayed to rebuild the standings at any date
+
+class _Standings(LadderState):
+    """A LadderState moved by one change at a time, see _changes()."""
+    def play_result(self, result):
+        """Applies a result the way adjust_rank does, someone who wasn't ranked yet joins at the bottom first."""
+        _date, challenger_id, _cr, _ci, challengee_id, _er, _ei, winner_id = result
+        if challenger_id is None or challengee_id is None or winner_id not in (challenger_id, challengee_id):
+            return
+
+        for player_id in (challenger_id, challengee_id):
+            if player_id not in self:
+                self.append(player_id)
+
+        self.play(winner_id, challengee_id if winner_id == challenger_id else challenger_id)
+
+    def play_event(self, event):
+        """Applies a join at the bottom, a leave, a rank edited by hand or an arrow reset. Anything the standings already show is skipped."""
+        _date, kind, player_id, rank, arrow = event
+        if kind == StandingsEvent.KIND_JOIN and player_id not in self:
+            self.append(player_id)
+        elif kind == StandingsEvent.KIND_LEAVE and player_id in self:
+            self.remove(player_id)
+        elif kind == StandingsEvent.KIND_MOVE and rank is not None:
+            self.move(player_id, rank, arrow)
+        elif kind == StandingsEvent.KIND_RESET:
+            self.down = bytearray(len(self.players))
+
+    def move(self, player_id, rank, arrow):
+        """Puts the player on `rank` with `arrow`, the players from there down to where they were shift along one."""
+        position = self.positions.get(player_id)
+        if position is not None:
+            del self.players[position]
+            del self.down[position]
+
+        position = min(rank, len(self.players) + 1) - 1
+        self.players.insert(position, player_id)
+        self.down.insert(position, _DOWN if arrow == Rank.ARROW_DOWN else _UP)
+        self._positions = None
+
+    def play_change(self, change):
+        _date, is_result, row = change
+        if is_result:
+            self.play_result(row)
+        else:
+            self.play_event(row)
+
+    def undo_result(self, result):
+        """Puts both players of a result back on the ranks and arrows the Match recorded for them going in."""
+        _date, challenger_id, challenger_rank, challenger_icon, challengee_id, challengee_rank, challengee_icon, _winner_id = result
+        if None in (challenger_id, challengee_id, challenger_rank, challengee_rank):
+            return
+
+        # A match only ever swaps its two players, anything else means a rank was edited by hand since
+        now = set(self.positions.get(player_id) for player_id in (challenger_id, challengee_id))
+        if now != set((challenger_rank - 1, challengee_rank - 1)):
+            return
+
+        self.place(challenger_id, challenger_rank, challenger_icon or self.arrow(challenger_id))
+        self.place(challengee_id, challengee_rank, challengee_icon or self.arrow(challengee_id))
+
+def _between(queryset, field, after, until):
+    if after is not None:
+        queryset = queryset.filter(**{field + '__gt': after})
+    if until is not None:
+        queryset = queryset.filter(**{field + '__lte': until})
+    return queryset
+
+def _results(ladder_id, after = None, until = None, newest_first = False):
+    """Completed results on the ladder in the order they were played, or reversed, with what play() and undo() need."""
+    results = _between(Match.objects.filter(ladder_id = ladder_id, winner__isnull = False, date_complete__isnull = False), 'date_complete', after, until)
+
+    order = ('-date_complete', '-id') if newest_first else ('date_complete', 'id')
+    return results.order_by(*order).values_list('date_complete', 'challenger_id', 'challenger_rank', 'challenger_rank_icon',
+                                                'challengee_id', 'challengee_rank', 'challengee_rank_icon', 'winner_id').iterator()
+
+def _events(ladder_id, after = None, until = None):
+    """The ladder's joins, leaves, moves and resets in the order they happened, as (date, kind, player id, rank, arrow)."""
+    events = _between(StandingsEvent.objects.filter(ladder_id = ladder_id), 'happened_at', after, until)
+    return events.order_by('happened_at', 'id').values_list('happened_at', 'kind', 'player_id', 'rank', 'arrow').iterator()
+
+def _changes(ladder_id, after = None, until = None):
+    """Results and events merged in the order they happened as (date, is result, row), events first at the same moment."""
+    results = ((result[0], True, result) for result in _results(ladder_id, after, until))
+    events = ((event[0], False, event) for event in _events(ladder_id, after, until))
+    return heapq.merge(events, results, key = lambda change: change[:2])
+
+def _checkpoint(ladder_id, when, standings, seed = False):
+    return StandingsCheckpoint(ladder_id = ladder_id, taken_at = when, standings = _encode_standings(standings.packed()), seed = seed)
+
+def _replay(ladder_id, standings, changes, checkpoints = None):
+    """Plays changes forward over the standings, collecting a checkpoint into `checkpoints` (if given) every CHECKPOINT_INTERVAL.
+
+        A checkpoint is only cut between changes made at different times, so replaying from it
+        (everything after its date) never skips or repeats one.
+    """
+    since = 0
+    previous = None
+    for change in changes:
+        if checkpoints is not None and previous is not None and since >= CHECKPOINT_INTERVAL and change[0] > previous[0]:
+            checkpoints.append(_checkpoint(ladder_id, previous[0], standings))
+            since = 0
+        standings.play_change(change)
+        previous = change
+        since += 1
+
+def _rewind(ladder_id, standings, results, checkpoints = None):
+    """Undoes results newest first over the standings, collecting a seed checkpoint into `checkpoints` (if given) every CHECKPOINT_INTERVAL."""
+    since = 0
+    previous = None
+    for result in results:
+        # Everything newer than this result has been undone, so this is how the ladder stood once it was played
+        if checkpoints is not None and previous is not None and since >= CHECKPOINT_INTERVAL and result[0] < previous[0]:
+            checkpoints.append(_checkpoint(ladder_id, result[0], standings, seed = True))
+            since = 0
+        standings.undo_result(result)
+        previous = result
+        since += 1
+
+def standings_at(ladder, when):
+    """Returns the ladder's standings at `when`, a list of (player id, arrow) in rank order. Only reads.
+
+        Costs one checkpoint read and at most CHECKPOINT_INTERVAL replayed changes once checkpoint_standings
+        has been through the ladder's history.
+    """
+    checkpoint = StandingsCheckpoint.objects.filter(ladder = ladder, taken_at__lte = when).order_by('-taken_at').first()
+    if checkpoint is not None:
+        standings = _Standings(ladder.pk, _decode_standings(checkpoint.standings))
+        _replay(ladder.pk, standings, _changes(ladder.pk, after = checkpoint.taken_at, until = when))
+        return standings.packed()
+
+    first = StandingsCheckpoint.objects.filter(ladder = ladder).order_by('taken_at').first()
+    if first is None and not StandingsEvent.objects.filter(ladder = ladder).exists():
+        # Players were ranked without any record of it, the standings right now are all there is to go back from
+        standings = _Standings.load(ladder.pk)
+        _rewind(ladder.pk, standings, _results(ladder.pk, after = when, newest_first = True))
+    elif first is not None and first.seed:
+        standings = _Standings(ladder.pk, _decode_standings(first.standings))
+        _rewind(ladder.pk, standings, _results(ladder.pk, after = when, until = first.taken_at, newest_first = True))
+    else:
+        # Everything that happened to the ladder was recorded, play it from the start
+        standings = _Standings(ladder.pk)
+        _replay(ladder.pk, standings, _changes(ladder.pk, until = when))
+
+    return standings.packed()
+
+def _last_change(ladder_id, when):
+    """The time of the ladder's last result, event or checkpoint at or before `when`, or None if there wasn't one yet.
+
+        Its standings at `when` are the same as they were then, so this is a stable name for them.
+    """
+    def latest(queryset, field):
+        return Subquery(queryset.filter(**{field + '__lte': when}).order_by('-' + field).values(field)[:1])
+
+    moments = Ladder.objects.filter(pk = ladder_id).annotate(
+        result     = latest(Match.objects.filter(ladder_id = ladder_id, winner__isnull = False), 'date_complete'),
+        event      = latest(StandingsEvent.objects.filter(ladder_id = ladder_id), 'happened_at'),
+        checkpoint = latest(StandingsCheckpoint.objects.filter(ladder_id = ladder_id), 'taken_at'),
+    ).values_list('result', 'event', 'checkpoint').first()
+
+    return max((moment for moment in moments or () if moment is not None), default = None)
+
+def fill_checkpoints(ladder, full = False):
+    """Checkpoints the ladder's history every CHECKPOINT_INTERVAL changes, so every date rebuilds from a nearby checkpoint.
+
+        Walks the changes after the latest checkpoint, or every stretch between checkpoints with
+        `full`, and undoes the matches from before a seed. Returns the number saved.
+    """
+    checkpoints = []
+    with transaction.atomic():
+        stored = list(StandingsCheckpoint.objects.filter(ladder = ladder).order_by('taken_at').values_list('taken_at', 'standings', 'seed'))
+        if not stored and not StandingsEvent.objects.filter(ladder = ladder).exists():
+            # Ranked without any record of it, seed the history with the standings right now
+            first = _take_standings_checkpoint(ladder.pk, seed = True)
+            stored = [(first.taken_at, first.standings, True)]
+            checkpoints_taken = 1
+        else:
+            checkpoints_taken = 0
+
+        if stored and stored[0][2]:
+            # Everything before the seed, undone from it
+            _rewind(ladder.pk, _Standings(ladder.pk, _decode_standings(stored[0][1])), _results(ladder.pk, until = stored[0][0], newest_first = True), checkpoints)
+        else:
+            # Everything before the first checkpoint, played from the start
+            _replay(ladder.pk, _Standings(ladder.pk), _changes(ladder.pk, until = stored[0][0] if stored else None), checkpoints)
+
+        # Every stretch after a checkpoint, replayed from the checkpoint it starts at
+        stretches = list(zip(stored, [taken_at for taken_at, _standings, _seed in stored[1:]] + [None]))
+        for (taken_at, packed, _seed), following in (stretches if full else stretches[-1:]):
+            _replay(ladder.pk, _Standings(ladder.pk, _decode_standings(packed)), _changes(ladder.pk, after = taken_at, until = following), checkpoints)
+
+        StandingsCheckpoint.objects.bulk_create(checkpoints)
+
+    return checkpoints_taken + len(checkpoints)
+
+def _parse_when(value):
+    """Reads the ?at= parameter, an ISO 8601 date (the end of that day) or datetime, in UTC. Returns None if it isn't one."""
+    try:
+        when = parse_datetime(value)
+        if when is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            when = datetime.datetime(day.year, day.month, day.day) + datetime.timedelta(days = 1, microseconds = -1)
+    except ValueError:
+        return None
+
+    return make_aware(when, utc) if is_naive(when) else when.astimezone(utc)
@@ -0,0 +1,207 @@
+# coding=UTF-8
+import csv
+import datetime
+import json
+from itertools import islice
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware, utc
+from ladder.cache import _home_feed_changed, _ladder_changed
+from ladder.events import _ladder_event
+from ladder.helpers import _repair_ladder_counters
+from ladder.history import CHECKPOINT_INTERVAL
+from ladder.models import Ladder, Match, Rank, RankHistory, StandingsCheckpoint, StandingsEvent, _encode_standings
+from ladder.ratings import replay_ladder_ratings
+from ladder.state import LadderState
+
+IMPORT_CHUNK_SIZE   = 5000      # Results read, and Matches written, at a time
+
+_TRUE_VALUES        = ('1', 'true', 'yes', 'y')
+
+def _read_csv(stream):
+    """Yields (line number, row dict) for each result in a CSV file with a date,challenger,challengee,winner[,forfeit] header."""
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+def _read_ndjson(stream):
+    """Yields (line number, row dict) for each result in a file with one JSON object per line."""
+    for line_num, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                raise ValueError("line {0}: {1}".format(line_num, e))
+
+def _parse_result_date(value):
+    """Reads an ISO 8601 date or datetime, naive values are taken to be UTC."""
+    value = str(value or '').strip()
+    when = parse_datetime(value)
+    if when is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError("'{0}' is not an ISO 8601 date".format(value))
+        when = datetime.datetime(day.year, day.month, day.day)
+
+    return make_aware(when, utc) if is_naive(when) else when.astimezone(utc)
+
+class _StandingsReplay(object):
+    """The ladder's standings held in a LadderState, moved by each result with the same rules as adjust_rank.
+
+        Only the players are kept, one entry each, so memory doesn't grow with the number of results.
+        The standings are checkpointed as of the imported dates every CHECKPOINT_INTERVAL results, and
+        players who join through a result are recorded as joining then.
+    """
+    def __init__(self, ladder):
+        self.ladder   = ladder
+        self.state    = LadderState.load(ladder.pk)
+        self.history  = []      # RankHistory for the results played since the last flush
+        self.events   = []      # StandingsEvents for the players who joined since the last flush
+        self.checkpoints = []   # StandingsCheckpoints cut since the last flush
+        self.since    = 0       # Results played since the last checkpoint
+        self.last_played = ladder.last_match_at
+
+    def start(self, when):
+        """Checkpoints the standings the import starts from just before its first result, played at `when`.
+
+            Raises ValueError if players joined, left or were moved on the ladder from then on, the
+            imported results would have to be played in between and that history would be lost.
+        """
+        started = when - datetime.timedelta(microseconds = 1)
+        later = StandingsEvent.objects.filter(ladder = self.ladder, happened_at__gte = started).order_by('happened_at').values_list('happened_at', flat = True).first()
+        if later is not None:
+            raise ValueError("the ladder's standings changed on {0}, results can only be imported from after that".format(later.isoformat()))
+
+        # With no results or events since, any later checkpoint holds these same standings
+        StandingsCheckpoint.objects.filter(ladder = self.ladder, taken_at__gte = started).delete()
+
+        # With nothing older left to play them from, these standings seed the ladder's history
+        older = StandingsCheckpoint.objects.filter(ladder = self.ladder).exists() or StandingsEvent.objects.filter(ladder = self.ladder).exists()
+        self.checkpoint(started, seed = len(self.state) > 0 and not older)
+
+    def checkpoint(self, when, seed = False):
+        self.checkpoints.append(StandingsCheckpoint(ladder = self.ladder, taken_at = when, standings = _encode_standings(self.state.packed()), seed = seed))
+        self.since = 0
+
+    def _rank(self, player_id, when):
+        """The player's rank and arrow, players who haven't joined the ladder yet join at the bottom at `when`, like join_ladder."""
+        if player_id not in self.state:
+            rank = self.state.append(player_id)
+            self.events.append(StandingsEvent(ladder = self.ladder, kind = StandingsEvent.KIND_JOIN, player_id = player_id, rank = rank, happened_at = when))
+            self.history.append(RankHistory(ladder = self.ladder, player_id = player_id, rank = rank, recorded_at = when))
+        return self.state.rank(player_id), self.state.arrow(player_id)
+
+    def play(self, when, challenger_id, challengee_id, winner_id, forfeit):
+        """Applies one result and returns its Match, recorded with the ranks both players had going into it."""
+        # Cut between results played at different times, so replaying from the checkpoint doesn't repeat any
+        if self.since >= CHECKPOINT_INTERVAL and when > self.last_played:
+            self.checkpoint(self.last_played)
+
+        challenger_rank, challenger_arrow = self._rank(challenger_id, when)
+        challengee_rank, challengee_arrow = self._rank(challengee_id, when)
+        loser_id = challengee_id if winner_id == challenger_id else challenger_id
+
+        match = Match(ladder = self.ladder, forfeit = forfeit, date_challenged = when, date_complete = when,
+                      challenger_id = challenger_id, challenger_rank = challenger_rank, challenger_rank_icon = challenger_arrow,
+                      challengee_id = challengee_id, challengee_rank = challengee_rank, challengee_rank_icon = challengee_arrow,
+                      winner_id = winner_id, winner_rank = min(challenger_rank, challengee_rank), winner_rank_icon = Rank.ARROW_UP)
+
+        winner_rank, _winner_arrow, loser_rank, _loser_arrow = self.state.play(winner_id, loser_id)
+        self.history.append(RankHistory(ladder = self.ladder, player_id = winner_id, rank = winner_rank, recorded_at = when))
+        self.history.append(RankHistory(ladder = self.ladder, player_id = loser_id, rank = loser_rank, recorded_at = when))
+        self.last_played = when
+        self.since += 1
+        return match
+
+    def flush(self):
+        """Writes the rank history, joins and checkpoints collected since the last flush."""
+        RankHistory.objects.bulk_create(self.history)
+        StandingsEvent.objects.bulk_create(self.events)
+        StandingsCheckpoint.objects.bulk_create(self.checkpoints)
+        self.history = []
+        self.events = []
+        self.checkpoints = []
+
+    def save(self):
+        """Checkpoints and writes the final standings, only the players who moved or joined. Returns how many joined."""
+        if self.since:
+            self.checkpoint(self.last_played)
+        self.flush()
+
+        joined = len(self.state.joined)
+        self.state.flush()
+        return joined
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def import_match_results(ladder, rows, chunk_size = IMPORT_CHUNK_SIZE):
+    """Records a history of results on the ladder and replays their rank changes, without the per-match signals.
+
+        `rows` yields (line number, dict) with the date, the challenger, challengee and winner's usernames
+        and optionally forfeit, in the order they were played and newer than the ladder's latest match,
+        join or leave.
+        Results are read and their Matches written a chunk at a time, the standings are written once at
+        the end and the ratings rebuilt from the whole history. The standings the import starts from are
+        taken to be how the ladder stood just before its first result. Everything is rolled back if any
+        row is invalid, the ValueError names its line. Returns (matches imported, players who joined).
+    """
+    usernames = {}
+    imported  = 0
+
+    with transaction.atomic():
+        # Hold the ladder so no result is recorded in between
+        ladder = Ladder.objects.select_for_update().get(pk = ladder.pk)
+        replay = _StandingsReplay(ladder)
+
+        for chunk in _chunks(rows, chunk_size):
+            # Resolve the chunk's new usernames together, each player is only looked up once
+            wanted = set(row.get(field) for _line, row in chunk for field in ('challenger', 'challengee')) - set(usernames)
+            if wanted:
+                usernames.update(User.objects.filter(username__in = wanted).values_list('username', 'id'))
+
+            matches = []
+            for line_num, row in chunk:
+                try:
+                    when = _parse_result_date(row.get('date'))
+                    challenger_id = usernames.get(row.get('challenger'))
+                    challengee_id = usernames.get(row.get('challengee'))
+                    if challenger_id is None or challengee_id is None:
+                        raise ValueError("unknown player '{0}'".format(row.get('challenger') if challenger_id is None else row.get('challengee')))
+                    if challenger_id == challengee_id:
+                        raise ValueError("a player can't play against themself")
+                    if row.get('winner') not in (row.get('challenger'), row.get('challengee')):
+                        raise ValueError("the winner '{0}' didn't play in the match".format(row.get('winner')))
+                    if ladder.last_match_at is not None and when <= ladder.last_match_at:
+                        raise ValueError("results must be newer than the ladder's latest match, {0} isn't after {1}".format(when.isoformat(), ladder.last_match_at.isoformat()))
+                    if replay.last_played is not None and when < replay.last_played:
+                        raise ValueError("results must be in the order they were played, {0} comes after {1}".format(when.isoformat(), replay.last_played.isoformat()))
+                    if not imported and not matches:
+                        replay.start(when)
+                except ValueError as e:
+                    raise ValueError("line {0}: {1}".format(line_num, e))
+
+                winner_id = challenger_id if row.get('winner') == row.get('challenger') else challengee_id
+                forfeit = str(row.get('forfeit') or '').strip().lower() in _TRUE_VALUES
+                matches.append(replay.play(when, challenger_id, challengee_id, winner_id, forfeit))
+
+            Match.objects.bulk_create(matches)
+            replay.flush()
+            imported += len(matches)
+
+        joined = replay.save()
+
+        # bulk_create and the batched updates skip the signals that keep the counters, ratings and caches
+        _repair_ladder_counters(Ladder.objects.filter(pk = ladder.pk))
+        replay_ladder_ratings(ladder)
+        _ladder_changed(ladder.pk)
+        _ladder_event(ladder.pk, 'resync', {})
+        _home_feed_changed()
+
+    return imported, joined
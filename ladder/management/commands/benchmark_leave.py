@@ -0,0 +1,41 @@
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ladder.models import Ladder, Rank
+
+class Command(BaseCommand):
+    help = "Times a player leaving the top of ladders of increasing size, on a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,5000', help="Comma separated ladder sizes to time.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of leaves to time at each size.")
+
+    def _make_ladder(self, size):
+        ladder = Ladder.objects.create(name = "Benchmark {0}".format(size))
+        User.objects.bulk_create([User(username = "bench-{0}-{1}".format(size, i)) for i in range(size)])
+        users = User.objects.filter(username__startswith = "bench-{0}-".format(size)).order_by('id')
+        Rank.objects.bulk_create([Rank(ladder = ladder, player = user, rank = i + 1, arrow = Rank.ARROW_UP) for i, user in enumerate(users)], batch_size = 1000)
+        return ladder
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity = 0, autoclobber = True, serialize = False)
+        try:
+            self.stdout.write("{0:>8}  {1:>10}  {2:>10}".format("players", "median ms", "max ms"))
+            for size in sizes:
+                ladder = self._make_ladder(size)
+
+                timings = []
+                for _ in range(options['repeat']):
+                    top_rank = Rank.objects.get(ladder = ladder, rank = 1)
+                    started = time.perf_counter()
+                    top_rank.delete()
+                    timings.append((time.perf_counter() - started) * 1000)
+
+                self.stdout.write("{0:>8}  {1:>10.2f}  {2:>10.2f}".format(size, statistics.median(timings), max(timings)))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity = 0)
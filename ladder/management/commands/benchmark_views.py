@@ -0,0 +1,132 @@
+import datetime
+import json
+import statistics
+import subprocess
+import time
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from ladder.models import Challenge, Ladder, Match
+
+class Command(BaseCommand):
+    help = "Times the main pages through the test client against generated data of several sizes, on a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100:3:50:500,1000:10:200:5000',
+                            help="Comma separated data sizes to time, each as users:ladders:players:matches (players and matches are per ladder).")
+        parser.add_argument('--repeat', type=int, default=10, help="Number of requests to time for each page at each size.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the generated data.")
+        parser.add_argument('--output', default='benchmark-views.json', help="File the JSON results are written to, - for stdout.")
+
+    def _parse_sizes(self, sizes):
+        parsed = []
+        for size in sizes.split(','):
+            try:
+                users, ladders, players, matches = [int(part) for part in size.split(':')]
+            except ValueError:
+                raise CommandError("Sizes look like users:ladders:players:matches, got '{0}'".format(size))
+            parsed.append({'users': users, 'ladders': ladders, 'players': players, 'matches': matches})
+        return parsed
+
+    def _commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr = subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _pages(self, size):
+        """Picks a generated ladder, its most recent challenger and a player with a pending challenge, and returns the pages to time."""
+        ladder = Ladder.objects.filter(name__startswith = "{0} ".format(size['prefix'])).order_by('id').first()
+        match = Match.objects.filter(ladder = ladder).order_by('-date_complete').first()
+        player = match.challenger if match else User.objects.filter(username__startswith = "{0}-".format(size['prefix'])).first()
+        open_challenge = Challenge.objects.filter(ladder = ladder, accepted = Challenge.STATUS_NOT_ACCEPTED).select_related('challengee').first()
+        messaged = open_challenge.challengee if open_challenge else player
+
+        return [
+            ('index',                 reverse('index'),                                         None),
+            ('single_ladder_details', reverse('ladder:detail', args = [ladder.slug]),           None),
+            ('ladder_match_list',     reverse('ladder:match_list', args = [ladder.slug]),       None),
+            ('profile',               reverse('user:profile', args = [player.username]),        None),
+            ('user_match_list',       reverse('user:match_list', args = [player.username]),     None),
+            ('message_challenges',    reverse('user:message_challenges'),                       messaged),
+        ]
+
+    def _time_page(self, url, user, repeat):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+
+        # The first request runs against an empty cache, the rest show the steady state.
+        cache.clear()
+        timings = []
+        for _ in range(repeat + 1):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                try:
+                    response = client.get(url)
+                except Exception as e:
+                    return {'url': url, 'error': "{0}: {1}".format(type(e).__name__, e)}
+                timings.append((time.perf_counter() - started) * 1000)
+
+            if response.status_code != 200:
+                return {'url': url, 'error': "status {0}".format(response.status_code)}
+
+        warm = timings[1:] or timings
+        return {
+            'url': url,
+            'queries': len(queries),
+            'cold_ms': round(timings[0], 3),
+            'median_ms': round(statistics.median(warm), 3),
+            'p95_ms': round(sorted(warm)[int(0.95 * (len(warm) - 1))], 3),
+            'max_ms': round(max(warm), 3),
+        }
+
+    def handle(self, *args, **options):
+        sizes = self._parse_sizes(options['sizes'])
+        results = {
+            'commit': self._commit(),
+            'date': datetime.datetime.utcnow().isoformat() + 'Z',
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'sizes': [],
+        }
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity = 0, autoclobber = True, serialize = False)
+        try:
+            self.stdout.write("{0:>24}  {1:<22}  {2:>7}  {3:>10}  {4:>10}  {5:>10}".format("size", "page", "queries", "cold ms", "median ms", "p95 ms"))
+            for i, size in enumerate(sizes):
+                size['prefix'] = "size{0}".format(i)
+                label = "{users}:{ladders}:{players}:{matches}".format(**size)
+                call_command('generate_ladder_data', prefix = size['prefix'], seed = options['seed'],
+                             users = size['users'], ladders = size['ladders'], players = size['players'], matches = size['matches'],
+                             stdout = self.stdout)
+
+                pages = {}
+                for name, url, user in self._pages(size):
+                    pages[name] = self._time_page(url, user, options['repeat'])
+                    page = pages[name]
+                    if 'error' in page:
+                        self.stdout.write("{0:>24}  {1:<22}  {2}".format(label, name, page['error']))
+                    else:
+                        self.stdout.write("{0:>24}  {1:<22}  {2:>7}  {3:>10.2f}  {4:>10.2f}  {5:>10.2f}".format(
+                            label, name, page['queries'], page['cold_ms'], page['median_ms'], page['p95_ms']))
+
+                results['sizes'].append(dict(size, label = label, pages = pages))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity = 0)
+            teardown_test_environment()
+
+        output = json.dumps(results, indent = 2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+            self.stdout.write("Wrote results to {0}".format(options['output']))
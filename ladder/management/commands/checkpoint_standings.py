@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from ladder.history import fill_checkpoints
+from ladder.models import Ladder
+
+class Command(BaseCommand):
+    help = "Checkpoints the standings through the history of ladders, so any date can be rebuilt from a nearby checkpoint. Run it regularly, reading old standings never saves one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_slugs', nargs='*', help="Slugs of the ladders to checkpoint, defaults to every ladder.")
+        parser.add_argument('--full', action='store_true', help="Walk every stretch between checkpoints, not only the changes since the latest one.")
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.all()
+        if options['ladder_slugs']:
+            ladders = ladders.filter(slug__in = options['ladder_slugs'])
+            missing = set(options['ladder_slugs']) - set(ladders.values_list('slug', flat = True))
+            if missing:
+                raise CommandError("Unknown ladders: {0}".format(", ".join(sorted(missing))))
+
+        total = 0
+        for ladder in ladders.order_by('id'):
+            saved = fill_checkpoints(ladder, full = options['full'])
+            total += saved
+            if options['verbosity'] > 1:
+                self.stdout.write("  {0}: {1} checkpoints".format(ladder.slug, saved))
+
+        self.stdout.write("Saved {0} checkpoint{1}".format(total, "" if total == 1 else "s"))
@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from ladder.expiry import expire_overdue_challenges
+
+class Command(BaseCommand):
+    help = "Forfeits unanswered challenges whose deadline has passed to their challengers, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Challenges expired per transaction.")
+        parser.add_argument('--loop', action='store_true', help="Keep running, checking for overdue challenges every --interval seconds.")
+        parser.add_argument('--interval', type=float, default=60.0, help="Seconds to wait between checks in --loop mode once nothing is overdue.")
+
+    def _report(self, expired, batches, batch_times):
+        elapsed = sum(batch_times)
+        rate = expired / elapsed if elapsed else 0.0
+        slowest = max(batch_times) * 1000 if batch_times else 0.0
+        self.stdout.write("Expired {0} challenges in {1} batches, {2:.2f}s ({3:.0f}/s, slowest batch {4:.1f}ms)".format(expired, batches, elapsed, rate, slowest))
+
+    def _drain(self, batch_size):
+        """Expires batches until nothing is overdue, returns (expired, batch times)."""
+        expired = 0
+        batch_times = []
+        while True:
+            started = time.perf_counter()
+            count = expire_overdue_challenges(batch_size)
+            if not count:
+                return expired, batch_times
+            batch_times.append(time.perf_counter() - started)
+            expired += count
+            if self.verbosity > 1:
+                self.stdout.write("  batch {0}: {1} challenges in {2:.1f}ms".format(len(batch_times), count, batch_times[-1] * 1000))
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+
+        while True:
+            expired, batch_times = self._drain(options['batch_size'])
+            if expired or not options['loop']:
+                self._report(expired, len(batch_times), batch_times)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,213 @@
+import datetime
+import random
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.timezone import utc
+from elo.models import UserProfile
+from ladder.helpers import _repair_ladder_counters
+from ladder.history import CHECKPOINT_INTERVAL
+from ladder.models import Challenge, Game, Ladder, Match, Rank, RankHistory, StandingsCheckpoint, StandingsEvent, _encode_standings, _match_result_ranks
+from ladder.ratings import replay_ladder_ratings
+
+CHUNK_SIZE = 5000           # Rows written per bulk_create
+FORFEIT_CHANCE = 0.05       # Chance that a generated challenge was forfeit instead of played
+
+class _IdAllocator(object):
+    """Hands out primary keys ahead of bulk_create, so rows can point at each other before they're written."""
+    def __init__(self, model):
+        self.next_id = (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+    def __call__(self):
+        allocated = self.next_id
+        self.next_id += 1
+        return allocated
+
+class _ChunkedWriter(object):
+    def __init__(self, model):
+        self.model = model
+        self.pending = []
+        self.written = 0
+
+    def add(self, obj):
+        self.pending.append(obj)
+        if len(self.pending) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.model.objects.bulk_create(self.pending)
+            self.written += len(self.pending)
+            self.pending = []
+
+class Command(BaseCommand):
+    help = "Fills the database with users, ladders and a long, valid challenge/match history for load testing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Number of users to create.")
+        parser.add_argument('--ladders', type=int, default=10, help="Number of ladders to create.")
+        parser.add_argument('--players', type=int, default=200, help="Players ranked on each ladder (at most --users).")
+        parser.add_argument('--matches', type=int, default=5000, help="Completed matches to play on each ladder.")
+        parser.add_argument('--open', type=int, default=10, help="Challenges left open (pending or accepted) on each ladder.")
+        parser.add_argument('--prefix', default='bench', help="Prefix for the generated usernames and ladder names.")
+        parser.add_argument('--seed', type=int, default=None, help="Seed for the random generator, for repeatable data.")
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError("--users must be at least 2")
+
+        with transaction.atomic():
+            self._start(options['seed'])
+            users = self._create_users(options['prefix'], options['users'])
+            game, _created = Game.objects.get_or_create(name = "Benchmark", defaults = {'abv': 'BENCH'})
+
+            ladders = []
+            for i in range(options['ladders']):
+                ladder = Ladder.objects.create(name = "{0} Ladder {1}".format(options['prefix'], i), game = game)
+                # Reload the ladder so the numeric fields aren't left as their string defaults
+                ladder = Ladder.objects.get(pk = ladder.pk)
+                players = self.rng.sample(users, min(options['players'], len(users)))
+                self._play_history(ladder, players, options['matches'], options['open'])
+                ladders.append(ladder)
+
+            for writer in (self.challenges, self.matches, self.history, self.events, self.checkpoints):
+                writer.flush()
+
+            # bulk_create skips the signals that keep the ladders' counters
+            _repair_ladder_counters(Ladder.objects.filter(pk__in = [ladder.pk for ladder in ladders]))
+
+            # The ids were handed out by hand, so move the sequences past them.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, UserProfile, Challenge, Match]):
+                    cursor.execute(sql)
+
+        for ladder in ladders:
+            replay_ladder_ratings(ladder)
+
+        self.stdout.write("Created {0} users, {1} ladders, {2} challenges and {3} matches".format(
+            len(users), len(ladders), self.challenges.written, self.matches.written))
+
+    def _start(self, seed):
+        """Sets up the random generator, the id allocators and the writers the ladders' histories go through."""
+        self.rng = random.Random(seed)
+        self.now = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+        self.challenge_ids = _IdAllocator(Challenge)
+        self.match_ids = _IdAllocator(Match)
+        self.challenges = _ChunkedWriter(Challenge)
+        self.matches = _ChunkedWriter(Match)
+        self.history = _ChunkedWriter(RankHistory)
+        self.events = _ChunkedWriter(StandingsEvent)
+        self.checkpoints = _ChunkedWriter(StandingsCheckpoint)
+
+    def _create_users(self, prefix, count):
+        user_ids = _IdAllocator(User)
+        profile_ids = _IdAllocator(UserProfile)
+
+        users = [User(pk = user_ids(), username = "{0}-{1}".format(prefix, i), password = '!') for i in range(count)]
+        User.objects.bulk_create(users, batch_size = CHUNK_SIZE)
+
+        # bulk_create skips the post_save signal that normally creates the profile
+        UserProfile.objects.bulk_create([UserProfile(pk = profile_ids(), user = user, handle = user.username) for user in users], batch_size = CHUNK_SIZE)
+
+        return [user.pk for user in users]
+
+    def _checkpoint(self, ladder, when, standings, arrows):
+        self.checkpoints.add(StandingsCheckpoint(ladder = ladder, taken_at = when, standings = _encode_standings([(p, arrows[p]) for p in standings])))
+
+    def _play_history(self, ladder, players, matches, open_challenges):
+        """Plays `matches` challenges on the ladder with the same range and swap rules as the site, then writes the final ranks.
+
+            The players all join when the history starts. Their joins, every rank change and a checkpoint
+            every CHECKPOINT_INTERVAL matches are recorded as of the generated dates, as the site would have.
+        """
+        size = len(players)
+        standings = list(players)
+        arrows = dict((player, Rank.ARROW_UP) for player in players)
+        skill = dict((player, self.rng.gauss(1500, 200)) for player in players)
+
+        # Everyone starts on an up arrow, without an up range nobody could ever challenge
+        if int(ladder.up_arrow) < 1 and matches:
+            self.stderr.write("{0} has no up arrow range, leaving it without matches".format(ladder.name))
+            matches = 0
+
+        when = self.now - datetime.timedelta(hours = matches + 1)
+        for i, player in enumerate(standings):
+            self.events.add(StandingsEvent(ladder = ladder, kind = StandingsEvent.KIND_JOIN, player_id = player, happened_at = when))
+            self.history.add(RankHistory(ladder = ladder, player_id = player, rank = i + 1, recorded_at = when))
+        self._checkpoint(ladder, when, standings, arrows)
+
+        played = 0
+        while played < matches and size > 1:
+            position = self.rng.randrange(size)
+            challenger = standings[position]
+            targets = self._targets(ladder, position, arrows[challenger], size)
+            if not targets:
+                continue
+            target = self.rng.choice(targets)
+            challengee = standings[target]
+
+            when += datetime.timedelta(minutes = self.rng.randint(1, 120))
+            forfeit = self.rng.random() < FORFEIT_CHANCE
+            if forfeit or self.rng.random() < 1.0 / (1.0 + 10.0 ** ((skill[challengee] - skill[challenger]) / 400.0)):
+                winner, loser, winner_pos, loser_pos = challenger, challengee, position, target
+            else:
+                winner, loser, winner_pos, loser_pos = challengee, challenger, target, position
+
+            challenge_id = self.challenge_ids()
+            self.challenges.add(Challenge(pk = challenge_id, ladder = ladder, challenger_id = challenger, challengee_id = challengee,
+                                          date_issued = when, deadline = when + datetime.timedelta(days = ladder.response_timeout),
+                                          accepted = Challenge.STATUS_FORFEIT if forfeit else Challenge.STATUS_COMPLETED))
+            self.matches.add(Match(pk = self.match_ids(), ladder = ladder, related_challenge_id = challenge_id, forfeit = forfeit,
+                                   date_challenged = when, date_complete = when + datetime.timedelta(minutes = 30),
+                                   challenger_id = challenger, challenger_rank = position + 1, challenger_rank_icon = arrows[challenger],
+                                   challengee_id = challengee, challengee_rank = target + 1, challengee_rank_icon = arrows[challengee],
+                                   winner_id = winner, winner_rank = min(position, target) + 1, winner_rank_icon = Rank.ARROW_UP))
+
+            winner_rank, arrows[winner], loser_rank, arrows[loser] = _match_result_ranks(winner_pos + 1, loser_pos + 1, size)
+            standings[winner_rank - 1] = winner
+            standings[loser_rank - 1] = loser
+            self.history.add(RankHistory(ladder = ladder, player_id = winner, rank = winner_rank, recorded_at = when + datetime.timedelta(minutes = 30)))
+            self.history.add(RankHistory(ladder = ladder, player_id = loser, rank = loser_rank, recorded_at = when + datetime.timedelta(minutes = 30)))
+            played += 1
+            # Every match completes at a later time than the one before, so any of them can end a checkpoint's stretch
+            if played % CHECKPOINT_INTERVAL == 0 or played == matches:
+                self._checkpoint(ladder, when + datetime.timedelta(minutes = 30), standings, arrows)
+
+        Rank.objects.bulk_create([Rank(ladder = ladder, player_id = player, rank = i + 1, arrow = arrows[player]) for i, player in enumerate(standings)],
+                                 batch_size = CHUNK_SIZE)
+
+        self._open_challenges(ladder, standings, arrows, open_challenges)
+
+    def _open_challenges(self, ladder, standings, arrows, count):
+        """Leaves some challenges pending and some accepted with their match still to be played."""
+        busy = set()
+        for position in self.rng.sample(range(len(standings)), min(count * 4, len(standings))):
+            if count <= 0:
+                break
+            challenger = standings[position]
+            targets = [t for t in self._targets(ladder, position, arrows[challenger], len(standings)) if standings[t] not in busy]
+            if challenger in busy or not targets:
+                continue
+            target = self.rng.choice(targets)
+            challengee = standings[target]
+            busy.update((challenger, challengee))
+            count -= 1
+
+            accepted = self.rng.random() < 0.5
+            challenge_id = self.challenge_ids()
+            self.challenges.add(Challenge(pk = challenge_id, ladder = ladder, challenger_id = challenger, challengee_id = challengee,
+                                          date_issued = self.now, deadline = self.now + datetime.timedelta(days = ladder.response_timeout),
+                                          accepted = Challenge.STATUS_ACCEPTED if accepted else Challenge.STATUS_NOT_ACCEPTED))
+            if accepted:
+                self.matches.add(Match(pk = self.match_ids(), ladder = ladder, related_challenge_id = challenge_id, date_challenged = self.now,
+                                       challenger_id = challenger, challenger_rank = position + 1, challenger_rank_icon = arrows[challenger],
+                                       challengee_id = challengee, challengee_rank = target + 1, challengee_rank_icon = arrows[challengee]))
+
+    def _targets(self, ladder, position, arrow, size):
+        """Positions (0-based) a player at `position` may challenge."""
+        if arrow == Rank.ARROW_UP:
+            return list(range(max(0, position - ladder.up_arrow), position))
+        return list(range(position + 1, min(size, position + 1 + ladder.down_arrow)))
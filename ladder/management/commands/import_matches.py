@@ -0,0 +1,46 @@
+import io
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ladder.imports import IMPORT_CHUNK_SIZE, _read_csv, _read_ndjson, import_match_results
+from ladder.models import Ladder
+
+READERS = {'csv': _read_csv, 'ndjson': _read_ndjson}
+
+class Command(BaseCommand):
+    help = ("Imports a history of match results onto a ladder from a CSV or NDJSON file, replaying their rank changes. "
+            "Each result has a date, the challenger, challengee and winner's usernames, and optionally forfeit.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - to read standard input.")
+        parser.add_argument('--ladder', required=True, help="Slug of the ladder the results were played on.")
+        parser.add_argument('--format', choices=sorted(READERS), help="File format, guessed from the file extension by default.")
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help="Results read and written at a time.")
+
+    def handle(self, *args, **options):
+        try:
+            ladder = Ladder.objects.get(slug = options['ladder'])
+        except Ladder.DoesNotExist:
+            raise CommandError("Unknown ladder: {0}".format(options['ladder']))
+
+        file_format = options['format']
+        if file_format is None:
+            file_format = 'ndjson' if options['path'].lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+        if options['path'] == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding = 'utf-8-sig', newline = '')
+        else:
+            try:
+                stream = open(options['path'], encoding = 'utf-8-sig', newline = '')
+            except OSError as e:
+                raise CommandError("Can't read {0}: {1}".format(options['path'], e))
+
+        started = time.perf_counter()
+        try:
+            with stream:
+                imported, joined = import_match_results(ladder, READERS[file_format](stream), options['chunk_size'])
+        except ValueError as e:
+            raise CommandError("Nothing was imported, {0}".format(e))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write("Imported {0} matches onto {1} in {2:.2f}s ({3} new players ranked)".format(imported, ladder.name, elapsed, joined))
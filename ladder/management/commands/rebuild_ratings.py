@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ladder.models import Ladder
+from ladder.ratings import replay_ladder_ratings
+
+class Command(BaseCommand):
+    help = "Recomputes every player's rating from the match history of the given ladders (or all ladders)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_slugs', nargs='*', help="Slugs of the ladders to rebuild, defaults to every ladder.")
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.all()
+        if options['ladder_slugs']:
+            ladders = ladders.filter(slug__in=options['ladder_slugs'])
+            missing = set(options['ladder_slugs']) - set(ladders.values_list('slug', flat=True))
+            if missing:
+                raise CommandError("Unknown ladders: {0}".format(", ".join(sorted(missing))))
+
+        for ladder in ladders:
+            started = time.perf_counter()
+            replayed = replay_ladder_ratings(ladder)
+            self.stdout.write("{0}: replayed {1} matches in {2:.2f}s".format(ladder.name, replayed, time.perf_counter() - started))
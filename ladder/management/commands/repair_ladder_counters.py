@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from ladder.helpers import _repair_ladder_counters
+from ladder.models import Ladder
+
+class Command(BaseCommand):
+    help = "Recomputes the stored player count and last match time of ladders from their ranks and matches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('ladder_slugs', nargs='*', help="Slugs of the ladders to repair, defaults to every ladder.")
+
+    def handle(self, *args, **options):
+        ladders = Ladder.objects.all()
+        if options['ladder_slugs']:
+            ladders = ladders.filter(slug__in = options['ladder_slugs'])
+            missing = set(options['ladder_slugs']) - set(ladders.values_list('slug', flat = True))
+            if missing:
+                raise CommandError("Unknown ladders: {0}".format(", ".join(sorted(missing))))
+
+        updated = _repair_ladder_counters(ladders)
+        self.stdout.write("Repaired the counters of {0} ladder{1}".format(updated, "" if updated == 1 else "s"))
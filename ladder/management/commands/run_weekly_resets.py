@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ladder.models import Ladder
+from ladder.resets import run_weekly_resets
+
+class Command(BaseCommand):
+    help = "Resets the arrows and closes the unanswered challenges of every ladder with a weekly reset due today."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weekday', choices=[value for value, _name in Ladder.WEEKDAYS] + [name.lower() for _value, name in Ladder.WEEKDAYS],
+                            help="Reset the ladders due on this day instead of today, as a name or 0 (Sunday) to 6 (Saturday).")
+        parser.add_argument('--workers', type=int, default=4, help="Ladders reset in parallel.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        weekday = options['weekday']
+        if weekday is not None and not weekday.isdigit():
+            weekday = dict((name.lower(), value) for value, name in Ladder.WEEKDAYS)[weekday]
+
+        started = time.perf_counter()
+        results = run_weekly_resets(weekday = weekday, workers = options['workers'])
+        elapsed = time.perf_counter() - started
+
+        reset = [(ladder_id, result) for ladder_id, result in results if result is not None]
+        if options['verbosity'] > 1:
+            for ladder_id, (ranks, challenges) in reset:
+                self.stdout.write("  ladder {0}: {1} arrows reset, {2} challenges closed".format(ladder_id, ranks, challenges))
+
+        self.stdout.write("Reset {0} ladder{1} in {2:.2f}s ({3} arrows, {4} challenges closed)".format(
+            len(reset), "" if len(reset) == 1 else "s", elapsed, sum(r[0] for _id, r in reset), sum(r[1] for _id, r in reset)))
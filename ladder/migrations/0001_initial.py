@@ -0,0 +1,121 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:16
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Challenge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_issued', models.DateTimeField()),
+                ('deadline', models.DateTimeField(blank=True, null=True, verbose_name='Challenge Expires')),
+                ('accepted', models.CharField(choices=[('0', 'Not Accepted'), ('1', 'Accepted'), ('2', 'Forfeit'), ('3', 'Postponed'), ('4', 'Completed'), ('5', 'Cancelled')], default=0, max_length=2)),
+                ('note', models.TextField(blank=True, null=True)),
+                ('challengee', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='challenge_challengee', to=settings.AUTH_USER_MODEL)),
+                ('challenger', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='challenge_challenger', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Game',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('abv', models.CharField(max_length=10, unique=True)),
+                ('slug', models.CharField(blank=True, editable=False, max_length=50)),
+                ('icon', models.ImageField(blank=True, upload_to='img/games')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Ladder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('slug', models.CharField(blank=True, editable=False, max_length=60)),
+                ('description', models.TextField(blank=True)),
+                ('max_players', models.IntegerField(default='0', validators=[django.core.validators.MinValueValidator(0)])),
+                ('privacy', models.CharField(choices=[('0', 'Open'), ('1', 'Unlisted'), ('2', 'Private')], default='0', max_length=2)),
+                ('signups', models.BooleanField(default=True)),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Ladder Created')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='Ladder Closes')),
+                ('up_arrow', models.IntegerField(default='2', validators=[django.core.validators.MinValueValidator(0)], verbose_name='Up arrow range')),
+                ('down_arrow', models.IntegerField(default='4', validators=[django.core.validators.MinValueValidator(0)], verbose_name='Down arrow range')),
+                ('weekly_reset', models.CharField(blank=True, choices=[('0', 'Sunday'), ('1', 'Monday'), ('2', 'Tuesday'), ('3', 'Wednesday'), ('4', 'Thursday'), ('5', 'Friday'), ('6', 'Saturday')], max_length=2, null=True)),
+                ('challenge_cooldown', models.IntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(0)])),
+                ('response_timeout', models.IntegerField(blank=True, default='3', validators=[django.core.validators.MinValueValidator(0)])),
+                ('game', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ladder.game')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Rank',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField()),
+                ('arrow', models.CharField(choices=[('0', '▲'), ('1', '▼')], default='0', max_length=2)),
+                ('ladder', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ladder.ladder')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Rank',
+                'verbose_name_plural': 'Rankings',
+            },
+        ),
+        migrations.CreateModel(
+            name='Match',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_challenged', models.DateTimeField(verbose_name='Date Challenged')),
+                ('date_complete', models.DateTimeField(blank=True, null=True, verbose_name='Challenge Completed')),
+                ('challenger_rank', models.IntegerField(blank=True, null=True)),
+                ('challenger_rank_icon', models.CharField(blank=True, choices=[('0', '▴'), ('1', '▾')], max_length=2, null=True)),
+                ('character1', models.CharField(blank=True, max_length=40, verbose_name="Challenger's Character")),
+                ('challengee_rank', models.IntegerField(blank=True, null=True)),
+                ('challengee_rank_icon', models.CharField(blank=True, choices=[('0', '▴'), ('1', '▾')], max_length=2, null=True)),
+                ('character2', models.CharField(blank=True, max_length=40, verbose_name="Challengee's Character")),
+                ('winner_rank', models.IntegerField(blank=True, null=True)),
+                ('winner_rank_icon', models.CharField(blank=True, choices=[('0', '▴'), ('1', '▾')], max_length=2, null=True)),
+                ('forfeit', models.BooleanField(default=False)),
+                ('challengee', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='match_challengee', to=settings.AUTH_USER_MODEL)),
+                ('challenger', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='match_challenger', to=settings.AUTH_USER_MODEL)),
+                ('ladder', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ladder.ladder')),
+                ('related_challenge', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ladder.challenge')),
+                ('winner', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Match',
+                'verbose_name_plural': 'Matches',
+            },
+        ),
+        migrations.AddField(
+            model_name='challenge',
+            name='ladder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='ladder.ladder'),
+        ),
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.FloatField(default=1500.0)),
+                ('matches', models.IntegerField(default=0)),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ladder.ladder')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Rating',
+                'verbose_name_plural': 'Ratings',
+                'unique_together': {('ladder', 'player')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['ladder', 'accepted'], name='challenge_ladder_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['deadline'], name='challenge_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['ladder', '-date_complete'], name='match_ladder_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rank',
+            index=models.Index(fields=['ladder', 'rank'], name='rank_ladder_rank_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rank',
+            constraint=models.UniqueConstraint(fields=('ladder', 'player'), name='rank_unique_ladder_player'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='match',
+            name='match_ladder_completed_idx',
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['ladder', '-date_complete', '-id'], name='match_ladder_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['challenger', '-date_complete', '-id'], name='match_challenger_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['challengee', '-date_complete', '-id'], name='match_challengee_completed_idx'),
+        ),
+    ]
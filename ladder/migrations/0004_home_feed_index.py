@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0003_match_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['-date_complete', '-id'], name='match_completed_idx'),
+        ),
+    ]
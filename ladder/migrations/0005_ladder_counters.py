@@ -0,0 +1,36 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:31
+
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_ladder_counters(apps, schema_editor):
+    Ladder = apps.get_model('ladder', 'Ladder')
+    Match = apps.get_model('ladder', 'Match')
+    Rank = apps.get_model('ladder', 'Rank')
+
+    players = Rank.objects.filter(ladder=OuterRef('pk')).order_by().annotate(c=Func(F('pk'), function='COUNT')).values('c')[:1]
+    last_match = Match.objects.filter(ladder=OuterRef('pk'), date_complete__isnull=False).order_by('-date_complete').values('date_complete')[:1]
+    Ladder.objects.update(player_count=Coalesce(Subquery(players), 0), last_match_at=Subquery(last_match))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0004_home_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ladder',
+            name='last_match_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Last Match'),
+        ),
+        migrations.AddField(
+            model_name='ladder',
+            name='player_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Players'),
+        ),
+        migrations.RunPython(fill_ladder_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0005_ladder_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['accepted', 'deadline'], name='challenge_status_deadline_idx'),
+        ),
+    ]
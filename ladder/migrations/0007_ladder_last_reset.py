@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0006_challenge_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ladder',
+            name='last_reset',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Last Weekly Reset'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0007_ladder_last_reset'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='challenge',
+            index=models.Index(fields=['ladder', 'challenger', 'challengee', 'date_issued'], name='challenge_cooldown_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:53
+
+import datetime
+import json
+
+from django.db import migrations, models
+from django.utils.timezone import utc
+import django.db.models.deletion
+
+
+def checkpoint_current_standings(apps, schema_editor):
+    """Every ladder's history starts from how it stands today, run checkpoint_standings to rebuild further back."""
+    Ladder = apps.get_model('ladder', 'Ladder')
+    Rank = apps.get_model('ladder', 'Rank')
+    StandingsCheckpoint = apps.get_model('ladder', 'StandingsCheckpoint')
+
+    now = datetime.datetime.utcnow().replace(tzinfo=utc)
+    checkpoints = []
+    for ladder_id in Ladder.objects.values_list('id', flat=True):
+        standings = list(Rank.objects.filter(ladder_id=ladder_id).order_by('rank').values_list('player_id', 'arrow'))
+        packed = {'players': [player_id for player_id, _arrow in standings], 'down': [player_id for player_id, arrow in standings if arrow == '1']}
+        checkpoints.append(StandingsCheckpoint(ladder_id=ladder_id, taken_at=now, standings=json.dumps(packed, separators=(',', ':'))))
+    StandingsCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0008_challenge_cooldown_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StandingsCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField()),
+                ('standings', models.TextField()),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ladder.ladder')),
+            ],
+            options={
+                'verbose_name': 'Standings checkpoint',
+                'verbose_name_plural': 'Standings checkpoints',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='standingscheckpoint',
+            index=models.Index(fields=['ladder', '-taken_at'], name='checkpoint_ladder_taken_idx'),
+        ),
+        migrations.RunPython(checkpoint_current_standings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.6 on 2026-10-18 17:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def record_past_matches(apps, schema_editor):
+    """Every completed match left its winner on the better of the two ranks and its loser on the other."""
+    Match = apps.get_model('ladder', 'Match')
+    RankHistory = apps.get_model('ladder', 'RankHistory')
+
+    matches = Match.objects.filter(ladder__isnull=False, winner__isnull=False, date_complete__isnull=False, challenger__isnull=False, challengee__isnull=False,
+                                   challenger_rank__isnull=False, challengee_rank__isnull=False).order_by('date_complete', 'id')
+    history = []
+    for ladder_id, challenger_id, challenger_rank, challengee_id, challengee_rank, winner_id, date_complete in matches.values_list(
+            'ladder_id', 'challenger_id', 'challenger_rank', 'challengee_id', 'challengee_rank', 'winner_id', 'date_complete').iterator():
+        loser_id = challengee_id if winner_id == challenger_id else challenger_id
+        history.append(RankHistory(ladder_id=ladder_id, player_id=winner_id, rank=min(challenger_rank, challengee_rank), recorded_at=date_complete))
+        history.append(RankHistory(ladder_id=ladder_id, player_id=loser_id, rank=max(challenger_rank, challengee_rank), recorded_at=date_complete))
+        if len(history) >= 5000:
+            RankHistory.objects.bulk_create(history)
+            history = []
+    RankHistory.objects.bulk_create(history)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ladder', '0009_standings_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(blank=True, null=True)),
+                ('recorded_at', models.DateTimeField()),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ladder.ladder')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Rank history',
+                'verbose_name_plural': 'Rank history',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='rankhistory',
+            index=models.Index(fields=['player', 'ladder', 'recorded_at'], name='rank_history_player_idx'),
+        ),
+        migrations.RunPython(record_past_matches, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:22
+
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_first_checkpoints(apps, schema_editor):
+    """A ladder's first checkpoint either seeded its history with the standings it had, or was the empty one
+        taken when it was created, when every join since was checkpointed and its history can be played from the start."""
+    StandingsCheckpoint = apps.get_model('ladder', 'StandingsCheckpoint')
+
+    seeds, empty = [], []
+    first = StandingsCheckpoint.objects.order_by('ladder_id', 'taken_at', 'id')
+    seen = set()
+    for checkpoint_id, ladder_id, standings in first.values_list('id', 'ladder_id', 'standings').iterator():
+        if ladder_id in seen:
+            continue
+        seen.add(ladder_id)
+        (seeds if json.loads(standings)['players'] else empty).append(checkpoint_id)
+
+    StandingsCheckpoint.objects.filter(id__in=seeds).update(seed=True)
+    StandingsCheckpoint.objects.filter(id__in=empty).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0010_rank_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='standingscheckpoint',
+            name='seed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='StandingsEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('j', 'Join'), ('l', 'Leave'), ('r', 'Reset')], max_length=1)),
+                ('player_id', models.IntegerField(blank=True, null=True)),
+                ('rank', models.PositiveIntegerField(blank=True, null=True)),
+                ('happened_at', models.DateTimeField()),
+                ('ladder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ladder.ladder')),
+            ],
+            options={
+                'verbose_name': 'Standings event',
+                'verbose_name_plural': 'Standings events',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='standingsevent',
+            index=models.Index(fields=['ladder', 'happened_at'], name='standings_event_ladder_idx'),
+        ),
+        migrations.RunPython(seed_first_checkpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ladder', '0011_standings_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='standingsevent',
+            name='arrow',
+            field=models.CharField(blank=True, choices=[('0', '▲'), ('1', '▼')], max_length=2, null=True),
+        ),
+        migrations.AlterField(
+            model_name='standingsevent',
+            name='kind',
+            field=models.CharField(choices=[('j', 'Join'), ('l', 'Leave'), ('m', 'Moved by hand'), ('r', 'Reset')], max_length=1),
+        ),
+    ]
@@ -1,16 +1,53 @@
 # -*- coding: utf-8 -*-
 import datetime
+import json
 from django.contrib.auth.models import User
-from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Case, Exists, F, Max, OuterRef, Q, Value, When
 from django.db.models.deletion import CASCADE, SET_NULL
 from django.db.models.signals import post_save, post_delete
 from django.template.defaultfilters import slugify
 from django.urls.base import reverse
 from django.utils.timezone import utc
-from ladder.exceptions import ParticipantBusy, PlayerNotRanked, ChallengeeOutOfRange, ChallengeeIsChallenger
+from ladder.cache import _home_feed_changed, _ladder_changed
+from ladder.events import _ladder_event
+from ladder.exceptions import ParticipantBusy, PlayerNotRanked, ChallengeeOutOfRange, ChallengeeIsChallenger, ChallengeOnCooldown, ChallengeStatusConflict
+
+ELO_INITIAL_RATING  = 1500.0    # Rating given to a player before their first match on a ladder
+ELO_K_FACTOR        = 32.0      # Most points that can change hands in a single match
+
+def _elo_exchange( winner_rating, loser_rating, k = ELO_K_FACTOR ) :
+    """ Returns the number of rating points the winner takes from the loser. """
+    expected = 1.0 / ( 1.0 + 10.0 ** ( ( loser_rating - winner_rating ) / 400.0 ) )
+    return k * ( 1.0 - expected )
+
+def _cooldown_challenges( challenger, ladder, now = None ) :
+    """ Returns the challenger's challenges on the ladder still inside its cooldown, or None if the ladder has no cooldown.
+
+        Answered from the (ladder, challenger, challengee, date_issued) index, only the challenger's recent
+        challenges are read and never the rest of the ladder's history.
+    """
+    if not ladder.challenge_cooldown :
+        return None
+
+    if now is None :
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+    since = now - datetime.timedelta(days=int(ladder.challenge_cooldown))
+
+    # Cancelled challenges were never played, they don't hold the pair apart
+    return Challenge.objects.filter( ladder = ladder, challenger = challenger, date_issued__gte = since ).exclude( accepted = Challenge.STATUS_CANCELLED )
+
+def _challengeable_ranks( rank, arrow, up_arrow, down_arrow, rankings = None ) :
+    """ Returns the ranks a player on `rank` with `arrow` may challenge as a range, cut off at the last of `rankings` players if given. """
+    if arrow == Rank.ARROW_UP :
+        return range( max( rank - int( up_arrow ), 1 ), rank )
+    elif arrow == Rank.ARROW_DOWN :
+        last = rank + int( down_arrow ) if rankings is None else min( rank + int( down_arrow ), rankings )
+        return range( rank + 1, last + 1 )
+
+    # Somehow the challenger has an invalid arrow
+    raise ValueError( "challenger arrow is invalid", arrow )
 
 def _can_challenge_user( challenger, challengee, ladder ) :
     """ This function validates a challenge before it is saved """
@@ -18,22 +55,36 @@ def _can_challenge_user( challenger, challengee, ladder ) :
     if challenger == challengee :
         raise ChallengeeIsChallenger( "you cannot challenge yourself" )
 
-    # Attempt to get the ranks of the participants
+    # Get the ranks of both participants, and whether either of them is already busy with
+    # another open challenge on this ladder, in a single query.
+    other_challenges = Challenge.objects.filter( ladder = ladder, accepted__in = (Challenge.STATUS_NOT_ACCEPTED, Challenge.STATUS_ACCEPTED) )
+    other_challenges = other_challenges.exclude( challenger = challenger, challengee = challengee ) # Exclude ourselves
+    other_challenges = other_challenges.filter( Q( challenger = OuterRef('player') ) | Q( challengee = OuterRef('player') ) )
+    participants = Rank.objects.filter( ladder = ladder, player__in = (challenger, challengee) ).annotate( busy = Exists( other_challenges ) )
+
+    # The same query finds whether the challenger already challenged this player within the ladder's cooldown
+    recent_challenges = _cooldown_challenges( challenger, ladder )
+    if recent_challenges is not None :
+        participants = participants.annotate( on_cooldown = Exists( recent_challenges.filter( challengee = OuterRef('player') ) ) )
+    participants = dict( (rank.player_id, rank) for rank in participants.only( 'player', 'rank', 'arrow' ) )
+
     try :
-        challenger_rank = Rank.objects.get( ladder = ladder, player = challenger )
-        challengee_rank = Rank.objects.get( ladder = ladder, player = challengee )
-    except ObjectDoesNotExist :
+        challenger_rank = participants[challenger.pk]
+        challengee_rank = participants[challengee.pk]
+    except KeyError :
         # Rank couldn't be retrieved, but both players must be ranked
         raise PlayerNotRanked( "either the challenger {} or challengee {} is not ranked on the ladder".format( challenger, challengee, ladder ), ladder )
 
     # Make sure the participants aren't already busy with another challenge
-    active_ladder_challenges = Challenge.objects.filter( ladder = ladder ).filter( Q(accepted = Challenge.STATUS_ACCEPTED) | Q(accepted = Challenge.STATUS_NOT_ACCEPTED) )
-    active_ladder_challenges = active_ladder_challenges.exclude( challenger = challenger, challengee = challengee ) # Exclude ourselves
-    if      active_ladder_challenges.filter( Q( challenger = challenger ) | Q( challengee = challenger ) ) :
+    if      challenger_rank.busy :
         raise ParticipantBusy( "cannot issue a new challenge with open challenges already", challenger )
-    elif    active_ladder_challenges.filter( Q( challenger = challengee ) | Q( challengee = challengee ) ) :
+    elif    challengee_rank.busy :
         raise ParticipantBusy( "cannot issue a challenge to a player already busy with another challenge", challengee )
 
+    # Make sure the challenger hasn't challenged this player too recently
+    if getattr( challengee_rank, 'on_cooldown', False ) :
+        raise ChallengeOnCooldown( "you already challenged this player within the last {} days".format( ladder.challenge_cooldown ), challengee )
+
     # Find the difference between ranks
     rankdiff = challenger_rank.rank - challengee_rank.rank
 
@@ -41,16 +92,9 @@ def _can_challenge_user( challenger, challengee, ladder ) :
     if rankdiff == 0 :
         raise ChallengeeOutOfRange( "challengee and challenger are equally ranked at {}".format( challenger_rank.rank ), rankdiff )
 
-    # Check that the target of the challenge is within the ladder's specified range
-    if challenger_rank.arrow == Rank.ARROW_UP :
-        if rankdiff < 0 or rankdiff > int( ladder.up_arrow ) :
-            raise ChallengeeOutOfRange( "challengee is ranked {}, which can't be challenged from {}".format( challengee_rank.rank, challenger_rank.rank ), rankdiff )
-    elif challenger_rank.arrow == Rank.ARROW_DOWN :
-        if rankdiff > 0 or -rankdiff > int( ladder.down_arrow ) :
-            raise ChallengeeOutOfRange( "challengee is ranked {}, which can't be challenged from {}".format( challengee_rank.rank, challenger_rank.rank ), rankdiff )
-    else :
-        # Somehow the challenger has an invalid arrow
-        raise ValueError( "challenger arrow is invalid", challenger_rank.arrow )
+    # Check that the target of the challenge is within the ladder's specified range, by the same rule LadderState lists targets with
+    if challengee_rank.rank not in _challengeable_ranks( challenger_rank.rank, challenger_rank.arrow, ladder.up_arrow, ladder.down_arrow ) :
+        raise ChallengeeOutOfRange( "challengee is ranked {}, which can't be challenged from {}".format( challengee_rank.rank, challenger_rank.rank ), rankdiff )
 
     return True
 
@@ -70,8 +114,7 @@ def _get_user_challenges(user, ladder = None, statuses = None):
 
     # Narrow it down to statuses requested
     if statuses is not None:
-        for status in statuses:
-            open_challenges = open_challenges.filter( accepted = status )
+        open_challenges = open_challenges.filter( accepted__in = statuses )
 
     return open_challenges
 
@@ -110,21 +153,20 @@ class Ladder(models.Model):
     )
 
     def ranked_players(self):
-        """Gets number of players on ladder."""
-        return Rank.objects.filter( ladder = self ).count()
+        """Gets number of players on ladder, kept up to date as players join and leave."""
+        return self.player_count
 
     def save(self, force_insert=False, force_update=False, using=None, *args, **kwargs):
         self.slug = slugify(self.name)
         super(Ladder, self).save(*args, **kwargs)
 
     def latest_match(self):
-        matches = Match.objects.filter(ladder_id=self.id).order_by('-date_challenged').first()
-        if not matches :
+        if self.last_match_at is None :
             return "Never"
-        return matches.date_challenged
+        return self.last_match_at
 
     def is_user_ranked( self, user ) :
-        return user.rank_set.get( ladder = self ) != None
+        return user.rank_set.filter( ladder = self ).exists()
     
     def __str__(self):
         return "{0} ({1})".format(self.name, self.game.name)
@@ -138,6 +180,9 @@ class Ladder(models.Model):
     game                = models.ForeignKey(Game, null=True, blank=True, on_delete=SET_NULL)
     players             = property(ranked_players)
     latest_activity     = property(latest_match)
+    # Stored copies of the player count and last result, see repair_ladder_counters to recompute them.
+    player_count        = models.IntegerField("Players", default=0, editable=False)
+    last_match_at       = models.DateTimeField("Last Match", blank=True, null=True, editable=False)
     max_players         = models.IntegerField(default='0', validators=[MinValueValidator(0),])
     privacy             = models.CharField(max_length=2, choices=PRIVACY_LEVELS, blank=False, default=PRIVACY_OPEN)
     signups             = models.BooleanField(blank=False, default=True)
@@ -146,6 +191,7 @@ class Ladder(models.Model):
     up_arrow            = models.IntegerField("Up arrow range", default='2', validators=[MinValueValidator(0),])
     down_arrow          = models.IntegerField("Down arrow range", default='4', validators=[MinValueValidator(0),])
     weekly_reset        = models.CharField(max_length=2, choices=WEEKDAYS, blank=True, null=True)
+    last_reset          = models.DateTimeField("Last Weekly Reset", blank=True, null=True, editable=False)
     challenge_cooldown  = models.IntegerField(blank=True, null=True, validators=[MinValueValidator(0),])
     response_timeout    = models.IntegerField(blank=True, default='3', validators=[MinValueValidator(0),])
 
@@ -162,6 +208,8 @@ class Rank(models.Model):
     class Meta:
         verbose_name_plural = "Rankings"
         verbose_name        = "Rank"
+        constraints         = [models.UniqueConstraint(fields=['ladder', 'player'], name='rank_unique_ladder_player')]
+        indexes             = [models.Index(fields=['ladder', 'rank'], name='rank_ladder_rank_idx')]
 
     player  = models.ForeignKey('auth.User', null=False, blank=False, on_delete=CASCADE)
     rank    = models.IntegerField()
@@ -172,6 +220,21 @@ class Rank(models.Model):
         return u"{0} [{1}{2}]".format(self.player.userprofile.handle, self.rank, self.get_arrow_display())
 
 
+class Rating(models.Model):
+    class Meta:
+        verbose_name_plural = "Ratings"
+        verbose_name        = "Rating"
+        unique_together     = (('ladder', 'player'),)
+
+    player  = models.ForeignKey('auth.User', null=False, blank=False, on_delete=CASCADE)
+    ladder  = models.ForeignKey(Ladder, null=False, blank=False, on_delete=CASCADE)
+    rating  = models.FloatField(default=ELO_INITIAL_RATING)
+    matches = models.IntegerField(default=0)
+
+    def __str__(self):
+        return u"{0} [{1:.0f}]".format(self.player.userprofile.handle, self.rating)
+
+
 class Challenge(models.Model):
     STATUS_NOT_ACCEPTED = u'0'
     STATUS_ACCEPTED     = u'1'
@@ -189,6 +252,16 @@ class Challenge(models.Model):
         (STATUS_CANCELLED,     u'Cancelled')
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['ladder', 'accepted'], name='challenge_ladder_status_idx'),
+            models.Index(fields=['deadline'], name='challenge_deadline_idx'),
+            # Overdue unanswered challenges, without walking the deadlines of every finished one
+            models.Index(fields=['accepted', 'deadline'], name='challenge_status_deadline_idx'),
+            # The last time a player challenged another, for the ladder's cooldown
+            models.Index(fields=['ladder', 'challenger', 'challengee', 'date_issued'], name='challenge_cooldown_idx'),
+        ]
+
     challenger  = models.ForeignKey('auth.User', related_name='challenge_challenger', null=True, blank=False, on_delete=SET_NULL)
     challengee  = models.ForeignKey('auth.User', related_name='challenge_challengee', null=True, blank=False, on_delete=SET_NULL)
     date_issued = models.DateTimeField()
@@ -200,30 +273,86 @@ class Challenge(models.Model):
     def __str__(self):
         return "{0} vs {1}".format(self.challenger, self.challengee)
 
+    # The statuses a challenge is allowed to move into, and the statuses it may move from.
+    # An accepted challenge is forfeit through its Match, which records the winner as it does.
+    TRANSITIONS = {
+        STATUS_ACCEPTED:    (STATUS_NOT_ACCEPTED, STATUS_POSTPONED),
+        STATUS_FORFEIT:     (STATUS_NOT_ACCEPTED, STATUS_POSTPONED),
+        STATUS_POSTPONED:   (STATUS_NOT_ACCEPTED, STATUS_ACCEPTED),
+        STATUS_COMPLETED:   (STATUS_ACCEPTED,),
+        STATUS_CANCELLED:   (STATUS_NOT_ACCEPTED,),
+    }
+
+    def _transition(self, status):
+        """Moves the challenge from the status it was loaded with into a new one and returns the status it left.
+
+            This is a single conditional UPDATE (WHERE accepted = <loaded status>), so two people
+            answering the same challenge can't both win, and a copy loaded before someone else
+            answered it raises ChallengeStatusConflict instead of acting on the new status. The
+            validation in save() that only matters when a challenge is issued is skipped.
+        """
+        # A challenge created in this process still holds the field's integer default
+        previous = str(self.accepted)
+        if previous in Challenge.TRANSITIONS[status]:
+            if Challenge.objects.filter(pk = self.pk, accepted = previous).update(accepted = status):
+                self.accepted = status
+                _ladder_changed(self.ladder_id)
+                return previous
+
+        raise ChallengeStatusConflict( "challenge can't be marked {} from its current status".format( dict(Challenge.CHALLENGE_RESPONSES)[status] ), self.pk )
+
+    def _record_match(self):
+        """Creates the Match for this challenge, recording both players' rank and arrow as they are right now.
+            If a player isn't ranked, their rank is left as null for adjust_rank to figure out.
+        """
+        ranks = Rank.objects.filter(ladder_id = self.ladder_id, player_id__in = (self.challenger_id, self.challengee_id)).only('player', 'rank', 'arrow')
+        ranks = dict((r.player_id, r) for r in ranks)
+        challenger_rank = ranks.get(self.challenger_id)
+        challengee_rank = ranks.get(self.challengee_id)
+
+        defaults = { 'date_challenged': datetime.datetime.utcnow().replace(tzinfo=utc),
+                    'challenger': self.challenger, 'challengee': self.challengee,
+                    'challenger_rank': getattr(challenger_rank, 'rank', None), 'challenger_rank_icon': getattr(challenger_rank, 'arrow', None),
+                    'challengee_rank': getattr(challengee_rank, 'rank', None), 'challengee_rank_icon': getattr(challengee_rank, 'arrow', None) }
+        new_match, created = Match.objects.get_or_create(related_challenge=self, ladder=self.ladder, defaults=defaults)
+        return new_match
+
+    def _record_forfeit(self):
+        """ If the match is forfeit upon receiving the Challenge, then immedietly mark this as a loss for the challengee. """
+        new_match = self._record_match()
+        new_match.forfeit = True
+        new_match.choose_winner( self.challenger )
+        new_match.save()
+        return new_match
+
     def accept(self):
-        self.accepted = Challenge.STATUS_ACCEPTED
+        """ Once the challenge is accepted, create the MATCH object and record the current stats. """
+        self._transition(Challenge.STATUS_ACCEPTED)
+        return self._record_match()
 
     def forfeit(self):
-        self.accepted = Challenge.STATUS_FORFEIT
+        self._transition(Challenge.STATUS_FORFEIT)
+        self._record_forfeit()
 
     def postpone(self):
-        self.accepted = Challenge.STATUS_POSTPONED
+        self._transition(Challenge.STATUS_POSTPONED)
 
     def complete(self):
-        self.accepted = Challenge.STATUS_COMPLETED
+        self._transition(Challenge.STATUS_COMPLETED)
 
     def cancel(self):
-        self.accepted = Challenge.STATUS_CANCELLED
+        self._transition(Challenge.STATUS_CANCELLED)
         self.delete()
 
     def save(self, *args, **kwargs):
-        # Check that our challenge is actually valid
-        _can_challenge_user( self.challenger, self.challengee, self.ladder )
+        # Check that our challenge is actually valid, this only matters when it is first issued.
+        if self._state.adding:
+            _can_challenge_user( self.challenger, self.challengee, self.ladder )
 
         # Setup the deadline based on the ladder's timeout
         if not self.deadline :
             ladder = self.ladder
-            if ladder.response_timeout > 0 :
+            if int( ladder.response_timeout ) > 0 :
                 self.deadline = datetime.datetime.utcnow().replace(tzinfo=utc) + datetime.timedelta(days=int(ladder.response_timeout))
             else:
                 self.deadline = None
@@ -236,41 +365,12 @@ class Challenge(models.Model):
         # Challenge object. Just a couple of players, a ladder and deadline.
         super(Challenge, self).save(*args, **kwargs)
 
-        if self.accepted == Challenge.STATUS_ACCEPTED or self.accepted == Challenge.STATUS_FORFEIT:
-            """
-            Once match is accepted, created the MATCH object and record the current stats.
-            At this point we record the pre-match stats, so we need to get the players' current rank.
-            If this rank does not exist, we leave as null, let the adjust_rank function figure out their ranks post-match.
-            """
-            try:
-                challenger_rank_obj = Rank.objects.get(ladder=self.ladder, player=self.challenger)
-                challenger_rank = challenger_rank_obj.rank
-                challenger_arrow = challenger_rank_obj.arrow
-            except ObjectDoesNotExist:
-                challenger_rank = None
-                challenger_arrow = None
-
-            try:
-                challengee_rank_obj = Rank.objects.get(ladder=self.ladder, player=self.challengee)
-                challengee_rank = challengee_rank_obj.rank
-                challengee_arrow = challengee_rank_obj.arrow
-            except ObjectDoesNotExist:
-                challengee_rank = None
-                challengee_arrow = None
-
-            defaults = { 'date_challenged': datetime.datetime.utcnow().replace(tzinfo=utc),
-                        'challenger': self.challenger, 'challengee': self.challengee,
-                        'challenger_rank': challenger_rank, 'challenger_rank_icon': challenger_arrow,
-                        'challengee_rank': challengee_rank, 'challengee_rank_icon': challengee_arrow }
-            new_match, created = Match.objects.get_or_create(related_challenge=self, ladder=self.ladder, defaults=defaults)
-
-            if self.accepted == Challenge.STATUS_FORFEIT:
-                """ 
-                If the match is forfeit upon receiving the Challenge, then immedietly mark this as a loss for the challengee.
-                """
-                new_match.forfeit = True
-                new_match.choose_winner( self.challenger )
-                new_match.save()
+        # Status changes normally go through the transitions above, but a status set by hand
+        # (from the admin, say) still needs its Match.
+        if self.accepted == Challenge.STATUS_ACCEPTED:
+            self._record_match()
+        elif self.accepted == Challenge.STATUS_FORFEIT:
+            self._record_forfeit()
 
 class Match(models.Model):
     ARROW_UP    = u'0'
@@ -284,6 +384,14 @@ class Match(models.Model):
     class Meta:
         verbose_name_plural = "Matches"
         verbose_name = "Match"
+        # Match histories are read newest first and paged on (date_complete, id)
+        indexes = [
+            models.Index(fields=['ladder', '-date_complete', '-id'], name='match_ladder_completed_idx'),
+            models.Index(fields=['challenger', '-date_complete', '-id'], name='match_challenger_completed_idx'),
+            models.Index(fields=['challengee', '-date_complete', '-id'], name='match_challengee_completed_idx'),
+            # The home page feed, newest results across every ladder
+            models.Index(fields=['-date_complete', '-id'], name='match_completed_idx'),
+        ]
 
     def choose_winner( self, winner ) :
         if isinstance( winner, int ) :
@@ -307,27 +415,35 @@ class Match(models.Model):
         if self.date_complete is not None:
             return
 
-        if self.winner :
-            # With the winner mark the related challenge as "Completed"
-            if self.related_challenge.accepted == Challenge.STATUS_ACCEPTED:
-                # As long as the match wasn't forfeit of course.
-                if self.forfeit :
-                    self.related_challenge.forfeit()
-                else :
-                    self.related_challenge.complete()
-                self.related_challenge.save(*args, **kwargs)
-
-            # Because there is a winner, mark the Match object as complete
-            # right now.
-            self.date_complete = datetime.datetime.utcnow().replace(tzinfo=utc)
-
-            # Record the winner's rank & icon on the Match object.
-            # If the challenger is the winner, give them the challengee's rank
-            # (if higher)
-            self.winner_rank = self.challengee_rank if self.challenger_rank > self.challengee_rank else self.challenger_rank
-            self.winner_rank_icon = u'0'
-
-        super(Match, self).save(*args, **kwargs)
+        # The result, the challenge status and the rank changes made by the post_save handlers
+        # are recorded together or not at all.
+        try :
+            with transaction.atomic():
+                if self.winner :
+                    # With the winner mark the related challenge as "Completed"
+                    # As long as the match wasn't forfeit of course. This only moves a challenge that is
+                    # still accepted, so it is a no-op when the challenge itself was forfeit.
+                    challenge = self.related_challenge if Match.related_challenge.is_cached(self) else None
+                    if self.related_challenge_id is not None and (challenge is None or challenge.accepted == Challenge.STATUS_ACCEPTED):
+                        status = Challenge.STATUS_FORFEIT if self.forfeit else Challenge.STATUS_COMPLETED
+                        if Challenge.objects.filter(pk = self.related_challenge_id, accepted = Challenge.STATUS_ACCEPTED).update(accepted = status):
+                            _ladder_changed(self.ladder_id)
+
+                    # Because there is a winner, mark the Match object as complete
+                    # right now.
+                    self.date_complete = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+                    # Record the winner's rank & icon on the Match object.
+                    # If the challenger is the winner, give them the challengee's rank
+                    # (if higher)
+                    self.winner_rank = self.challengee_rank if self.challenger_rank > self.challengee_rank else self.challenger_rank
+                    self.winner_rank_icon = u'0'
+
+                super(Match, self).save(*args, **kwargs)
+        except Exception :
+            # Nothing was recorded, so the result can be reported again.
+            self.date_complete = None
+            raise
 
     def get_loser( self ):
         if self.winner:
@@ -371,90 +487,282 @@ class Match(models.Model):
     def __str__(self):
         return "{0} vs {1}".format(self.challenger, self.challengee)
 
+class StandingsCheckpoint(models.Model):
+    """ A ladder's standings as they were at one moment, see ladder.history for rebuilding them at any date. """
+    class Meta:
+        verbose_name_plural = "Standings checkpoints"
+        verbose_name        = "Standings checkpoint"
+        indexes             = [models.Index(fields=['ladder', '-taken_at'], name='checkpoint_ladder_taken_idx')]
+
+    ladder      = models.ForeignKey(Ladder, null=False, blank=False, on_delete=CASCADE)
+    taken_at    = models.DateTimeField()
+    # Compact JSON: {"players": [player ids in rank order], "down": [player ids with a down arrow]}
+    standings   = models.TextField()
+    # Nothing from before a seed was recorded, earlier dates are rebuilt by undoing matches from it
+    seed        = models.BooleanField(default=False)
+
+    def __str__(self):
+        return "{0} at {1}".format(self.ladder_id, self.taken_at)
+
+class StandingsEvent(models.Model):
+    """ A change to the standings that no match explains: a player joining or leaving, a rank edited by hand, or the weekly arrow reset. """
+    KIND_JOIN   = u'j'
+    KIND_LEAVE  = u'l'
+    KIND_MOVE   = u'm'
+    KIND_RESET  = u'r'
+
+    KINDS = (
+        (KIND_JOIN,     u'Join'),
+        (KIND_LEAVE,    u'Leave'),
+        (KIND_MOVE,     u'Moved by hand'),
+        (KIND_RESET,    u'Reset'),
+    )
+
+    class Meta:
+        verbose_name_plural = "Standings events"
+        verbose_name        = "Standings event"
+        indexes             = [models.Index(fields=['ladder', 'happened_at'], name='standings_event_ladder_idx')]
+
+    ladder      = models.ForeignKey(Ladder, null=False, blank=False, on_delete=CASCADE)
+    kind        = models.CharField(max_length=1, choices=KINDS)
+    # A plain id like the checkpoints keep, deleting a user mustn't rewrite the ladder's past
+    player_id   = models.IntegerField(null=True, blank=True)
+    # The rank they joined at, left from or were moved to
+    rank        = models.PositiveIntegerField(null=True, blank=True)
+    # The arrow a player moved by hand was given
+    arrow       = models.CharField(max_length=2, choices=Rank.ARROW_ICONS, null=True, blank=True)
+    happened_at = models.DateTimeField()
+
+    def __str__(self):
+        return "{0} {1} at {2}".format(self.ladder_id, self.get_kind_display(), self.happened_at)
+
+def _record_standings_event(ladder_id, kind, player_id = None, rank = None, when = None, arrow = None):
+    """ Appends one StandingsEvent, the same small row however many players are ranked. """
+    if when is None:
+        when = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    StandingsEvent.objects.create(ladder_id = ladder_id, kind = kind, player_id = player_id, rank = rank, arrow = arrow, happened_at = when)
+
+def _encode_standings(standings):
+    """ Packs a list of (player id, arrow) in rank order for a StandingsCheckpoint. """
+    return json.dumps({'players': [player_id for player_id, _arrow in standings],
+                       'down':    [player_id for player_id, arrow in standings if arrow == Rank.ARROW_DOWN]}, separators = (',', ':'))
+
+def _decode_standings(packed):
+    """ Unpacks a StandingsCheckpoint's standings into a list of (player id, arrow) in rank order. """
+    standings = json.loads(packed)
+    down = set(standings['down'])
+    return [(player_id, Rank.ARROW_DOWN if player_id in down else Rank.ARROW_UP) for player_id in standings['players']]
+
+def _take_standings_checkpoint(ladder_id, when = None, seed = False):
+    """ Records the ladder's current standings, for checkpoint_standings. """
+    if ladder_id is None:
+        return None
+    if when is None:
+        when = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    standings = Rank.objects.filter(ladder_id = ladder_id).order_by('rank').values_list('player_id', 'arrow')
+    return StandingsCheckpoint.objects.create(ladder_id = ladder_id, taken_at = when, standings = _encode_standings(standings), seed = seed)
+
+class RankHistory(models.Model):
+    """ One change to a player's rank on a ladder, only ever appended to. A rank of None means they left it. """
+    class Meta:
+        verbose_name_plural = "Rank history"
+        verbose_name        = "Rank history"
+        indexes             = [models.Index(fields=['player', 'ladder', 'recorded_at'], name='rank_history_player_idx')]
+
+    ladder      = models.ForeignKey(Ladder, null=False, blank=False, on_delete=CASCADE)
+    player      = models.ForeignKey('auth.User', null=False, blank=False, on_delete=CASCADE)
+    rank        = models.PositiveIntegerField(null=True, blank=True)
+    recorded_at = models.DateTimeField()
+
+    def __str__(self):
+        return "{0} #{1} at {2}".format(self.player_id, self.rank, self.recorded_at)
+
+def _record_rank_history(ladder_id, ranks, when = None):
+    """ Appends a RankHistory row for each (player id, rank) in `ranks`, all in one statement. """
+    if when is None:
+        when = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+    RankHistory.objects.bulk_create([RankHistory(ladder_id = ladder_id, player_id = player_id, rank = rank, recorded_at = when) for player_id, rank in ranks])
+
 def del_user_rank_adjustment(instance, sender, **kwargs):
     """ This updates all existing ranks on the ladder, and cancels all outstanding challenges. """
     
     if issubclass(sender, Rank):
-        # get a list of the remaining players with a larger (worse) rank
-        remainingPlayers = Rank.objects.filter(ladder = instance.ladder)
-
-        # if there are no players remaining players, we're done
-        if remainingPlayers == 0:
+        # a rank that was already detached from its ladder has nothing to shift
+        if instance.ladder_id is None:
             return
 
-        lowerRankedPlayers = remainingPlayers.filter(rank__gt = instance.rank)
-        if lowerRankedPlayers.count() > 0:
-            for player in lowerRankedPlayers:
-                player.rank -= 1
-                player.save()
+        remainingPlayers = Rank.objects.filter(ladder_id = instance.ladder_id)
+
+        with transaction.atomic():
+            # move every player with a larger (worse) rank up one spot, in a single statement
+            remainingPlayers.filter(rank__gt = instance.rank).update(rank = F('rank') - 1)
+            # The players below moving up aren't written to their histories, rank_series works it out from the leave event
+            left_at = datetime.datetime.utcnow().replace(tzinfo=utc)
+            _record_rank_history(instance.ladder_id, [(instance.player_id, None)], left_at)
+
+            # If the new last place has a down arrow, flip it up.
+            # if there is no last place, ignore that.
+            lastPlace = remainingPlayers.aggregate(Max('rank'))['rank__max']
+            if lastPlace is not None:
+                remainingPlayers.filter(rank = lastPlace, arrow = Rank.ARROW_DOWN).update(arrow = Rank.ARROW_UP)
+
+            # cancel all non-completed challenges
+            open_challenges = _get_user_challenges( instance.player_id, ladder = instance.ladder_id, statuses = (Challenge.STATUS_NOT_ACCEPTED, Challenge.STATUS_ACCEPTED) )
+            open_challenges.delete()
+
+            Ladder.objects.filter(pk = instance.ladder_id).update(player_count = F('player_count') - 1)
+            _record_standings_event(instance.ladder_id, StandingsEvent.KIND_LEAVE, instance.player_id, instance.rank, left_at)
+
+            _ladder_event(instance.ladder_id, 'leave', {'player': instance.player_id, 'rank': instance.rank})
+
+        _ladder_changed(instance.ladder_id)
+
+def add_user_rank_adjustment(instance, sender, created, raw = False, **kwargs):
+    """ A new rank adds a player to its ladder's count, starts their rank history and is recorded as a join.
+        A rank edited by hand adds to the player's rank history and is recorded as that one player moving.
+        Either moves the ladder on to a new version. """
+    if issubclass(sender, Rank) and not raw and instance.ladder_id is not None:
+        saved_at = datetime.datetime.utcnow().replace(tzinfo=utc)
+        _record_rank_history(instance.ladder_id, [(instance.player_id, instance.rank)], saved_at)
+        if created:
+            Ladder.objects.filter(pk = instance.ladder_id).update(player_count = F('player_count') + 1)
+            _record_standings_event(instance.ladder_id, StandingsEvent.KIND_JOIN, instance.player_id, instance.rank, saved_at)
+        else:
+            _record_standings_event(instance.ladder_id, StandingsEvent.KIND_MOVE, instance.player_id, instance.rank, saved_at, arrow = instance.arrow)
+        _ladder_changed(instance.ladder_id)
+
+def _match_result_ranks(winner_rank, loser_rank, rankings):
+    """ Returns (winner_rank, winner_arrow, loser_rank, loser_arrow) after a match on a ladder of `rankings` players. """
 
-        lastPlace = remainingPlayers.order_by('rank').last()
+    # If the winner is lower down on the ladder than the loser
+    if winner_rank > loser_rank :
+        # This swaps the ranks
+        winner_rank, loser_rank = loser_rank, winner_rank
 
-        # If the new last place has a down arrow, flip it up.
-        # if there is no last place, ignore that.
-        try:
-            if lastPlace.arrow == Rank.ARROW_DOWN:
-                lastPlace.arrow = Rank.ARROW_UP
-                lastPlace.save()
-        except AttributeError:
-            pass
+    # Loser gets an up arrow if they are at the bottom of the list.
+    loser_arrow = Rank.ARROW_DOWN if loser_rank < rankings else Rank.ARROW_UP
 
-        # get a list of all non-completed challenges
-        open_challenges = _get_user_challenges( instance.player, ladder = instance.ladder, statuses = (Challenge.STATUS_NOT_ACCEPTED, Challenge.STATUS_ACCEPTED) )
-        for challenge in open_challenges:
-            challenge.delete()
+    # Winner always gets an up arrow.
+    return winner_rank, Rank.ARROW_UP, loser_rank, loser_arrow
 
 def adjust_rank(instance, sender, **kwargs):
     if issubclass(sender, Match):
-        if not instance.winner:
+        if not instance.winner_id:
             # If there isn't a winner then why are we here?
             # What is our purpose in life if not to achieve where others have
             # failed?
             return
 
-        # Having two if statements like this is faster than having a single if/else for some reason
-        winner  = instance.challenger if instance.challenger == instance.winner else instance.challengee
-        loser   = instance.challenger if instance.challengee == instance.winner else instance.challengee
+        winner_id   = instance.winner_id
+        loser_id    = instance.loser_id
+        ladder_id   = instance.ladder_id
 
-        ladder  = instance.ladder
+        with transaction.atomic():
+            # Winner always gets an up arrow. Writing it first also takes the write lock on SQLite,
+            # which ignores select_for_update, so no other result can move these ranks between
+            # reading them below and writing them back.
+            Rank.objects.filter( ladder_id = ladder_id, player_id = winner_id ).update( arrow = Rank.ARROW_UP )
 
-        # Get current number of people ranked on the ladder.
-        rankings = ladder.ranked_players()
+            # Lock both rows, always in the same order, then read them.
+            # We should never allow unranked players to get this far
+            ranks = Rank.objects.select_for_update().filter( ladder_id = ladder_id, player_id__in = (winner_id, loser_id) ).order_by( 'player_id' )
+            ranks = dict( ranks.values_list( 'player_id', 'rank' ) )
 
-        # if rankings>0:
-        #     # The ladder is already initialized.
+            # Get current number of people ranked on the ladder.
+            rankings = Rank.objects.filter( ladder_id = ladder_id ).count()
 
-        #     # Now that we have a winner we need to give people actual ranks.
-        #     # If they don't have one, give them the current rankings +1.
-        #     # Challenger gets ranked higher by default because THEMS THE BREAKS
-        #     defaults = {'rank':rankings+1, 'arrow':Rank.ARROW_DOWN,}
-        #     winner_rank, _created = Rank.objects.get_or_create(player=winner, ladder=ladder, defaults=defaults)
-        #     loser_rank, _created = Rank.objects.get_or_create(player=loser, ladder=ladder, defaults=defaults)
+            winner_rank, winner_arrow, loser_rank, loser_arrow = _match_result_ranks( ranks[winner_id], ranks[loser_id], rankings )
 
-        # We should never allow unranked players to get this far
-        winner_rank = Rank.objects.only('rank').get( player = winner, ladder = ladder )
-        loser_rank  = Rank.objects.only('rank').get( player = loser,  ladder = ladder )
+            # Write both rows back in a single statement.
+            Rank.objects.filter( ladder_id = ladder_id, player_id__in = (winner_id, loser_id) ).update(
+                rank  = Case( When( player_id = winner_id, then = Value( winner_rank ) ), default = Value( loser_rank ) ),
+                arrow = Case( When( player_id = winner_id, then = Value( winner_arrow ) ), default = Value( loser_arrow ) ),
+            )
 
-        # If the winner is lower down on the ladder than the loser
-        if winner_rank.rank > loser_rank.rank :
-            old_winner_rank = winner_rank.rank
-            old_loser_rank  = loser_rank.rank
+            _record_rank_history( ladder_id, [(winner_id, winner_rank), (loser_id, loser_rank)], instance.date_complete )
 
-            # This swaps the ranks
-            winner_rank.rank = old_loser_rank
-            loser_rank.rank  = old_winner_rank
+            if instance.date_complete is not None :
+                Ladder.objects.filter( Q( last_match_at__isnull = True ) | Q( last_match_at__lt = instance.date_complete ), pk = ladder_id ).update( last_match_at = instance.date_complete )
 
-        # Loser gets an up arrow if they are at the bottom of the list.
-        loser_rank.arrow = Rank.ARROW_DOWN if loser_rank.rank < rankings else Rank.ARROW_UP
+            _ladder_event( ladder_id, 'match', {'match': instance.pk, 'ranks': [[winner_id, winner_rank, winner_arrow], [loser_id, loser_rank, loser_arrow]]} )
 
-        # Winner always gets an up arrow.
-        winner_rank.arrow = Rank.ARROW_UP
+        _ladder_changed(ladder_id)
 
-        winner_rank.save()
-        loser_rank.save()
+def adjust_rating(instance, sender, **kwargs):
+    if issubclass(sender, Match):
+        if not instance.winner_id or instance.ladder_id is None:
+            return
+
+        loser_id = instance.loser_id
+        if loser_id is None:
+            # One of the players has been deleted since the match was played.
+            return
+
+        with transaction.atomic():
+            ratings = Rating.objects.select_for_update().filter( ladder_id = instance.ladder_id, player_id__in = (instance.winner_id, loser_id) )
+            ratings = dict( (r.player_id, r) for r in ratings )
+
+            # A player's first match on the ladder gives them their starting rating.
+            for player_id in (instance.winner_id, loser_id) :
+                if player_id not in ratings :
+                    ratings[player_id], _created = Rating.objects.select_for_update().get_or_create( ladder_id = instance.ladder_id, player_id = player_id )
+
+            winner_rating = ratings[instance.winner_id]
+            loser_rating  = ratings[loser_id]
+
+            points = _elo_exchange( winner_rating.rating, loser_rating.rating )
+
+            winner_rating.rating  += points
+            winner_rating.matches += 1
+            loser_rating.rating   -= points
+            loser_rating.matches  += 1
+
+            winner_rating.save( update_fields = ['rating', 'matches'] )
+            loser_rating.save( update_fields = ['rating', 'matches'] )
+
+def challenge_changed(instance, sender, **kwargs):
+    """ Opening or closing a challenge changes who is busy on the ladder. """
+    if issubclass(sender, Challenge):
+        _ladder_changed(instance.ladder_id)
+
+def ladder_changed(instance, sender, **kwargs):
+    """ The ladder's own details are shown along with its standings. """
+    if issubclass(sender, Ladder):
+        _ladder_changed(instance.pk)
+
+def home_feed_changed(instance, sender, **kwargs):
+    """ Completed matches, ladders and their games are listed on the home page. """
+    if issubclass(sender, Match) and instance.date_complete is None:
+        return
+    _home_feed_changed()
 
 # After updating a Match, if there is a winner, adjust relevant Ranks
 post_save.connect(adjust_rank, sender = Match)
 
+# After updating a Match, if there is a winner, exchange rating points
+post_save.connect(adjust_rating, sender = Match)
+
+# After saving a User's Rank, count new players on the ladder, start their rank history and record the join.
+post_save.connect(add_user_rank_adjustment, sender = Rank)
+
 # After deleting a User's Rank, update all other Ranks up one.
-post_delete.connect(del_user_rank_adjustment, sender = Rank)
\ No newline at end of file
+post_delete.connect(del_user_rank_adjustment, sender = Rank)
+
+# Any change to a Challenge can change which players are busy.
+post_save.connect(challenge_changed, sender = Challenge)
+post_delete.connect(challenge_changed, sender = Challenge)
+
+# Renaming or deleting a ladder changes everything served under its slug.
+post_save.connect(ladder_changed, sender = Ladder)
+post_delete.connect(ladder_changed, sender = Ladder)
+
+# Completed matches and the ladder list make up the cached home page feed.
+post_save.connect(home_feed_changed, sender = Match)
+post_delete.connect(home_feed_changed, sender = Match)
+post_save.connect(home_feed_changed, sender = Ladder)
+post_delete.connect(home_feed_changed, sender = Ladder)
+post_save.connect(home_feed_changed, sender = Game)
+post_delete.connect(home_feed_changed, sender = Game)
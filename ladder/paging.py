@@ -0,0 +1,78 @@
+# coding=UTF-8
+import base64
+import binascii
+import datetime
+from django.db.models import Q
+from django.utils.timezone import utc
+
+MATCHES_PER_PAGE    = 25        # How many matches to show on each page of a match history
+
+_EPOCH              = datetime.datetime(1970, 1, 1, tzinfo=utc)
+_OLDER              = 'o'
+_NEWER              = 'n'
+
+class MatchPage(object):
+    """One page of a match history, with the opaque cursors of the pages on either side (None at the ends)."""
+    def __init__(self, matches, newer_cursor, older_cursor):
+        self.matches        = matches
+        self.newer_cursor   = newer_cursor
+        self.older_cursor   = older_cursor
+
+def _encode_cursor(direction, match):
+    """Packs the position of a match in the history (date_complete, id) into a url-safe token."""
+    micros = (match.date_complete - _EPOCH) // datetime.timedelta(microseconds = 1)
+    raw = "{0}:{1}:{2}".format(direction, micros, match.pk)
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+def _decode_cursor(token):
+    """Returns (direction, date_complete, id) for a token, or None when it isn't one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('ascii')
+        direction, micros, pk = raw.split(':')
+        if direction not in (_OLDER, _NEWER):
+            return None
+        return direction, _EPOCH + datetime.timedelta(microseconds = int(micros)), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, OverflowError):
+        return None
+
+def _get_match_page(querysets, cursor = None, per_page = MATCHES_PER_PAGE):
+    """Returns a MatchPage of completed matches, newest first, starting from the cursor.
+
+        Seeks straight to the cursor's (date_complete, id) instead of counting and skipping the rows
+        before it, so a page deep in a long history costs the same as the first one. Several querysets
+        (e.g. the matches a user challenged and the ones they defended) are each read up to one page
+        and merged, so each side can use its own index.
+    """
+    position = _decode_cursor(cursor) if cursor else None
+    direction = position[0] if position else _OLDER
+
+    if position is None:
+        seek = Q()
+    elif direction == _OLDER:
+        _direction, date_complete, pk = position
+        seek = Q(date_complete__lte = date_complete) & (Q(date_complete__lt = date_complete) | Q(id__lt = pk))
+    else:
+        _direction, date_complete, pk = position
+        seek = Q(date_complete__gte = date_complete) & (Q(date_complete__gt = date_complete) | Q(id__gt = pk))
+
+    ordering = ('-date_complete', '-id') if direction == _OLDER else ('date_complete', 'id')
+
+    # Read one row past the page to find out whether there is another page after it.
+    matches = []
+    for queryset in querysets:
+        matches.extend(queryset.filter(seek, date_complete__isnull = False).order_by(*ordering)[:per_page + 1])
+    matches.sort(key = lambda m: (m.date_complete, m.pk), reverse = (direction == _OLDER))
+
+    more = len(matches) > per_page
+    matches = matches[:per_page]
+
+    if direction == _NEWER:
+        matches.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = position is not None, more
+
+    newer_cursor = _encode_cursor(_NEWER, matches[0]) if matches and has_newer else None
+    older_cursor = _encode_cursor(_OLDER, matches[-1]) if matches and has_older else None
+
+    return MatchPage(matches, newer_cursor, older_cursor)
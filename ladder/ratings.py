@@ -0,0 +1,73 @@
+# coding=UTF-8
+from itertools import chain
+import numpy as np
+from django.db import connection, transaction
+from ladder.models import Match, Rating, ELO_INITIAL_RATING, ELO_K_FACTOR
+
+RESULTS_FETCH_SIZE = 10000     # Result rows read from the cursor at a time when replaying a ladder
+
+def _load_results(ladder):
+    """Returns (winner_ids, loser_ids) arrays for every completed match on the ladder, oldest first."""
+    results = Match.objects.filter( ladder = ladder, winner__isnull = False, date_complete__isnull = False,
+                                    challenger__isnull = False, challengee__isnull = False )
+    results = results.order_by( 'date_complete', 'id' ).values_list( 'challenger_id', 'challengee_id', 'winner_id' )
+
+    # Skip building a model for each of a million matches. The driver still hands over a tuple per row,
+    # but only RESULTS_FETCH_SIZE of them are held at a time before they're packed into an array.
+    sql, params = results.query.sql_with_params()
+    chunks = []
+    with connection.cursor() as cursor:
+        cursor.execute( sql, params )
+        while True :
+            fetched = cursor.fetchmany( RESULTS_FETCH_SIZE )
+            if not fetched :
+                break
+            chunks.append( np.fromiter( chain.from_iterable( fetched ), dtype = np.int64, count = len( fetched ) * 3 ) )
+
+    rows = np.concatenate( chunks ).reshape( -1, 3 ) if chunks else np.empty( (0, 3), dtype = np.int64 )
+
+    challengers, challengees, winners = rows[:, 0], rows[:, 1], rows[:, 2]
+    losers = np.where( winners == challengers, challengees, challengers )
+
+    return winners, losers
+
+def _replay_results(winners, losers, players, k = ELO_K_FACTOR):
+    """Plays every result in order and returns the final rating of each player index.
+
+        winners/losers are arrays of indices into the ratings. Every match depends on the ratings left by
+        the ones before it, so the exchange itself is a sequential scan over plain floats, which beats
+        splitting the history into independent numpy batches for the ladder sizes we see.
+    """
+    ratings = [ELO_INITIAL_RATING] * players
+
+    for w, l in zip( winners.tolist(), losers.tolist() ) :
+        winner_rating = ratings[w]
+        loser_rating  = ratings[l]
+        points        = k * ( 1.0 - 1.0 / ( 1.0 + 10.0 ** ( ( loser_rating - winner_rating ) / 400.0 ) ) )
+        ratings[w]    = winner_rating + points
+        ratings[l]    = loser_rating - points
+
+    return np.array( ratings )
+
+def replay_ladder_ratings(ladder):
+    """Recomputes every rating on a ladder from its match history and replaces the stored ratings.
+
+        Returns the number of matches that were replayed.
+    """
+    winners, losers = _load_results( ladder )
+
+    # Map user ids onto 0..n-1 so the ratings can live in a flat array.
+    player_ids, indices = np.unique( np.concatenate( (winners, losers) ), return_inverse = True )
+    winner_idx, loser_idx = indices[:len(winners)], indices[len(winners):]
+
+    ratings = _replay_results( winner_idx, loser_idx, len(player_ids) )
+    matches = np.bincount( indices, minlength = len(player_ids) )
+
+    new_ratings = [ Rating( ladder = ladder, player_id = player_id, rating = rating, matches = played )
+                    for player_id, rating, played in zip( player_ids.tolist(), ratings.tolist(), matches.tolist() ) ]
+
+    with transaction.atomic():
+        Rating.objects.filter( ladder = ladder ).delete()
+        Rating.objects.bulk_create( new_ratings, batch_size = 1000 )
+
+    return len(winners)
@@ -0,0 +1,75 @@
+# coding=UTF-8
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils.timezone import utc
+from ladder.cache import _ladder_changed
+from ladder.events import _ladder_event
+from ladder.models import Challenge, Ladder, Rank, StandingsEvent, _record_standings_event
+
+def _reset_weekday(now):
+    """Returns the Ladder.WEEKDAYS value for the day of `now`, where '0' is Sunday."""
+    return str( (now.weekday() + 1) % 7 )
+
+def _ladders_due(weekday, now):
+    """Returns the ids of the open ladders that reset on `weekday` and haven't been reset yet today."""
+    start_of_day = now.replace( hour = 0, minute = 0, second = 0, microsecond = 0 )
+
+    due = Ladder.objects.filter( Q( end_date__isnull = True ) | Q( end_date__gt = now ), weekly_reset = weekday )
+    due = due.filter( Q( last_reset__isnull = True ) | Q( last_reset__lt = start_of_day ) )
+
+    return list( due.order_by( 'id' ).values_list( 'id', flat = True ) )
+
+def reset_ladder(ladder_id, now):
+    """Gives every player on the ladder an up arrow and closes its unanswered challenges.
+
+        Accepted challenges already have a Match being played and are left alone. Returns
+        (ranks reset, challenges closed), or None if the ladder was already reset today.
+    """
+    start_of_day = now.replace( hour = 0, minute = 0, second = 0, microsecond = 0 )
+
+    with transaction.atomic():
+        # Claiming the ladder first also keeps two schedulers from resetting it twice
+        claimed = Ladder.objects.filter( Q( last_reset__isnull = True ) | Q( last_reset__lt = start_of_day ), pk = ladder_id ).update( last_reset = now )
+        if not claimed :
+            return None
+
+        ranks = Rank.objects.filter( ladder_id = ladder_id, arrow = Rank.ARROW_DOWN ).update( arrow = Rank.ARROW_UP )
+        _record_standings_event( ladder_id, StandingsEvent.KIND_RESET, when = now )
+        challenges = Challenge.objects.filter( ladder_id = ladder_id, accepted = Challenge.STATUS_NOT_ACCEPTED ).update( accepted = Challenge.STATUS_CANCELLED )
+
+        _ladder_changed( ladder_id )
+        _ladder_event( ladder_id, 'resync', {} )
+
+    return ranks, challenges
+
+def _reset_ladders_in_worker(ladder_ids, now):
+    """Resets a share of the ladders on a pool thread, which opens its own database connection and has to close it."""
+    try:
+        return [(ladder_id, reset_ladder( ladder_id, now )) for ladder_id in ladder_ids]
+    finally:
+        connections.close_all()
+
+def run_weekly_resets(weekday = None, now = None, workers = 4):
+    """Resets every ladder due on `weekday` (today by default), each in its own transaction.
+
+        Ladders don't share any rows, so they are spread over a pool of `workers` threads. SQLite
+        only allows one writer at a time, there the ladders are reset one after another instead.
+        Returns a list of (ladder id, result of reset_ladder).
+    """
+    if now is None :
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+    if weekday is None :
+        weekday = _reset_weekday( now )
+
+    ladder_ids = _ladders_due( weekday, now )
+
+    if workers <= 1 or len( ladder_ids ) <= 1 or connection.vendor == 'sqlite' :
+        return [(ladder_id, reset_ladder( ladder_id, now )) for ladder_id in ladder_ids]
+
+    # Every worker takes an interleaved share, so each thread only connects once
+    shares = [ladder_ids[i::workers] for i in range( workers )]
+    with ThreadPoolExecutor( max_workers = workers ) as pool :
+        results = pool.map( lambda share: _reset_ladders_in_worker( share, now ), shares )
+        return sorted( result for share in results for result in share )
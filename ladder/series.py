@@ -0,0 +1,154 @@
+# coding=UTF-8
+"""A player's rank over time on a ladder, downsampled for charts.
+
+    Every rank a player takes in a match, or joining, is appended to RankHistory as it happens, so
+    a player's series is one indexed range read however many matches they have played. A player
+    leaving moves everyone below them up one, that is read back from the ladder's leave events
+    instead of being written to every history it touches. Long series are cut down to the
+    number of points a chart can show with Largest-Triangle-Three-Buckets, which keeps the
+    peaks and drops a plain every-nth sample would miss. Times the player left the ladder are
+    kept as gaps (a rank of None) so the line isn't drawn across them.
+"""
+import datetime
+import heapq
+from django.utils.timezone import utc
+from ladder.cache import _get_cached_rank_series, _get_ladder_version, _set_cached_rank_series
+from ladder.models import RankHistory, StandingsEvent
+
+RANK_SERIES_POINTS      = 200     # Points returned when the caller doesn't ask for a number
+RANK_SERIES_MAX_POINTS  = 1000    # Most points a caller can ask for
+
+def _lttb(points, threshold):
+    """Picks `threshold` of the (x, y) points, always keeping the first and last, that best keep the line's shape."""
+    if threshold >= len(points):
+        return points
+    if threshold < 3:
+        return [points[0], points[-1]]
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # The average of the next bucket is the third corner of each candidate's triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(x for x, _y in next_bucket) / len(next_bucket)
+        avg_y = sum(y for _x, y in next_bucket) / len(next_bucket)
+
+        ax, ay = points[a]
+        best, best_area = None, -1
+        for j in range(int(i * every) + 1, next_start):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+def _downsample(series, threshold):
+    """Cuts a list of (timestamp, rank) down to about `threshold` points, keeping every gap where the rank is None.
+
+        Each unbroken run between gaps gets a share of the points in proportion to its length.
+    """
+    if len(series) <= threshold:
+        return series
+
+    runs, gaps, run = [], [], []
+    for point in series:
+        if point[1] is None:
+            runs.append(run)
+            gaps.append(point)
+            run = []
+        else:
+            run.append(point)
+    runs.append(run)
+
+    budget = max(threshold - len(gaps), 0)
+    ranked = sum(len(r) for r in runs) or 1
+    sampled = []
+    for i, run in enumerate(runs):
+        sampled.extend(_lttb(run, max(budget * len(run) // ranked, min(len(run), 2))))
+        if i < len(gaps):
+            sampled.append(gaps[i])
+    return sampled
+
+def _with_leaves(history, leaves):
+    """Merges the (datetime, rank) history with the (datetime, rank left from) of other players leaving,
+        adding a point one rank up each time someone above the player left."""
+    series = []
+    rank = None
+    changes = heapq.merge(((when, False, value) for when, value in history), ((when, True, value) for when, value in leaves), key = lambda change: change[:2])
+    for when, is_leave, value in changes:
+        if not is_leave:
+            rank = value
+            series.append((when, rank))
+        elif rank is not None and value is not None and value < rank:
+            rank -= 1
+            series.append((when, rank))
+    return series
+
+def player_rank_series(player_id, ladder_ids, points = RANK_SERIES_POINTS):
+    """Returns {ladder id: the player's rank history on it}, each a list of (datetime, rank) downsampled to about `points`.
+
+        Series are cached until their ladder's version changes, the rest are read together in two
+        queries, the player's history and the leaves since it started.
+    """
+    versions = dict((ladder_id, _get_ladder_version(ladder_id)) for ladder_id in ladder_ids)
+    series = {}
+    for ladder_id, version in versions.items():
+        cached = _get_cached_rank_series(ladder_id, version, player_id, points)
+        if cached is not None:
+            series[ladder_id] = cached
+
+    missing = [ladder_id for ladder_id in versions if ladder_id not in series]
+    if missing:
+        history = dict((ladder_id, []) for ladder_id in missing)
+        rows = RankHistory.objects.filter(player_id = player_id, ladder_id__in = missing).order_by('ladder_id', 'recorded_at', 'id')
+        for ladder_id, recorded_at, rank in rows.values_list('ladder_id', 'recorded_at', 'rank').iterator():
+            history[ladder_id].append((recorded_at, rank))
+
+        leaves = dict((ladder_id, []) for ladder_id in missing)
+        played = [ladder_id for ladder_id in missing if history[ladder_id]]
+        if played:
+            started = min(history[ladder_id][0][0] for ladder_id in played)
+            events = StandingsEvent.objects.filter(ladder_id__in = played, kind = StandingsEvent.KIND_LEAVE, happened_at__gt = started).exclude(player_id = player_id)
+            for ladder_id, happened_at, rank in events.order_by('ladder_id', 'happened_at', 'id').values_list('ladder_id', 'happened_at', 'rank').iterator():
+                leaves[ladder_id].append((happened_at, rank))
+
+        for ladder_id in missing:
+            points_held = [(when.timestamp(), rank) for when, rank in _with_leaves(history[ladder_id], leaves[ladder_id])]
+            series[ladder_id] = [(datetime.datetime.fromtimestamp(when, utc), rank) for when, rank in _downsample(points_held, points)]
+            _set_cached_rank_series(ladder_id, versions[ladder_id], player_id, points, series[ladder_id])
+
+    return series
+
+def rank_series(ladder_id, player_id, points = RANK_SERIES_POINTS):
+    """Returns the player's rank history on the ladder as a list of (datetime, rank), downsampled to about `points`."""
+    return player_rank_series(player_id, [ladder_id], points)[ladder_id]
+
+def _sparkline(series, width, height):
+    """Lays the series out as SVG polyline points, one string per unbroken run, with first place along the top."""
+    ranked = [rank for _when, rank in series if rank is not None]
+    if not ranked:
+        return []
+
+    start, end = series[0][0].timestamp(), series[-1][0].timestamp()
+    span = (end - start) or 1
+    worst = max(max(ranked) - 1, 1)
+
+    lines, line = [], []
+    for when, rank in series:
+        if rank is None:
+            lines.append(line)
+            line = []
+            continue
+        x = (when.timestamp() - start) * width / span if end > start else width / 2
+        line.append("{0:.1f},{1:.1f}".format(x, (rank - 1) * height / worst))
+    lines.append(line)
+
+    return [" ".join(line) for line in lines if line]
@@ -0,0 +1,136 @@
+# coding=UTF-8
+"""A ladder's standings held as plain arrays instead of Rank objects.
+
+    LadderState keeps the player ids in rank order in an array, an index from each player to
+    their position, and their arrows as one flag byte per position. Looking a player up, swapping
+    two players and finding the ranks a player can challenge are all constant time, and removing
+    a player is one move of the arrays' tails. It loads from the Rank table in one query and
+    writes back only the players it moved.
+
+    It is used where the whole ladder is read anyway: the targets on the standings page, imports
+    and rebuilding past standings. adjust_rank, del_user_rank_adjustment and _can_challenge_user
+    stay on the Rank table, where they read at most two rows and shift the rest with one UPDATE,
+    without building any Rank objects. Loading a LadderState for them would read every player on
+    each result instead, and caching one would serve ranks other workers have already moved.
+    Validation and target_ranks share _challengeable_ranks, so they can't disagree.
+"""
+from array import array
+from django.db.models import Case, CharField, IntegerField, Value, When
+from ladder.models import Rank, _challengeable_ranks, _match_result_ranks
+
+FLUSH_BATCH_SIZE = 100     # Players written back per UPDATE, small enough for SQLite's parameter limit
+
+_DOWN, _UP = 1, 0
+
+class LadderState(object):
+    """The standings of one ladder: `players[i]` is ranked i + 1, `down[i]` is set if they have a down arrow."""
+    def __init__(self, ladder_id, standings = ()):
+        standings = list(standings)
+        self.ladder_id  = ladder_id
+        self.players    = array('q', (player_id for player_id, _arrow in standings))
+        self.down       = bytearray(_DOWN if arrow == Rank.ARROW_DOWN else _UP for _player_id, arrow in standings)
+        self._positions = None
+        self._moved     = set()     # Players whose rank or arrow changed since it was loaded
+        self.joined     = []        # Players added since it was loaded
+
+    @classmethod
+    def load(cls, ladder_id):
+        """Reads the ladder's standings in a single query, without building any Rank objects."""
+        return cls(ladder_id, Rank.objects.filter(ladder_id = ladder_id).order_by('rank').values_list('player_id', 'arrow'))
+
+    def __len__(self):
+        return len(self.players)
+
+    def __contains__(self, player_id):
+        return player_id in self.positions
+
+    @property
+    def positions(self):
+        """{player id: position}, built on first use."""
+        if self._positions is None:
+            self._positions = dict((player_id, i) for i, player_id in enumerate(self.players))
+        return self._positions
+
+    def rank(self, player_id):
+        """The player's rank, or None if they aren't on the ladder."""
+        position = self.positions.get(player_id)
+        return None if position is None else position + 1
+
+    def arrow(self, player_id):
+        position = self.positions.get(player_id)
+        if position is None:
+            return None
+        return Rank.ARROW_DOWN if self.down[position] else Rank.ARROW_UP
+
+    def place(self, player_id, rank, arrow):
+        """Puts the player on `rank` with `arrow`. Whoever held the rank is expected to be placed elsewhere too."""
+        self.players[rank - 1] = player_id
+        self.down[rank - 1] = _DOWN if arrow == Rank.ARROW_DOWN else _UP
+        self.positions[player_id] = rank - 1
+        self._moved.add(player_id)
+
+    def append(self, player_id):
+        """Adds a new player at the bottom with an up arrow, the way join_ladder does. Returns their rank."""
+        self.positions[player_id] = len(self.players)
+        self.players.append(player_id)
+        self.down.append(_UP)
+        self.joined.append(player_id)
+        return len(self.players)
+
+    def play(self, winner_id, loser_id):
+        """Applies a result the way adjust_rank does and returns (winner rank, winner arrow, loser rank, loser arrow)."""
+        result = _match_result_ranks(self.rank(winner_id), self.rank(loser_id), len(self.players))
+        winner_rank, winner_arrow, loser_rank, loser_arrow = result
+        self.place(winner_id, winner_rank, winner_arrow)
+        self.place(loser_id, loser_rank, loser_arrow)
+        return result
+
+    def remove(self, player_id):
+        """Takes the player off the ladder the way del_user_rank_adjustment does, everyone below moves up one.
+
+            Only the players below move in the index. Leaving is saved by deleting the player's Rank,
+            so the ranks this shifts aren't written by flush().
+        """
+        position = self.positions.pop(player_id)
+        del self.players[position]
+        del self.down[position]
+        for i in range(position, len(self.players)):
+            self.positions[self.players[i]] = i
+
+        # The new last place can't have a down arrow
+        if self.players:
+            self.down[-1] = _UP
+
+    def target_ranks(self, player_id, up_distance, down_distance):
+        """The ranks the player's arrow lets them challenge, as a range, empty if they aren't on the ladder."""
+        position = self.positions.get(player_id)
+        if position is None:
+            return range(0)
+
+        return _challengeable_ranks(position + 1, self.arrow(player_id), up_distance, down_distance, len(self.players))
+
+    def packed(self):
+        """A list of (player id, arrow) in rank order."""
+        return [(player_id, Rank.ARROW_DOWN if down else Rank.ARROW_UP) for player_id, down in zip(self.players, self.down)]
+
+    def flush(self):
+        """Writes the players added or moved since loading back to the Rank table. Returns how many were written.
+
+            New players are inserted together, the moved ones are updated FLUSH_BATCH_SIZE at a time.
+        """
+        joined = set(self.joined)
+        Rank.objects.bulk_create([Rank(ladder_id = self.ladder_id, player_id = player_id, rank = self.rank(player_id), arrow = self.arrow(player_id))
+                                  for player_id in self.joined])
+
+        moved = [player_id for player_id in self._moved if player_id not in joined]
+        for start in range(0, len(moved), FLUSH_BATCH_SIZE):
+            batch = moved[start:start + FLUSH_BATCH_SIZE]
+            Rank.objects.filter(ladder_id = self.ladder_id, player_id__in = batch).update(
+                rank  = Case(*[When(player_id = player_id, then = Value(self.rank(player_id))) for player_id in batch], output_field = IntegerField()),
+                arrow = Case(*[When(player_id = player_id, then = Value(self.arrow(player_id))) for player_id in batch], output_field = CharField()),
+            )
+
+        written = len(joined) + len(moved)
+        self._moved = set()
+        self.joined = []
+        return written
@@ -1 +1,1165 @@
-# todo: write tests, y'know, when you have time (-:
\ No newline at end of file
+import asyncio
+import datetime
+import os
+import random
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import utc
+
+from elo.asgi import application
+from elo.models import UserProfile
+from ladder.cache import _bump_ladder_version
+from ladder.events import LocalBroker, get_broker
+from ladder.exceptions import ChallengeeOutOfRange, ChallengeOnCooldown, ChallengeStatusConflict, ParticipantBusy
+from ladder.expiry import expire_overdue_challenges
+from ladder.helpers import HOME_RECENT_MATCHES, _get_valid_targets
+from ladder.history import standings_at
+from ladder.management.commands.generate_ladder_data import Command as GenerateLadderData
+from ladder.imports import import_match_results
+from ladder.models import Challenge, Game, Ladder, Match, Rank, RankHistory, Rating, StandingsCheckpoint, StandingsEvent, _can_challenge_user, _cooldown_challenges, _elo_exchange, _take_standings_checkpoint
+from ladder.paging import MATCHES_PER_PAGE, _get_match_page
+from ladder.ratings import replay_ladder_ratings
+from ladder.resets import run_weekly_resets
+from ladder.series import _downsample, rank_series
+from ladder.state import LadderState
+
+def _make_ladder(name, size):
+    """Builds a ladder with `size` ranked players, without going through each object's save()."""
+    # Reload the ladder so the numeric fields aren't left as their string defaults
+    ladder = Ladder.objects.get(pk = Ladder.objects.create(name = name).pk)
+    User.objects.bulk_create([User(username = "{0}-{1}".format(ladder.slug, i)) for i in range(size)])
+    users = list(User.objects.filter(username__startswith = "{0}-".format(ladder.slug)).order_by('id'))
+    Rank.objects.bulk_create([Rank(ladder = ladder, player = user, rank = i + 1, arrow = Rank.ARROW_UP) for i, user in enumerate(users)])
+    Ladder.objects.filter(pk = ladder.pk).update(player_count = size)
+    ladder.player_count = size
+    # Nothing commits inside a TestCase, so move the ladder on from anything cached for an earlier test's ladder with its id
+    _bump_ladder_version(ladder.pk)
+    return ladder, users
+
+def _play_match(ladder, challenger, challengee, winner):
+    """Plays a result through Match.save, with the players' current ranks and arrows recorded on it."""
+    ranks = dict((player_id, (rank, arrow)) for player_id, rank, arrow in Rank.objects.filter(ladder = ladder).values_list('player_id', 'rank', 'arrow'))
+    return Match.objects.create(ladder = ladder, challenger = challenger, challengee = challengee, winner = winner,
+                                challenger_rank = ranks[challenger.pk][0], challenger_rank_icon = ranks[challenger.pk][1],
+                                challengee_rank = ranks[challengee.pk][0], challengee_rank_icon = ranks[challengee.pk][1],
+                                date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+
+class LeaveLadderTests(TestCase):
+    def test_leave_compacts_ranks(self):
+        ladder, users = _make_ladder("Leave", 5)
+        Rank.objects.filter(ladder = ladder, rank = 5).update(arrow = Rank.ARROW_DOWN)
+
+        Rank.objects.get(ladder = ladder, player = users[1]).delete()
+
+        ranks = list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', 'rank'))
+        self.assertEqual(ranks, [(users[0].pk, 1), (users[2].pk, 2), (users[3].pk, 3), (users[4].pk, 4)])
+        self.assertEqual(Rank.objects.get(ladder = ladder, rank = 4).arrow, Rank.ARROW_UP)
+
+    def test_leave_cancels_open_challenges(self):
+        ladder, users = _make_ladder("Leave", 3)
+        Challenge(ladder = ladder, challenger = users[1], challengee = users[0]).save()
+
+        Rank.objects.get(ladder = ladder, player = users[1]).delete()
+
+        self.assertFalse(Challenge.objects.filter(ladder = ladder).exists())
+
+    def test_leave_query_count_is_flat(self):
+        query_counts = []
+        for size in (10, 1000):
+            ladder, users = _make_ladder("Leave {0}".format(size), size)
+            top_rank = Rank.objects.get(ladder = ladder, rank = 1)
+
+            with CaptureQueriesContext(connection) as queries:
+                top_rank.delete()
+            query_counts.append(len(queries))
+
+            self.assertEqual(list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('rank', flat = True)), list(range(1, size)))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+class StandingsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _ladder(self, name, size):
+        ladder, users = _make_ladder(name, size)
+        UserProfile.objects.bulk_create([UserProfile(user = user, handle = user.username.upper()) for user in users])
+        Ladder.objects.filter(pk = ladder.pk).update(game = Game.objects.create(name = "{0} Game".format(name), abv = "SV{0}".format(size)))
+        Challenge(ladder = ladder, challenger = users[1], challengee = users[0]).save()
+        return ladder, users
+
+    def test_standings_query_count_is_fixed(self):
+        for size in (5, 50):
+            ladder, users = self._ladder("Standings {0}".format(size), size)
+            self.client.force_login(users[3])
+
+            # ladder, busy players, ranks with profiles, session, user, ladder state, profile, open challenges, matches
+            with self.assertNumQueries(9):
+                response = self.client.get(reverse('ladder:detail', args = (ladder.slug,)))
+            self.assertEqual([(r.player_id, busy) for r, busy in response.context['rank_list']],
+                             [(user.pk, i < 2) for i, user in enumerate(users)])
+
+    def test_repeat_views_are_served_from_the_cache_until_a_result(self):
+        ladder, users = self._ladder("Cached", 5)
+        url = reverse('ladder:detail', args = (ladder.slug,))
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual([q['sql'] for q in queries if 'ladder_rank' in q['sql']], [])
+        self.assertEqual([r.player_id for r, _busy in response.context['rank_list']], [user.pk for user in users])
+
+        match = Match(ladder = ladder, challenger = users[3], challengee = users[2], challenger_rank = 4, challengee_rank = 3,
+                      date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+        match.choose_winner(users[3])
+        with self.captureOnCommitCallbacks(execute = True):
+            match.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertTrue([q['sql'] for q in queries if 'ladder_rank' in q['sql']])
+        self.assertEqual([r.player_id for r, _busy in response.context['rank_list']], [users[0].pk, users[1].pk, users[3].pk, users[2].pk, users[4].pk])
+
+    def test_challenge_links_follow_ranks_the_cache_has_not_seen(self):
+        ladder, users = self._ladder("Linked", 6)
+        Challenge.objects.filter(ladder = ladder).delete()
+        url = reverse('ladder:detail', args = (ladder.slug,))
+        self.client.force_login(users[4])
+        self.assertEqual(self.client.get(url).context['challengables'], [3, 4])
+
+        # Moved by another worker whose version bump hasn't landed yet
+        Rank.objects.filter(ladder = ladder, player = users[4]).update(rank = 3)
+        Rank.objects.filter(ladder = ladder, player = users[2]).update(rank = 5)
+        challengables = self.client.get(url).context['challengables']
+        self.assertEqual(challengables, [1, 2])
+        for rank in challengables:
+            self.assertTrue(_can_challenge_user(users[4], Rank.objects.get(ladder = ladder, rank = rank).player, ladder))
+
+class ChallengeValidationTests(TestCase):
+    def test_challenge_is_validated_in_one_query(self):
+        ladder, users = _make_ladder("Validated", 6)
+        Challenge(ladder = ladder, challenger = users[5], challengee = users[4]).save()
+
+        # Both ranks, both busy flags and the cooldown come back together, with or without a cooldown
+        for cooldown in (0, 3):
+            Ladder.objects.filter(pk = ladder.pk).update(challenge_cooldown = cooldown)
+            ladder = Ladder.objects.get(pk = ladder.pk)
+            with self.assertNumQueries(1):
+                self.assertTrue(_can_challenge_user(users[3], users[1], ladder))
+            with self.assertNumQueries(1):
+                with self.assertRaises(ParticipantBusy):
+                    _can_challenge_user(users[3], users[4], ladder)
+            with self.assertNumQueries(1):
+                with self.assertRaises(ChallengeeOutOfRange):
+                    _can_challenge_user(users[3], users[0], ladder)
+
+class RatingTests(TestCase):
+    def _ratings(self, ladder):
+        return dict((player_id, (round(rating, 6), matches)) for player_id, rating, matches in Rating.objects.filter(ladder = ladder).values_list('player_id', 'rating', 'matches'))
+
+    def test_exchange_matches_known_values(self):
+        self.assertAlmostEqual(_elo_exchange(1500, 1500), 16.0)
+        self.assertAlmostEqual(_elo_exchange(1600, 1400), 7.688098, places = 6)
+        self.assertAlmostEqual(_elo_exchange(1400, 1600), 24.311902, places = 6)
+        self.assertAlmostEqual(_elo_exchange(1500, 1500, k = 16), 8.0)
+
+    def test_results_exchange_points(self):
+        ladder, users = _make_ladder("Rated", 4)
+
+        _play_match(ladder, users[3], users[2], users[3])
+        self.assertEqual(self._ratings(ladder), {users[3].pk: (1516.0, 1), users[2].pk: (1484.0, 1)})
+
+        # The rematch is an upset, so the points are worked out from the new ratings
+        _play_match(ladder, users[3], users[2], users[2])
+        self.assertEqual(self._ratings(ladder), {users[3].pk: (1498.530498, 2), users[2].pk: (1501.469502, 2)})
+
+        # A match without a winner doesn't change anything
+        Match.objects.create(ladder = ladder, challenger = users[1], challengee = users[0], date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+        self.assertEqual(Rating.objects.filter(ladder = ladder).count(), 2)
+
+    def test_replay_matches_the_incremental_ratings(self):
+        ladder, users = _make_ladder("Replayed", 6)
+        random.seed(3)
+        for _i in range(40):
+            challenger, challengee = random.sample(users, 2)
+            _play_match(ladder, challenger, challengee, random.choice((challenger, challengee)))
+        incremental = self._ratings(ladder)
+
+        Rating.objects.filter(ladder = ladder).update(rating = 0, matches = 0)
+        self.assertEqual(replay_ladder_ratings(ladder), 40)
+        self.assertEqual(self._ratings(ladder), incremental)
+
+        # Read a few rows at a time, with a last partial chunk
+        Rating.objects.filter(ladder = ladder).update(rating = 0, matches = 0)
+        with mock.patch('ladder.ratings.RESULTS_FETCH_SIZE', 7):
+            self.assertEqual(replay_ladder_ratings(ladder), 40)
+        self.assertEqual(self._ratings(ladder), incremental)
+
+        # A ladder without results has no ratings to replay
+        empty, _users = _make_ladder("Unplayed", 2)
+        self.assertEqual(replay_ladder_ratings(empty), 0)
+        self.assertFalse(Rating.objects.filter(ladder = empty).exists())
+
+class ChallengeTransitionTests(TestCase):
+    def _challenge(self, name):
+        ladder, users = _make_ladder(name, 4)
+        Challenge(ladder = ladder, challenger = users[3], challengee = users[2]).save()
+        return ladder, users, Challenge.objects.get(ladder = ladder)
+
+    def test_accept_opens_a_match(self):
+        ladder, users, challenge = self._challenge("Accepted")
+        match = challenge.accept()
+
+        self.assertEqual(Challenge.objects.get(pk = challenge.pk).accepted, Challenge.STATUS_ACCEPTED)
+        self.assertEqual((match.related_challenge_id, match.winner_id, match.challenger_rank, match.challengee_rank), (challenge.pk, None, 4, 3))
+
+    def test_decline_forfeits_to_the_challenger(self):
+        ladder, users, challenge = self._challenge("Declined")
+        challenge.forfeit()
+
+        self.assertEqual(Challenge.objects.get(pk = challenge.pk).accepted, Challenge.STATUS_FORFEIT)
+        match = Match.objects.get(related_challenge = challenge)
+        self.assertEqual((match.forfeit, match.winner_id), (True, users[3].pk))
+        self.assertIsNotNone(match.date_complete)
+        self.assertEqual(Rank.objects.get(ladder = ladder, player = users[3]).rank, 3)
+
+    def test_a_fresh_challenge_can_be_answered(self):
+        ladder, users = _make_ladder("Fresh", 3)
+        challenge = Challenge(ladder = ladder, challenger = users[2], challengee = users[1])
+        challenge.save()
+        challenge.accept()
+        self.assertEqual(Challenge.objects.get(pk = challenge.pk).accepted, Challenge.STATUS_ACCEPTED)
+
+    def test_stale_answers_conflict(self):
+        ladder, users, challenge = self._challenge("Stale")
+        stale = Challenge.objects.get(pk = challenge.pk)
+        challenge.accept()
+
+        # Declining or cancelling the copy loaded before it was accepted changes nothing
+        for answer in (stale.forfeit, stale.accept, stale.cancel):
+            with self.assertRaises(ChallengeStatusConflict):
+                answer()
+        self.assertEqual(Challenge.objects.get(pk = challenge.pk).accepted, Challenge.STATUS_ACCEPTED)
+        self.assertEqual(list(Match.objects.filter(ladder = ladder).values_list('winner_id', 'forfeit')), [(None, False)])
+
+        with self.assertRaises(ChallengeStatusConflict):
+            challenge.forfeit()
+        with self.assertRaises(ChallengeStatusConflict):
+            challenge.cancel()
+        self.assertEqual(Challenge.objects.get(pk = challenge.pk).accepted, Challenge.STATUS_ACCEPTED)
+
+class IndexUsageTests(TestCase):
+    LADDERS = 10
+    PLAYERS = 300
+    MATCHES = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        rng = random.Random(0)
+        cls.ladders = []
+        for i in range(cls.LADDERS):
+            ladder, users = _make_ladder("Indexed {0}".format(i), cls.PLAYERS)
+            cls.ladders.append((ladder, users))
+
+            Match.objects.bulk_create([Match(ladder = ladder, challenger = a, challengee = b, winner = a, date_challenged = now,
+                                             date_complete = now - datetime.timedelta(minutes = m))
+                                       for m, (a, b) in enumerate(rng.sample(users, 2) for _ in range(cls.MATCHES))])
+            Challenge.objects.bulk_create([Challenge(ladder = ladder, challenger = users[p + 1], challengee = users[p], date_issued = now,
+                                                     deadline = now + datetime.timedelta(days = p % 7), accepted = str(p % 6))
+                                           for p in range(0, cls.PLAYERS - 1, 2)])
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), "expected {0} in the plan for:\n{1}\n{2}".format(" or ".join(index_names), queryset.query, plan))
+
+    def test_hot_lookups_use_indexes(self):
+        ladder, users = self.ladders[3]
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+        # single_ladder_details: standings, busy players and recent matches
+        self.assertUsesIndex(Rank.objects.filter(ladder = ladder).order_by('rank'), 'rank_ladder_rank_idx')
+        self.assertUsesIndex(Challenge.objects.filter(ladder = ladder, accepted__in = (Challenge.STATUS_NOT_ACCEPTED, Challenge.STATUS_ACCEPTED)), 'challenge_ladder_status_idx')
+        self.assertUsesIndex(Match.objects.filter(ladder = ladder).order_by('-date_complete')[:25], 'match_ladder_completed_idx')
+
+        # issue_challenge: both participants' ranks
+        # (SQLite builds unique constraints into the table, so its index gets an automatic name)
+        self.assertUsesIndex(Rank.objects.filter(ladder = ladder, player__in = users[:2]), 'rank_unique_ladder_player', 'sqlite_autoindex_ladder_rank')
+
+        # overdue challenges
+        self.assertUsesIndex(Challenge.objects.filter(deadline__lt = now), 'challenge_deadline_idx')
+
+        # challenge cooldown: the challenger's recent challenges
+        ladder.challenge_cooldown = 7
+        self.assertUsesIndex(_cooldown_challenges(users[1], ladder), 'challenge_cooldown_idx')
+
+        # profile rank chart: the player's history on their ladders
+        self.assertUsesIndex(RankHistory.objects.filter(player = users[1], ladder_id__in = [ladder.pk]).order_by('ladder_id', 'recorded_at', 'id'), 'rank_history_player_idx')
+
+class ConcurrentResultTests(TransactionTestCase):
+    THREADS = 8
+    RESULTS_PER_THREAD = 25
+    MAX_ATTEMPTS = 100     # Saves tried per result before the table is taken to be stuck
+    RETRY_DELAY = 0.002    # Seconds added to the wait after each busy attempt, so the threads stop colliding
+
+    def _report_results(self, ladder, users, seed, errors):
+        rng = random.Random(seed)
+        try:
+            for _ in range(self.RESULTS_PER_THREAD):
+                challenger, challengee = rng.sample(users, 2)
+                match = Match(ladder = ladder, challenger = challenger, challengee = challengee, challenger_rank = 2, challengee_rank = 1,
+                              date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+                match.choose_winner(rng.choice((challenger, challengee)))
+
+                # SQLite's shared-cache test database reports a busy table instead of waiting for it.
+                for attempt in range(self.MAX_ATTEMPTS):
+                    try:
+                        match.save()
+                        break
+                    except OperationalError:
+                        match.pk = None
+                        time.sleep(self.RETRY_DELAY * (attempt + 1))
+                else:
+                    raise AssertionError("result not saved after {0} attempts".format(self.MAX_ATTEMPTS))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def test_concurrent_results_keep_ranks_a_permutation(self):
+        ladder, users = _make_ladder("Concurrent", 12)
+
+        errors = []
+        threads = [threading.Thread(target = self._report_results, args = (ladder, users, seed, errors)) for seed in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Match.objects.filter(ladder = ladder).count(), self.THREADS * self.RESULTS_PER_THREAD)
+        ranks = sorted(Rank.objects.filter(ladder = ladder).values_list('rank', flat = True))
+        self.assertEqual(ranks, list(range(1, len(users) + 1)))
+
+class GenerateLadderDataTests(TestCase):
+    def test_generated_history_is_consistent(self):
+        call_command('generate_ladder_data', users = 30, ladders = 2, players = 20, matches = 200, open = 3, seed = 1, stdout = StringIO())
+
+        self.assertEqual(UserProfile.objects.filter(user__username__startswith = "bench-").count(), 30)
+        for ladder in Ladder.objects.filter(name__startswith = "bench "):
+            self.assertEqual(sorted(Rank.objects.filter(ladder = ladder).values_list('rank', flat = True)), list(range(1, 21)))
+            self.assertEqual(Match.objects.filter(ladder = ladder, date_complete__isnull = False).count(), 200)
+            self.assertEqual(Challenge.objects.filter(ladder = ladder, accepted__in = (Challenge.STATUS_NOT_ACCEPTED, Challenge.STATUS_ACCEPTED)).count(), 3)
+            self.assertEqual(Rating.objects.filter(ladder = ladder).count(), 20)
+
+        # The hand-picked ids must leave the sequences usable
+        late = User.objects.create(username = "late")
+        Challenge.objects.bulk_create([Challenge(ladder = ladder, challenger = late, challengee = late, date_issued = datetime.datetime.utcnow().replace(tzinfo=utc),
+                                                 deadline = datetime.datetime.utcnow().replace(tzinfo=utc))])
+
+    def test_generated_history_is_checkpointed_as_of_its_dates(self):
+        call_command('generate_ladder_data', users = 30, ladders = 1, players = 20, matches = 300, open = 0, seed = 2, prefix = "dated", stdout = StringIO())
+        ladder = Ladder.objects.get(name = "dated Ladder 0")
+        matches = list(Match.objects.filter(ladder = ladder).order_by('date_complete'))
+
+        joined = set(StandingsEvent.objects.filter(ladder = ladder, kind = StandingsEvent.KIND_JOIN).values_list('happened_at', flat = True))
+        self.assertEqual(len(joined), 1)
+        self.assertLess(min(joined), matches[0].date_challenged)
+        self.assertEqual(StandingsEvent.objects.filter(ladder = ladder).count(), 20)
+        self.assertEqual(list(StandingsCheckpoint.objects.filter(ladder = ladder).order_by('taken_at').values_list('taken_at', flat = True)),
+                         [min(joined), matches[249].date_complete, matches[-1].date_complete])
+        # Going into every match, both players stood where the match says they did
+        for match in matches[::37] + matches[-1:]:
+            standings = dict((player_id, i + 1) for i, (player_id, _arrow) in enumerate(standings_at(ladder, match.date_challenged)))
+            self.assertEqual((standings[match.challenger_id], standings[match.challengee_id]), (match.challenger_rank, match.challengee_rank))
+        self.assertEqual(standings_at(ladder, matches[-1].date_complete), list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', 'arrow')))
+        for rank in Rank.objects.filter(ladder = ladder):
+            self.assertEqual(rank_series(ladder.pk, rank.player_id)[-1][1], rank.rank)
+
+    def test_ladder_nobody_can_challenge_on_is_left_without_matches(self):
+        ladder, users = _make_ladder("Frozen", 0)
+        Ladder.objects.filter(pk = ladder.pk).update(up_arrow = 0, down_arrow = 0)
+        ladder = Ladder.objects.get(pk = ladder.pk)
+        players = [User.objects.create(username = "frozen-{0}".format(i)).pk for i in range(4)]
+
+        command = GenerateLadderData(stdout = StringIO(), stderr = StringIO())
+        command._start(3)
+        command._play_history(ladder, players, 50, 0)
+
+        self.assertEqual(command.matches.pending, [])
+        self.assertEqual(list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', flat = True)), players)
+
+class MatchHistoryPagingTests(TestCase):
+    MATCHES = 130
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ladder, cls.users = _make_ladder("Paged", 4)
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        # Several matches share each timestamp, so the id has to break the ties
+        Match.objects.bulk_create([Match(ladder = cls.ladder, challenger = cls.users[m % 4], challengee = cls.users[(m + 1) % 4], winner = cls.users[m % 4],
+                                         date_challenged = now, date_complete = now - datetime.timedelta(minutes = m // 3))
+                                   for m in range(cls.MATCHES)])
+        cls.expected = list(Match.objects.filter(ladder = cls.ladder).order_by('-date_complete', '-id').values_list('id', flat = True))
+
+    def _walk(self, url, cursor_name):
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(url, {'cursor': cursor} if cursor else {})
+            page = response.context['page']
+            pages.append([m.pk for m in page.matches])
+            cursor = getattr(page, cursor_name)
+            if cursor is None:
+                return pages, page
+
+    def test_pages_cover_the_history_in_both_directions(self):
+        url = reverse('ladder:match_list', args = [self.ladder.slug])
+
+        older_pages, last_page = self._walk(url, 'older_cursor')
+        self.assertEqual([pk for page in older_pages for pk in page], self.expected)
+
+        newer_pages, cursor = [], last_page.newer_cursor
+        while cursor:
+            page = self.client.get(url, {'cursor': cursor}).context['page']
+            newer_pages.insert(0, [m.pk for m in page.matches])
+            cursor = page.newer_cursor
+        self.assertEqual(newer_pages, older_pages[:-1])
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        url = reverse('ladder:match_list', args = [self.ladder.slug])
+        first = self.client.get(url).context['page']
+        deep = _get_match_page([Match.objects.filter(ladder = self.ladder)], first.older_cursor)
+        for _ in range(3):
+            deep = _get_match_page([Match.objects.filter(ladder = self.ladder)], deep.older_cursor)
+
+        with CaptureQueriesContext(connection) as first_queries:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as deep_queries:
+            self.client.get(url, {'cursor': deep.older_cursor})
+
+        self.assertEqual(len(first_queries), len(deep_queries))
+        self.assertFalse([q for q in deep_queries.captured_queries if 'COUNT(' in q['sql']])
+        self.assertNotIn('OFFSET', deep_queries.captured_queries[-1]['sql'])
+
+    def test_bad_cursor_shows_the_first_page(self):
+        response = self.client.get(reverse('ladder:match_list', args = [self.ladder.slug]), {'cursor': 'not-a-cursor'})
+        self.assertEqual([m.pk for m in response.context['page'].matches], self.expected[:MATCHES_PER_PAGE])
+
+    def test_user_history_merges_both_sides(self):
+        user = self.users[1]
+        pages, _last = self._walk(reverse('user:match_list', args = [user.username]), 'older_cursor')
+
+        expected = list(Match.objects.filter(Q(challenger = user) | Q(challengee = user)).order_by('-date_complete', '-id').values_list('id', flat = True))
+        self.assertEqual([pk for page in pages for pk in page], expected)
+
+class HomeFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ladder, self.users = _make_ladder("Home", 4)
+        Ladder.objects.filter(pk = self.ladder.pk).update(game = Game.objects.create(name = "Home Game", abv = "HOME"))
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        Match.objects.bulk_create([Match(ladder = self.ladder, challenger = self.users[1], challengee = self.users[0], winner = self.users[1],
+                                         date_challenged = now, date_complete = now - datetime.timedelta(minutes = m)) for m in range(40)])
+
+    def test_anonymous_home_page_is_served_from_cache(self):
+        response = self.client.get(reverse('index'))
+        self.assertEqual(len(response.context['match_list']), HOME_RECENT_MATCHES)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertEqual(len(queries), 0)
+
+    def test_completed_match_refreshes_the_feed(self):
+        self.client.get(reverse('index'))
+
+        match = Match(ladder = self.ladder, challenger = self.users[3], challengee = self.users[2], challenger_rank = 4, challengee_rank = 3,
+                      date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+        match.choose_winner(self.users[3])
+        with self.captureOnCommitCallbacks(execute = True):
+            match.save()
+
+        self.assertEqual(self.client.get(reverse('index')).context['match_list'][0].pk, match.pk)
+
+class LadderCounterTests(TestCase):
+    def test_counters_follow_joins_leaves_and_results(self):
+        ladder, users = _make_ladder("Counted", 3)
+        joiner = User.objects.create(username = "joiner")
+
+        self.client.force_login(joiner)
+        self.client.post(reverse('ladder:join', args = [ladder.slug]))
+        self.assertEqual(Ladder.objects.get(pk = ladder.pk).players, 4)
+        self.assertEqual(Rank.objects.get(ladder = ladder, player = joiner).rank, 4)
+
+        Rank.objects.get(ladder = ladder, player = users[0]).delete()
+        self.assertEqual(Ladder.objects.get(pk = ladder.pk).players, 3)
+
+        self.assertEqual(Ladder.objects.get(pk = ladder.pk).latest_activity, "Never")
+        match = Match(ladder = ladder, challenger = users[2], challengee = users[1], challenger_rank = 2, challengee_rank = 1,
+                      date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+        match.choose_winner(users[2])
+        match.save()
+        self.assertEqual(Ladder.objects.get(pk = ladder.pk).latest_activity, match.date_complete)
+
+    def test_repair_recomputes_counters(self):
+        ladder, users = _make_ladder("Drifted", 5)
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        Match.objects.bulk_create([Match(ladder = ladder, challenger = users[1], challengee = users[0], winner = users[1],
+                                         date_challenged = now, date_complete = now - datetime.timedelta(minutes = m)) for m in range(3)])
+        Ladder.objects.filter(pk = ladder.pk).update(player_count = 42)
+
+        call_command('repair_ladder_counters', stdout = StringIO())
+
+        ladder = Ladder.objects.get(pk = ladder.pk)
+        self.assertEqual((ladder.players, ladder.latest_activity), (5, now))
+
+class AdminScaleTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(username = "admin", password = "admin", email = ""))
+
+    def _add_matches(self, ladder, users, count):
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        Match.objects.bulk_create([Match(ladder = ladder, challenger = users[1], challengee = users[0], winner = users[m % 2],
+                                         date_challenged = now, date_complete = now) for m in range(count)])
+
+    def test_match_changelist_query_count_is_flat(self):
+        ladder, users = _make_ladder("Admin", 2)
+        Ladder.objects.filter(pk = ladder.pk).update(game = Game.objects.create(name = "Admin Game", abv = "ADM"))
+        url = reverse('admin:ladder_match_changelist')
+
+        query_counts = []
+        for count in (2, 60):
+            self._add_matches(ladder, users, count)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(self.client.get(url, {'q': users[1].username}).context['cl'].result_count, 62)
+
+    def test_rank_inline_looks_players_up(self):
+        ladder, users = _make_ladder("Inline", 30)
+        UserProfile.objects.bulk_create([UserProfile(user = user, handle = user.username) for user in users])
+        Ladder.objects.filter(pk = ladder.pk).update(game = Game.objects.create(name = "Inline Game", abv = "INL"))
+
+        response = self.client.get(reverse('admin:ladder_ladder_change', args = [ladder.pk]))
+
+        self.assertContains(response, 'admin-autocomplete')
+        # Each row only carries its own player, not every user on the site
+        self.assertLess(response.content.decode().count('<option'), 5 * len(users))
+
+class ExpireChallengesTests(TestCase):
+    def _overdue(self, ladder, pairs, days = 1):
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        Challenge.objects.bulk_create([Challenge(ladder = ladder, challenger = challenger, challengee = challengee, date_issued = now - datetime.timedelta(days = 4),
+                                                 deadline = now - datetime.timedelta(days = days, minutes = i))
+                                       for i, (challenger, challengee) in enumerate(pairs)])
+        return list(Challenge.objects.filter(ladder = ladder, deadline__lt = now).order_by('deadline', 'id'))
+
+    def _state(self, ladder, users):
+        ranks = dict(Rank.objects.filter(ladder = ladder).values_list('player_id', 'rank'))
+        arrows = dict(Rank.objects.filter(ladder = ladder).values_list('player_id', 'arrow'))
+        ratings = dict((r.player_id, round(r.rating, 6)) for r in Rating.objects.filter(ladder = ladder))
+        return [(ranks[u.pk], arrows[u.pk], ratings.get(u.pk)) for u in users]
+
+    def test_bulk_expiry_matches_forfeiting_one_by_one(self):
+        bulk, bulk_users = _make_ladder("Bulk expiry", 8)
+        single, single_users = _make_ladder("Single expiry", 8)
+        Rank.objects.filter(ladder__in = (bulk, single), rank = 4).update(arrow = Rank.ARROW_DOWN)
+        pairs = lambda users: [(users[1], users[0]), (users[3], users[4]), (users[6], users[5])]
+
+        self._overdue(bulk, pairs(bulk_users))
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        Challenge.objects.bulk_create([Challenge(ladder = bulk, challenger = bulk_users[7], challengee = bulk_users[2], date_issued = now,
+                                                 deadline = now + datetime.timedelta(days = 1))])
+        self.assertEqual(expire_overdue_challenges(batch_size = 2), 2)
+        self.assertEqual(expire_overdue_challenges(batch_size = 2), 1)
+        self.assertEqual(expire_overdue_challenges(batch_size = 2), 0)
+
+        for challenge in self._overdue(single, pairs(single_users)):
+            challenge.forfeit()
+
+        self.assertEqual(self._state(bulk, bulk_users), self._state(single, single_users))
+        self.assertEqual(Challenge.objects.get(ladder = bulk, challenger = bulk_users[7]).accepted, Challenge.STATUS_NOT_ACCEPTED)
+        forfeits = Match.objects.filter(ladder = bulk).order_by('related_challenge__deadline')
+        self.assertEqual([(m.forfeit, m.winner_id == m.challenger_id, m.challenger_rank, m.challengee_rank) for m in forfeits],
+                         [(m.forfeit, m.winner_id == m.challenger_id, m.challenger_rank, m.challengee_rank)
+                          for m in Match.objects.filter(ladder = single).order_by('related_challenge__deadline')])
+        self.assertEqual(Ladder.objects.get(pk = bulk.pk).latest_activity, max(m.date_complete for m in forfeits))
+        history = lambda ladder, users: [list(RankHistory.objects.filter(ladder = ladder, player = u).order_by('recorded_at', 'id').values_list('rank', flat = True))
+                                         for u in users]
+        self.assertEqual(history(bulk, bulk_users), history(single, single_users))
+        for user, (rank, _arrow, _rating) in zip(bulk_users, self._state(bulk, bulk_users)):
+            if user not in (bulk_users[2], bulk_users[7]):
+                self.assertEqual(rank_series(bulk.pk, user.pk)[-1][1], rank)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        query_counts = []
+        for size in (10, 100):
+            ladder, users = _make_ladder("Expiry {0}".format(size), size * 2)
+            self._overdue(ladder, [(users[i + 1], users[i]) for i in range(0, size * 2, 2)])
+
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(expire_overdue_challenges(batch_size = size), size)
+            query_counts.append(len(queries))
+
+        # SQLite's limit on query parameters may split the bulk writes, but nothing runs per challenge
+        self.assertLessEqual(query_counts[1], query_counts[0] + 2)
+
+class WeeklyResetTests(TestCase):
+    def test_resets_ladders_due_today_once(self):
+        monday = datetime.datetime(2026, 10, 19, 6, 0, tzinfo = utc)
+        due, due_users = _make_ladder("Monday reset", 6)
+        other, other_users = _make_ladder("Tuesday reset", 6)
+        Ladder.objects.filter(pk = due.pk).update(weekly_reset = '1')
+        Ladder.objects.filter(pk = other.pk).update(weekly_reset = '2')
+        Rank.objects.filter(ladder__in = (due, other), rank__in = (2, 3)).update(arrow = Rank.ARROW_DOWN)
+
+        for ladder, users in ((due, due_users), (other, other_users)):
+            Challenge.objects.bulk_create([
+                Challenge(ladder = ladder, challenger = users[1], challengee = users[0], date_issued = monday, accepted = Challenge.STATUS_NOT_ACCEPTED),
+                Challenge(ladder = ladder, challenger = users[3], challengee = users[2], date_issued = monday, accepted = Challenge.STATUS_ACCEPTED),
+            ])
+
+        self.assertEqual(run_weekly_resets(now = monday), [(due.pk, (2, 1))])
+
+        self.assertFalse(Rank.objects.filter(ladder = due, arrow = Rank.ARROW_DOWN).exists())
+        self.assertEqual(dict(Challenge.objects.filter(ladder = due).values_list('challenger_id', 'accepted')),
+                         {due_users[1].pk: Challenge.STATUS_CANCELLED, due_users[3].pk: Challenge.STATUS_ACCEPTED})
+        self.assertEqual(Rank.objects.filter(ladder = other, arrow = Rank.ARROW_DOWN).count(), 2)
+        self.assertEqual(Challenge.objects.filter(ladder = other, accepted = Challenge.STATUS_NOT_ACCEPTED).count(), 1)
+        # Only arrows change, nobody moves rank
+        self.assertFalse(RankHistory.objects.filter(ladder = due).exists())
+
+        # Running the scheduler again the same day doesn't reset anything twice, next week does
+        self.assertEqual(run_weekly_resets(now = monday + datetime.timedelta(hours = 12)), [])
+        self.assertEqual(run_weekly_resets(now = monday + datetime.timedelta(days = 7)), [(due.pk, (0, 0))])
+
+    def test_command_takes_a_weekday_name(self):
+        ladder, users = _make_ladder("Sunday reset", 3)
+        Ladder.objects.filter(pk = ladder.pk).update(weekly_reset = '0')
+        Rank.objects.filter(ladder = ladder, rank = 2).update(arrow = Rank.ARROW_DOWN)
+
+        out = StringIO()
+        call_command('run_weekly_resets', weekday = 'sunday', stdout = out)
+
+        self.assertIn("Reset 1 ladder", out.getvalue())
+        self.assertFalse(Rank.objects.filter(ladder = ladder, arrow = Rank.ARROW_DOWN).exists())
+        self.assertIsNotNone(Ladder.objects.get(pk = ladder.pk).last_reset)
+
+class ChallengeCooldownTests(TestCase):
+    def test_cooldown_blocks_rechallenging_the_same_player(self):
+        ladder, users = _make_ladder("Cooldown", 6)
+        Ladder.objects.filter(pk = ladder.pk).update(challenge_cooldown = 3)
+        ladder = Ladder.objects.get(pk = ladder.pk)
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+
+        # users[3] (rank 4) played users[2] yesterday and users[1] a week ago, an old cancelled challenge doesn't count
+        Challenge.objects.bulk_create([
+            Challenge(ladder = ladder, challenger = users[3], challengee = users[2], date_issued = now - datetime.timedelta(days = 1), accepted = Challenge.STATUS_COMPLETED),
+            Challenge(ladder = ladder, challenger = users[3], challengee = users[1], date_issued = now - datetime.timedelta(days = 7), accepted = Challenge.STATUS_COMPLETED),
+            Challenge(ladder = ladder, challenger = users[4], challengee = users[3], date_issued = now - datetime.timedelta(days = 1), accepted = Challenge.STATUS_CANCELLED),
+        ])
+
+        state = LadderState.load(ladder.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(_get_valid_targets(users[3], state, ladder), [2])
+        self.assertEqual(_get_valid_targets(users[4], state, ladder), [3, 4])
+
+        with self.assertRaises(ChallengeOnCooldown):
+            Challenge(ladder = ladder, challenger = users[3], challengee = users[2]).save()
+        Challenge(ladder = ladder, challenger = users[3], challengee = users[1]).save()
+
+    def test_no_cooldown_allows_rechallenging(self):
+        ladder, users = _make_ladder("No cooldown", 3)
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        Challenge.objects.bulk_create([Challenge(ladder = ladder, challenger = users[1], challengee = users[0], date_issued = now, accepted = Challenge.STATUS_COMPLETED)])
+
+        state = LadderState.load(ladder.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(_get_valid_targets(users[1], state, ladder), [1])
+        Challenge(ladder = ladder, challenger = users[1], challengee = users[0]).save()
+
+class LadderEventsTests(TestCase):
+    def _scope(self, ladder_slug):
+        return {'type': 'http', 'method': 'GET', 'path': reverse('ladder:events', args = (ladder_slug,)), 'headers': [], 'query_string': b''}
+
+    def test_stream_pushes_rank_changes_after_commit(self):
+        ladder, users = _make_ladder("Live", 4)
+
+        def play():
+            with self.captureOnCommitCallbacks(execute = True):
+                match = Match.objects.create(ladder = ladder, challenger = users[2], challengee = users[1], winner = users[2], challenger_rank = 3, challengee_rank = 2,
+                                             date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+                Rank.objects.get(ladder = ladder, player = users[0]).delete()
+            return match.pk
+
+        async def scenario():
+            stream = ApplicationCommunicator(application, self._scope(ladder.slug))
+            await stream.send_input({'type': 'http.request', 'body': b''})
+            self.assertEqual((await stream.receive_output(5))['status'], 200)
+            self.assertTrue((await stream.receive_output(5))['body'].startswith(b'retry:'))
+
+            match_id = await sync_to_async(play)()
+            match_event = (await stream.receive_output(5))['body'].decode()
+            leave_event = (await stream.receive_output(5))['body'].decode()
+
+            await stream.send_input({'type': 'http.disconnect'})
+            await stream.wait(5)
+            return match_id, match_event, leave_event
+
+        match_id, match_event, leave_event = async_to_sync(scenario)()
+
+        self.assertEqual(match_event, 'event: match\ndata: {{"match":{0},"ranks":[[{1},2,"0"],[{2},3,"1"]]}}\n\n'.format(match_id, users[2].pk, users[1].pk))
+        self.assertEqual(leave_event, 'event: leave\ndata: {{"player":{0},"rank":1}}\n\n'.format(users[0].pk))
+        # The closed stream no longer holds a subscription
+        self.assertEqual(get_broker().subscriber_count("ladder:{0}".format(ladder.pk)), 0)
+
+    def test_unknown_ladder_and_wsgi_fallback(self):
+        ladder, users = _make_ladder("Polled", 2)
+
+        async def scenario():
+            stream = ApplicationCommunicator(application, self._scope("no-such-ladder"))
+            await stream.send_input({'type': 'http.request', 'body': b''})
+            return (await stream.receive_output(5))['status']
+
+        self.assertEqual(async_to_sync(scenario)(), 404)
+        response = self.client.get(reverse('ladder:events', args = (ladder.slug,)))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.content.startswith(b'retry:'))
+
+    def test_local_broker_fans_out_to_many_idle_subscribers(self):
+        broker = LocalBroker()
+
+        async def scenario():
+            subscriptions = [broker.subscribe("ladder:1") for _ in range(5000)]
+            broker.publish("ladder:1", b"event: resync\ndata: {}\n\n")
+            broker.publish("ladder:2", b"ignored")
+            frames = await asyncio.gather(*[subscription.get() for subscription in subscriptions])
+            for subscription in subscriptions:
+                subscription.close()
+            return frames
+
+        frames = async_to_sync(scenario)()
+        self.assertEqual(set(frames), {b"event: resync\ndata: {}\n\n"})
+        self.assertEqual(len(frames), 5000)
+        self.assertEqual(broker.subscriber_count("ladder:1"), 0)
+
+class JsonApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _ladder(self):
+        ladder, users = _make_ladder("Api", 4)
+        UserProfile.objects.bulk_create([UserProfile(user = user, handle = user.username.upper()) for user in users])
+        Ladder.objects.filter(pk = ladder.pk).update(game = Game.objects.create(name = "Api Game", abv = "API"))
+        return ladder, users
+
+    def test_unchanged_ladder_answers_conditional_gets_without_queries(self):
+        ladder, users = self._ladder()
+        urls = [reverse('api:standings', args = (ladder.slug,)), reverse('api:matches', args = (ladder.slug,)),
+                reverse('api:player', args = (ladder.slug, users[1].username))]
+
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH = response['ETag']).status_code, 304)
+                # A time can't tell a challenge opened since apart from no change, only the ETag is offered
+                self.assertFalse(response.has_header('Last-Modified'))
+                self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE = 'Sat, 01 Jan 2050 00:00:00 GMT').status_code, 200)
+                # Unconditional requests are served from the cache too
+                self.assertEqual(self.client.get(url).content, response.content)
+
+        standings = self.client.get(urls[0]).json()
+        self.assertEqual([(p['username'], p['rank'], p['arrow']) for p in standings['standings']],
+                         [(user.username, i + 1, 'up') for i, user in enumerate(users)])
+        self.assertEqual(standings['ladder']['game'], "Api Game")
+
+    def test_a_result_changes_the_etag(self):
+        ladder, users = self._ladder()
+        url = reverse('api:player', args = (ladder.slug, users[2].username))
+        etag = self.client.get(url)['ETag']
+
+        with self.captureOnCommitCallbacks(execute = True):
+            Match.objects.create(ladder = ladder, challenger = users[2], challengee = users[1], winner = users[2], challenger_rank = 3, challengee_rank = 2,
+                                 date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        summary = response.json()
+        self.assertEqual((summary['player']['rank'], summary['player']['wins'], summary['player']['losses']), (2, 1, 0))
+        self.assertEqual(summary['matches'][0]['winner']['username'], users[2].username)
+
+    def test_renamed_ladder_drops_the_old_slug(self):
+        ladder, users = self._ladder()
+        old_url = reverse('api:standings', args = (ladder.slug,))
+        self.assertEqual(self.client.get(old_url).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute = True):
+            ladder = Ladder.objects.get(pk = ladder.pk)
+            ladder.name = "Api Renamed"
+            ladder.save()
+
+        self.assertEqual(self.client.get(old_url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('api:standings', args = (ladder.slug,))).status_code, 200)
+        self.assertEqual(self.client.get(reverse('api:standings', args = ("no-such-ladder",))).status_code, 404)
+
+class ImportMatchesTests(TestCase):
+    def test_import_replays_ranks_like_playing_each_match(self):
+        imported, imported_users = _make_ladder("Imported", 6)
+        played, played_users = _make_ladder("Played", 6)
+        newcomer = User.objects.create(username = "imported-newcomer")
+        start = datetime.datetime(2020, 1, 1, tzinfo = utc)
+        results = [(3, 1, 3), (5, 4, 5), (2, 0, 0), (4, 3, 4), (1, 0, 1)]
+
+        rows = ["date,challenger,challengee,winner,forfeit"]
+        rows += ["{0},{1},{2},{3},{4}".format((start + datetime.timedelta(days = i)).isoformat(), imported_users[a].username,
+                                               imported_users[b].username, imported_users[w].username, "yes" if i == 2 else "")
+                 for i, (a, b, w) in enumerate(results)]
+        rows.append("2020-02-01,{0},{1},{0},".format(newcomer.username, imported_users[0].username))
+
+        path = os.path.join(tempfile.mkdtemp(), "results.csv")
+        with open(path, 'w') as results_file:
+            results_file.write("\n".join(rows) + "\n")
+        out = StringIO()
+        call_command('import_matches', path, ladder = imported.slug, chunk_size = 2, stdout = out)
+        self.assertIn("Imported 6 matches", out.getvalue())
+
+        # The same results, reported one at a time through Match.save
+        for a, b, w in results:
+            ranks = dict(Rank.objects.filter(ladder = played).values_list('player_id', 'rank'))
+            Match.objects.create(ladder = played, challenger = played_users[a], challengee = played_users[b], winner = played_users[w],
+                                 challenger_rank = ranks[played_users[a].pk], challengee_rank = ranks[played_users[b].pk],
+                                 date_challenged = start)
+        Rank.objects.create(ladder = played, player = User.objects.create(username = "played-newcomer"), rank = 7)
+        ranks = dict(Rank.objects.filter(ladder = played).values_list('player_id', 'rank'))
+        newcomer_played = User.objects.get(username = "played-newcomer")
+        Match.objects.create(ladder = played, challenger = newcomer_played, challengee = played_users[0], winner = newcomer_played,
+                             challenger_rank = 7, challengee_rank = ranks[played_users[0].pk], date_challenged = start)
+
+        def standings(ladder, users):
+            rows = Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', 'arrow')
+            names = dict((user.pk, i) for i, user in enumerate(users))
+            return [(names[player_id], arrow) for player_id, arrow in rows]
+
+        self.assertEqual(standings(imported, imported_users + [newcomer]), standings(played, played_users + [newcomer_played]))
+        self.assertEqual(sorted(round(r, 6) for r in Rating.objects.filter(ladder = imported).values_list('rating', flat = True)),
+                         sorted(round(r, 6) for r in Rating.objects.filter(ladder = played).values_list('rating', flat = True)))
+
+        ladder = Ladder.objects.get(pk = imported.pk)
+        self.assertEqual((ladder.player_count, ladder.last_match_at), (7, datetime.datetime(2020, 2, 1, tzinfo = utc)))
+        self.assertEqual(Match.objects.filter(ladder = ladder, forfeit = True).count(), 1)
+
+    def test_invalid_row_imports_nothing(self):
+        ladder, users = _make_ladder("Rejected", 3)
+        rows = [(1, {'date': "2020-01-01T10:00:00", 'challenger': users[1].username, 'challengee': users[0].username, 'winner': users[1].username}),
+                (2, {'date': "2020-01-02T10:00:00", 'challenger': users[2].username, 'challengee': "nobody", 'winner': users[2].username})]
+
+        with self.assertRaisesRegex(ValueError, "line 2: unknown player 'nobody'"):
+            import_match_results(ladder, iter(rows), chunk_size = 1)
+
+        self.assertFalse(Match.objects.filter(ladder = ladder).exists())
+        self.assertEqual(list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', flat = True)), [u.pk for u in users])
+
+        with self.assertRaisesRegex(ValueError, "line 2: results must be in the order"):
+            import_match_results(ladder, iter([rows[0], (2, dict(rows[0][1], date = "2019-12-31"))]))
+
+    def test_import_before_a_recorded_join_is_refused(self):
+        ladder, users = _make_ladder("Joined since", 2)
+        _take_standings_checkpoint(ladder.pk, datetime.datetime(2019, 6, 1, tzinfo = utc), seed = True)
+        Rank.objects.create(ladder = ladder, player = User.objects.create(username = "joined-since-late"), rank = 3)
+        rows = [(1, {'date': "2020-01-01", 'challenger': users[1].username, 'challengee': users[0].username, 'winner': users[1].username})]
+
+        with self.assertRaisesRegex(ValueError, "line 1: the ladder's standings changed on"):
+            import_match_results(ladder, iter(rows))
+
+        # Nothing recorded was thrown away
+        self.assertEqual(StandingsEvent.objects.filter(ladder = ladder, kind = StandingsEvent.KIND_JOIN).count(), 1)
+        self.assertEqual(StandingsCheckpoint.objects.filter(ladder = ladder).count(), 1)
+        self.assertFalse(Match.objects.filter(ladder = ladder).exists())
+
+class StandingsHistoryTests(TestCase):
+    def _now(self):
+        return list(Rank.objects.filter(ladder = self.ladder).order_by('rank').values_list('player_id', 'arrow'))
+
+    def _play_history(self):
+        """Plays matches around a join and a leave, returning (when, standings) after each step."""
+        self.ladder, users = _make_ladder("History", 5)
+        # The players were ranked without going through Rank.save, checkpoint them as if they had joined
+        _take_standings_checkpoint(self.ladder.pk)
+        moments = []
+
+        def snapshot():
+            moments.append((datetime.datetime.utcnow().replace(tzinfo=utc), self._now()))
+
+        snapshot()
+        for challenger, challengee, winner in ((1, 0, 1), (3, 2, 3), (4, 3, 3), (2, 1, 2)):
+            _play_match(self.ladder, users[challenger], users[challengee], users[winner])
+            snapshot()
+
+        newcomer = User.objects.create(username = "history-newcomer")
+        Rank.objects.create(ladder = self.ladder, player = newcomer, rank = 6)
+        snapshot()
+        _play_match(self.ladder, newcomer, users[4], newcomer)
+        snapshot()
+
+        Rank.objects.get(ladder = self.ladder, player = users[2]).delete()
+        snapshot()
+        _play_match(self.ladder, users[3], users[0], users[3])
+        snapshot()
+        return moments
+
+    def test_rebuilds_every_moment_of_the_history(self):
+        moments = self._play_history()
+
+        # Only the first players were checkpointed, the join and the leave are one small event each
+        self.assertEqual(StandingsCheckpoint.objects.filter(ladder = self.ladder).count(), 1)
+        self.assertEqual(list(StandingsEvent.objects.filter(ladder = self.ladder).order_by('happened_at').values_list('kind', 'rank')),
+                         [(StandingsEvent.KIND_JOIN, 6), (StandingsEvent.KIND_LEAVE, 1)])
+
+        # Reading only reads
+        with CaptureQueriesContext(connection) as queries:
+            for when, standings in moments:
+                self.assertEqual(standings_at(self.ladder, when), standings)
+        self.assertEqual([q['sql'] for q in queries if not q['sql'].startswith('SELECT')], [])
+        self.assertEqual(StandingsCheckpoint.objects.filter(ladder = self.ladder).count(), 1)
+
+    def test_hand_edits_are_one_event_each(self):
+        moments = self._play_history()
+        first, second = Rank.objects.filter(ladder = self.ladder).order_by('rank')[:2]
+
+        # An admin swaps the top two, giving the new leader a down arrow. The rank, its history and the event, whatever the ladder's size.
+        first.rank = 2
+        with self.assertNumQueries(3):
+            first.save()
+        second.rank, second.arrow = 1, Rank.ARROW_DOWN
+        second.save()
+        moments.append((datetime.datetime.utcnow().replace(tzinfo=utc), self._now()))
+
+        self.assertEqual(StandingsCheckpoint.objects.filter(ladder = self.ladder).count(), 1)
+        self.assertEqual(list(StandingsEvent.objects.filter(ladder = self.ladder, kind = StandingsEvent.KIND_MOVE).order_by('id').values_list('player_id', 'rank', 'arrow')),
+                         [(first.player_id, 2, Rank.ARROW_UP), (second.player_id, 1, Rank.ARROW_DOWN)])
+        for when, standings in moments:
+            self.assertEqual(standings_at(self.ladder, when), standings)
+        for rank in (first, second):
+            self.assertEqual(rank_series(self.ladder.pk, rank.player_id)[-1][1], rank.rank)
+
+    def test_history_from_before_checkpoints_is_undone_from_the_first(self):
+        self.ladder, users = _make_ladder("Older history", 5)
+        StandingsCheckpoint.objects.filter(ladder = self.ladder).delete()
+        moments = [(datetime.datetime.utcnow().replace(tzinfo=utc), self._now())]
+        for challenger, challengee, winner in ((1, 0, 1), (3, 2, 3), (4, 3, 3), (2, 1, 2), (1, 0, 0)):
+            _play_match(self.ladder, users[challenger], users[challengee], users[winner])
+            moments.append((datetime.datetime.utcnow().replace(tzinfo=utc), self._now()))
+
+        for when, standings in moments:
+            self.assertEqual(standings_at(self.ladder, when), standings)
+
+    def test_checkpoints_bound_the_replay(self):
+        moments = self._play_history()
+
+        with mock.patch('ladder.history.CHECKPOINT_INTERVAL', 1):
+            call_command('checkpoint_standings', self.ladder.slug, stdout = StringIO())
+        self.assertGreater(StandingsCheckpoint.objects.filter(ladder = self.ladder).count(), 5)
+
+        for when, standings in moments:
+            # The nearest checkpoint and the change after it
+            with self.assertNumQueries(3):
+                self.assertEqual(standings_at(self.ladder, when), standings)
+
+    def test_backdated_import_is_checkpointed_as_of_its_dates(self):
+        ladder = Ladder.objects.create(name = "Backdated")
+        users = [User.objects.create(username = "backdated-{0}".format(i)) for i in range(4)]
+        rows = [(i + 1, {'date': "2020-01-0{0}".format(i + 1), 'challenger': users[a].username, 'challengee': users[b].username, 'winner': users[w].username})
+                for i, (a, b, w) in enumerate(((1, 0, 1), (2, 3, 3), (2, 1, 2)))]
+
+        with mock.patch('ladder.imports.CHECKPOINT_INTERVAL', 1):
+            self.assertEqual(import_match_results(ladder, iter(rows)), (3, 4))
+
+        # Everyone joined with their first result
+        self.assertEqual(list(StandingsEvent.objects.filter(ladder = ladder).order_by('happened_at', 'id').values_list('kind', 'player_id', 'rank', 'happened_at')),
+                         [(StandingsEvent.KIND_JOIN, users[p].pk, r, datetime.datetime(2020, 1, d, tzinfo = utc)) for p, r, d in ((1, 1, 1), (0, 2, 1), (2, 3, 2), (3, 4, 2))])
+        self.assertEqual([rank for _when, rank in rank_series(ladder.pk, users[3].pk)], [4, 3])
+
+        # Just before the first result, then after each day's results
+        self.assertEqual(list(StandingsCheckpoint.objects.filter(ladder = ladder).order_by('taken_at').values_list('taken_at', flat = True)),
+                         [datetime.datetime(2019, 12, 31, 23, 59, 59, 999999, tzinfo = utc)] + [datetime.datetime(2020, 1, d, tzinfo = utc) for d in (1, 2, 3)])
+
+        up = Rank.ARROW_UP
+        at = lambda *args: standings_at(ladder, datetime.datetime(*args, tzinfo = utc))
+        self.assertEqual(at(2019, 6, 1), [])
+        self.assertEqual(at(2020, 1, 1, 12), [(users[1].pk, up), (users[0].pk, up)])
+        self.assertEqual(at(2020, 1, 2, 12), [(users[1].pk, up), (users[0].pk, up), (users[3].pk, up), (users[2].pk, up)])
+        self.assertEqual(at(2021, 1, 1), list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', 'arrow')))
+        self.assertEqual(at(2021, 1, 1), [(users[2].pk, up), (users[0].pk, up), (users[3].pk, up), (users[1].pk, up)])
+
+        # Without the interval checkpoints the history is played from the start
+        StandingsCheckpoint.objects.filter(ladder = ladder).delete()
+        self.assertEqual(at(2020, 1, 2, 12), [(users[1].pk, up), (users[0].pk, up), (users[3].pk, up), (users[2].pk, up)])
+
+    def test_ladder_page_and_api_take_a_date(self):
+        moments = self._play_history()
+        UserProfile.objects.bulk_create([UserProfile(user = user, handle = user.username) for user in User.objects.filter(userprofile__isnull = True)])
+        Ladder.objects.filter(pk = self.ladder.pk).update(game = Game.objects.create(name = "History Game", abv = "HIS"))
+        when, standings = moments[2]
+
+        response = self.client.get(reverse('ladder:detail', args = (self.ladder.slug,)), {'at': when.isoformat()})
+        self.assertEqual([(rank.player_id, rank.arrow) for rank, _busy in response.context['rank_list']], standings)
+        self.assertContains(response, "Standings as of")
+
+        url = reverse('api:standings', args = (self.ladder.slug,))
+        api = self.client.get(url, {'at': when.isoformat()}).json()
+        self.assertEqual([p['username'] for p in api['standings']], [User.objects.get(pk = p).username for p, _arrow in standings])
+        self.assertEqual(self.client.get(url, {'at': "yesterday"}).status_code, 400)
+
+        # Every date up to the next change is the same response, only finding the last change costs a query
+        self.assertLess(api['at'], when.isoformat())
+        for later in range(1, 6):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(url, {'at': (when + datetime.timedelta(microseconds = later)).isoformat()}).json(), api)
+        self.assertEqual(self.client.get(url, {'at': "1999-01-01"}).json()['at'], None)
+
+class RankHistoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _history(self, ladder, user):
+        return list(RankHistory.objects.filter(ladder = ladder, player = user).order_by('recorded_at', 'id').values_list('rank', flat = True))
+
+    def test_joins_results_and_leaves_append_to_the_history(self):
+        ladder, users = _make_ladder("Charted", 3)
+        newcomer = User.objects.create(username = "charted-newcomer")
+        Rank.objects.create(ladder = ladder, player = newcomer, rank = 4)
+
+        Match.objects.create(ladder = ladder, challenger = newcomer, challengee = users[2], winner = newcomer, challenger_rank = 4, challengee_rank = 3,
+                             date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+
+        # Leaving writes the leaver's gap and one event, the players below aren't touched
+        recorded = RankHistory.objects.filter(ladder = ladder).count()
+        Rank.objects.get(ladder = ladder, player = users[0]).delete()
+        self.assertEqual(RankHistory.objects.filter(ladder = ladder).count(), recorded + 1)
+
+        self.assertEqual(self._history(ladder, newcomer), [4, 3])
+        self.assertEqual(self._history(ladder, users[2]), [4])
+        self.assertEqual(self._history(ladder, users[1]), [])
+        self.assertEqual(self._history(ladder, users[0]), [None])
+        self.assertEqual(StandingsEvent.objects.filter(ladder = ladder, kind = StandingsEvent.KIND_LEAVE).values_list('player_id', 'rank').get(), (users[0].pk, 1))
+
+        # The series works out the move up from the leave
+        self.assertEqual([rank for _when, rank in rank_series(ladder.pk, newcomer.pk)], [4, 3, 2])
+        self.assertEqual([rank for _when, rank in rank_series(ladder.pk, users[2].pk)], [4, 3])
+        self.assertEqual(rank_series(ladder.pk, users[1].pk), [])
+        for rank in Rank.objects.filter(ladder = ladder).exclude(player = users[1]):
+            self.assertEqual(rank_series(ladder.pk, rank.player_id)[-1][1], rank.rank)
+
+    def test_downsampling_keeps_the_ends_the_peaks_and_the_gaps(self):
+        series = [(t, 20 + t % 3) for t in range(10000)]
+        series[4000] = (4000, 1)
+        series[7000] = (7000, None)
+
+        sampled = _downsample(series, 100)
+
+        self.assertLessEqual(len(sampled), 100)
+        self.assertEqual((sampled[0], sampled[-1]), (series[0], series[-1]))
+        self.assertIn((4000, 1), sampled)
+        self.assertIn((7000, None), sampled)
+        self.assertEqual(sampled, sorted(sampled))
+        self.assertEqual(_downsample(series[:50], 100), series[:50])
+
+    def test_chart_endpoint_and_profile(self):
+        ladder, users = _make_ladder("Long career", 2)
+        player = users[1]
+        UserProfile.objects.create(user = player, handle = "Veteran")
+        Ladder.objects.filter(pk = ladder.pk).update(game = Game.objects.create(name = "Career Game", abv = "CAR"))
+        start = datetime.datetime(2020, 1, 1, tzinfo=utc)
+        RankHistory.objects.bulk_create([RankHistory(ladder = ladder, player = player, rank = 1 + m % 2, recorded_at = start + datetime.timedelta(hours = m))
+                                         for m in range(12000)])
+        url = reverse('api:player_history', args = (ladder.slug, player.username))
+
+        # The ladder, the player, their history and the leaves since it started
+        with self.assertNumQueries(4):
+            history = self.client.get(url, {'points': 50}).json()['history']
+        self.assertEqual(len(history), 50)
+        self.assertEqual(history[-1], [(start + datetime.timedelta(hours = 11999)).isoformat(), 2])
+        self.assertEqual(history, [[when.isoformat(), rank] for when, rank in rank_series(ladder.pk, player.pk, 50)])
+        self.assertEqual(self.client.get(url, {'points': 1}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'points': "many"}).status_code, 400)
+
+        response = self.client.get(reverse('user:profile', args = [player.username]))
+        self.assertContains(response, "<polyline", count = 1)
+
+class LadderStateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _standings(self, ladder):
+        return list(Rank.objects.filter(ladder = ladder).order_by('rank').values_list('player_id', 'arrow'))
+
+    def test_state_follows_results_and_leaves(self):
+        ladder, users = _make_ladder("Stateful", 6)
+        state = LadderState.load(ladder.pk)
+
+        with self.captureOnCommitCallbacks(execute = True):
+            for challenger, challengee, winner in ((5, 4, 5), (3, 2, 2), (4, 3, 4)):
+                Match.objects.create(ladder = ladder, challenger = users[challenger], challengee = users[challengee], winner = users[winner],
+                                     challenger_rank = state.rank(users[challenger].pk), challengee_rank = state.rank(users[challengee].pk),
+                                     date_challenged = datetime.datetime.utcnow().replace(tzinfo=utc))
+                state.play(users[winner].pk, users[challengee if winner == challenger else challenger].pk)
+            self.assertEqual(state.packed(), self._standings(ladder))
+
+            Rank.objects.get(ladder = ladder, player = users[1]).delete()
+            state.remove(users[1].pk)
+        self.assertEqual(state.packed(), self._standings(ladder))
+
+    def test_flush_writes_only_what_moved(self):
+        ladder, users = _make_ladder("Flushed", 300)
+        newcomer = User.objects.create(username = "flushed-newcomer")
+        state = LadderState.load(ladder.pk)
+        state.append(newcomer.pk)
+        state.play(newcomer.pk, users[299].pk)
+        state.play(users[150].pk, users[149].pk)
+
+        # One insert for the newcomer and one update for the three players who moved
+        with self.assertNumQueries(2):
+            self.assertEqual(state.flush(), 4)
+        self.assertEqual(self._standings(ladder), state.packed())
+
+    def test_target_ranks_follow_the_arrows(self):
+        ladder, users = _make_ladder("Targeted", 5)
+        stranger = User.objects.create(username = "targeted-stranger")
+        Rank.objects.filter(ladder = ladder, player = users[1]).update(arrow = Rank.ARROW_DOWN)
+        state = LadderState.load(ladder.pk)
+
+        self.assertEqual(list(state.target_ranks(users[0].pk, ladder.up_arrow, ladder.down_arrow)), [])
+        self.assertEqual(list(state.target_ranks(users[3].pk, ladder.up_arrow, ladder.down_arrow)), [2, 3])
+        self.assertEqual(list(state.target_ranks(users[1].pk, ladder.up_arrow, ladder.down_arrow)), [3, 4, 5])
+        self.assertEqual(list(state.target_ranks(stranger.pk, ladder.up_arrow, ladder.down_arrow)), [])
+
+    def test_challenges_are_checked_against_the_rank_table(self):
+        ladder, users = _make_ladder("Checked", 5)
+
+        # Ranks changed by another process, nothing here has been told
+        Rank.objects.filter(ladder = ladder, player = users[3]).update(rank = 1)
+        Rank.objects.filter(ladder = ladder, player = users[0]).update(rank = 4)
+        with self.assertRaises(ChallengeeOutOfRange):
+            _can_challenge_user(users[3], users[1], ladder)
+        self.assertTrue(_can_challenge_user(users[0], users[2], ladder))
+
+        Rank.objects.filter(ladder = ladder, player = users[0]).update(arrow = '7')
+        with self.assertRaises(ValueError):
+            _can_challenge_user(users[0], users[2], ladder)
@@ -16,5 +16,6 @@ urlpatterns = [
         url(r'^leave/$',                        ladder.views.leave_ladder,          name='leave'),
         url(r'^edit/$',                         ladder.views.update_ladder,         name='update_ladder'),
         url(r'^challenge/$',                    ladder.views.issue_challenge,       name='issue_challenge'),
+        url(r'^events/$',                       ladder.views.events,                name='events'),
     ])),
 ]
\ No newline at end of file
@@ -3,21 +3,38 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
+from django.db import transaction
 from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import redirect, render, get_object_or_404
 from django import forms
-from itertools import chain
 
-from ladder.models import Rank, Match, Ladder, Challenge, Game
-from ladder.helpers import _open_challenges_exist, _get_valid_targets
-from ladder.exceptions import ChallengeValidationError, PlayerNotRanked
+from ladder.cache import _ladder_changed
+from ladder.events import POLL_RECONNECT_DELAY
+from ladder.models import Rank, Match, Ladder, Challenge, Game, _get_user_challenges
+from ladder.helpers import _get_valid_targets, _get_ladder_standings, _get_home_feed, _get_standings_at
+from ladder.history import _parse_when
+from ladder.paging import _get_match_page
+from ladder.state import LadderState
+from ladder.exceptions import ChallengeOnCooldown, ChallengeValidationError, ParticipantBusy, PlayerNotRanked
+
+def historical_ladder_details(request, ladder, when):
+    """Retrieve info on a single ladder as it stood at `when`, rebuilt from its history. Nothing can be played in the past."""
+    rank_list  = _get_standings_at(ladder, when)
+    match_list = Match.objects.filter(ladder = ladder, date_complete__lte = when).select_related('ladder', 'challenger__userprofile', 'challengee__userprofile', 'winner__userprofile').order_by('-date_complete')[:25]
+    return {'can_challenge':False, 'challengables':[], 'current_player_rank':None, 'leave_link':None, 'join_link':None, 'ladder':ladder, 'rank_list':rank_list, 'match_list':match_list, 'open_challenges':[], 'history_at':when}
 
 def single_ladder_details(request, ladder):
-    """Retrieve info on a single ladder."""
-    
-    # get the raw ranking list
-    rank_list = Rank.objects.filter(ladder = ladder).order_by('rank')  
+    """Retrieve info on a single ladder, or with ?at=<date> on how it stood then."""
+    if request.GET.get('at'):
+        when = _parse_when(request.GET['at'])
+        if when is not None:
+            return historical_ladder_details(request, ladder, when)
+        messages.error(request, u"{0} isn't a date, these are the current standings.".format(request.GET['at']))
+
+    # get the ranking list, along with each player's profile and busy flag
+    rank_list = _get_ladder_standings(ladder)
+    ranked_players = dict((r.player_id, (r, busy)) for r, busy in rank_list)
     
     # set a flag to allow them to join the ladder
     join_link = None
@@ -26,19 +43,19 @@ def single_ladder_details(request, ladder):
     # if user is logged in
     if request.user.is_authenticated:
 
-        if ladder.max_players > ladder.players or ladder.max_players == 0 and request.user.pk not in [key.player.pk for key in rank_list]: 
+        if ladder.max_players > len(rank_list) or ladder.max_players == 0 and request.user.pk not in ranked_players: 
             join_link = True
 
-        if request.user.pk in [key.player.pk for key in rank_list]:
+        if request.user.pk in ranked_players:
             leave_link = True
 
         # if there is a ranking, get a list of those you can challenge.
-        try:
-            current_player_rank = Rank.objects.get(player = request.user, ladder = ladder)
-            challengables = _get_valid_targets(request.user, current_player_rank, rank_list, ladder)
+        if request.user.pk in ranked_players:
+            current_player_rank, open_challenges_exist = ranked_players[request.user.pk]
+            # Read fresh, so the links offered are the ones _can_challenge_user will accept
+            challengables = _get_valid_targets(request.user, LadderState.load(ladder.pk), ladder)
             messages.debug(request, "Challengable ranks: {0}".format(challengables))
-            open_challenges_exist = _open_challenges_exist(request.user, ladder)
-        except ObjectDoesNotExist:
+        else:
             open_challenges_exist = False
             current_player_rank = None
             challengables = []
@@ -48,43 +65,37 @@ def single_ladder_details(request, ladder):
         join_link = False
         challengables = []
 
-    rank_list       = [(r, _open_challenges_exist( r.player, ladder )) for r in rank_list] 
-    match_list      = Match.objects.filter(ladder = ladder).order_by('-date_complete')[:25]
-    open_challenges = Challenge.objects.filter(challenger = request.user.id, ladder = ladder).filter(accepted = 0).order_by('-deadline')
+    match_list      = Match.objects.filter(ladder = ladder).select_related('ladder', 'challenger__userprofile', 'challengee__userprofile', 'winner__userprofile').order_by('-date_complete')[:25]
+    open_challenges = Challenge.objects.filter(challenger = request.user.id, ladder = ladder).filter(accepted = 0).select_related('challenger__userprofile', 'challengee__userprofile').order_by('-deadline')
     return {'can_challenge':open_challenges_exist, 'challengables': challengables, 'current_player_rank':current_player_rank, 'leave_link':leave_link, 'join_link':join_link, 'ladder':ladder, 'rank_list':rank_list, 'match_list':match_list, 'open_challenges':open_challenges}
 
 def list_all_ladders(request):
     """Retrieve info on all the ladders."""
 
-    # List of all ladders includes match and rank info as well.
-    match_list = Match.objects.all().order_by('-date_complete')[:25]
-    rank_list = Rank.objects.all()
-    ladder_list = Ladder.objects.all()
+    # List of all ladders includes the recent matches as well, shared by everyone and cached.
+    all_ladders = dict(_get_home_feed())
 
     if request.user.is_authenticated:
-        # Check for open challenges
-        try:
-            challenger_list = Challenge.objects.filter(match__challenger = request.user, accepted=False)
-        except Exception:
-            challenger_list = []
-        try:
-            challengee_list = Challenge.objects.filter(match__challengee = request.user, accepted=False)
-        except Exception:
-            challengee_list = []
-
         # Check for logged-in users' open challenges
-        your_challenges = list(chain(challenger_list, challengee_list))
+        your_challenges = _get_user_challenges(request.user, statuses = (Challenge.STATUS_NOT_ACCEPTED,)).select_related('challenger', 'challengee')
     else:
         your_challenges = []
 
-    return {'match_list':match_list, 'rank_list':rank_list, 'ladder_list':ladder_list, 'your_challenges':your_challenges}
+    all_ladders['your_challenges'] = your_challenges
+    return all_ladders
+
+def events(request, ladder_slug):
+    """The ladder's live event stream is served by elo.asgi. Without it there is nothing to hold open,
+        so the EventSource is told to check back later, the same as polling the ladder page."""
+    get_object_or_404(Ladder, slug = ladder_slug)
+    return HttpResponse("retry: {0}\n\n".format(POLL_RECONNECT_DELAY), content_type = 'text/event-stream')
 
 def index(request, ladder_slug = None):
     """Display a list of all ladders, or just one ladder."""
     # Single ladder was requested via GET or directly via URL
     if request.GET != {} or ladder_slug:
         get_slug = ladder_slug if ladder_slug else request.GET['ladder_slug']
-        ladder = Ladder.objects.get(slug = get_slug)
+        ladder = Ladder.objects.select_related('game', 'owner').get(slug = get_slug)
         single_ladder_info = single_ladder_details(request, ladder)
 
         return render(request, 'single_ladder_listing.html', single_ladder_info)
@@ -94,14 +105,13 @@ def index(request, ladder_slug = None):
         all_ladders = list_all_ladders(request)
         return render(request, 'ladder_home.html', all_ladders)
 
-def match_list( request, ladder_slug, page_info ) :
-    # TODO: Implement this
+def match_list( request, ladder_slug ) :
     # Show a (paged) list of all matches on the ladder
-    ladder          = Ladder.objects.get( slug = ladder_slug )
-    matches         = Match.objects.filter( ladder = ladder ).order_by( '-date_complete' )[page_info.get_item_slice()]
-    page_info.set_item_count( Match.objects.filter( ladder = ladder ).count() )
+    ladder          = get_object_or_404( Ladder, slug = ladder_slug )
+    matches         = Match.objects.filter( ladder = ladder ).select_related( 'challenger__userprofile', 'challengee__userprofile', 'winner__userprofile' )
+    page            = _get_match_page( [matches], request.GET.get( 'cursor' ) )
 
-    return render(request, 'match_list.html', { 'ladder':ladder, 'pageinfo':page_info, 'matches':matches })
+    return render(request, 'match_list.html', { 'ladder':ladder, 'page':page, 'matches':page.matches })
 
 def match_detail( request, ladder_slug, match_id ) :
     # TODO: Implement this
@@ -146,12 +156,16 @@ def join_ladder(request, ladder_slug):
     
     # If POST and user is unranked: confirm the join.
     elif request.method == 'POST' and not _user_already_ranked(request.user, ladder):
-        rank_list = Rank.objects.filter(ladder = ladder)
-        
-        new_rank = Rank(player = request.user, rank = rank_list.count() + 1, arrow = 0, ladder = ladder)
-        new_rank.save()
-        rank_list = Rank.objects.filter(ladder = ladder)
-        messages.success(request, u"You've joined the ladder! You are now rank {0} of {1}.".format(new_rank.rank, rank_list.count()))
+        # Lock the ladder so players joining at the same time get consecutive ranks,
+        # the new rank and the ladder's player count are saved together.
+        with transaction.atomic():
+            ladder = Ladder.objects.select_for_update().get(pk = ladder.pk)
+            rank_list = Rank.objects.filter(ladder = ladder)
+
+            new_rank = Rank(player = request.user, rank = rank_list.count() + 1, arrow = 0, ladder = ladder)
+            new_rank.save()
+            _ladder_changed(ladder.pk)
+        messages.success(request, u"You've joined the ladder! You are now rank {0} of {0}.".format(new_rank.rank))
     
         return HttpResponseRedirect(reverse('ladder:detail', args=(ladder.slug,)))
 
@@ -193,32 +207,37 @@ def issue_challenge(request, *args, **kwargs):
 
         try :
             challenger      = request.user
-            challengee      = User.objects.get(pk = challengee_id)
+            challengee      = User.objects.select_related('userprofile').get(pk = challengee_id)
         except ObjectDoesNotExist :
             messages.error( request, "Challenge target does not exist {}".format( challengee_id ) )
             return HttpResponseRedirect(reverse('ladder:detail', args=(ladder_slug,)))
 
         try :
             ladder          = Ladder.objects.get(slug=ladder_slug)
-            if not ladder.is_user_ranked( challenger ) :
-                raise PlayerNotRanked( "challenger isn't ranked on the ladder", ladder )
-        except PlayerNotRanked:
+        except ObjectDoesNotExist :
             messages.error( request, "You cannot issue a challenge on the ladder {}".format( ladder_slug ) )
             return HttpResponseRedirect(reverse('index'))
 
-        # Check for open challenges
-
-        if _open_challenges_exist(request.user, ladder):
-            messages.error(request, u"You have open challenges, you cannot challenge at this time.")
-        else:
-            # Generate a challenge
-            try :
-                challenge = Challenge( challenger=challenger, challengee=challengee, ladder=ladder )
-                challenge.save()
-                messages.success(request, u"You have issued a challenged to {0}, under the ladder {1}".format(challengee.userprofile.handle, ladder.name))
-            except ChallengeValidationError as e :
+        # Generate a challenge, saving it checks that both players are ranked, neither is busy
+        # and the challengee is in range.
+        try :
+            challenge = Challenge( challenger=challenger, challengee=challengee, ladder=ladder )
+            challenge.save()
+            messages.success(request, u"You have issued a challenged to {0}, under the ladder {1}".format(challengee.userprofile.handle, ladder.name))
+        except PlayerNotRanked :
+            messages.error( request, "You cannot issue a challenge on the ladder {}".format( ladder_slug ) )
+            return HttpResponseRedirect(reverse('index'))
+        except ParticipantBusy as e :
+            if e.args[1] != challenger :
                 messages.error( request, "An error occurred: {}".format( str(e) ) )
                 return HttpResponseRedirect(reverse('ladder:detail', args=(ladder.slug,)))
+            messages.error(request, u"You have open challenges, you cannot challenge at this time.")
+        except ChallengeOnCooldown :
+            messages.error( request, u"You challenged {0} too recently, you can challenge them again once {1} days have passed.".format( challengee.userprofile.handle, ladder.challenge_cooldown ) )
+            return HttpResponseRedirect(reverse('ladder:detail', args=(ladder.slug,)))
+        except ChallengeValidationError as e :
+            messages.error( request, "An error occurred: {}".format( str(e) ) )
+            return HttpResponseRedirect(reverse('ladder:detail', args=(ladder.slug,)))
 
         return render(request, 'challenge.html', {'ladder':ladder, 'challengee':challengee })
 
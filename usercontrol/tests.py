@@ -1,3 +1,73 @@
+import datetime
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import utc
 
-# Create your tests here.
+from elo.models import UserProfile
+from ladder.models import Challenge, Game, Ladder, Match, Rank
+
+class ProfileQueryTests(TestCase):
+    def _make_player(self, username, ladders, matches_per_ladder):
+        """A player ranked first on `ladders` ladders against one opponent each, who has won every other match."""
+        now = datetime.datetime.utcnow().replace(tzinfo=utc)
+        player = User.objects.create(username = username)
+        game = Game.objects.create(name = "{0} game".format(username), abv = username[:5])
+        for i in range(ladders):
+            ladder = Ladder.objects.create(name = "{0} {1}".format(username, i), game = game)
+            opponent = User.objects.create(username = "{0}-opponent-{1}".format(username, i))
+            Rank.objects.bulk_create([Rank(ladder = ladder, player = player, rank = 1), Rank(ladder = ladder, player = opponent, rank = 2)])
+            Challenge.objects.bulk_create([Challenge(ladder = ladder, challenger = opponent, challengee = player, date_issued = now, deadline = now,
+                                                     accepted = Challenge.STATUS_COMPLETED)])
+            Match.objects.bulk_create([Match(ladder = ladder, challenger = opponent, challengee = player, winner = player if m % 2 else opponent,
+                                             date_challenged = now, date_complete = now - datetime.timedelta(minutes = m))
+                                       for m in range(matches_per_ladder)])
+        return player
+
+    def test_stats(self):
+        player = self._make_player("stats", 3, 4)
+
+        stats = self.client.get(reverse('user:profile', args = [player.username])).context['stats']
+
+        self.assertEqual(stats, {"Ladders Joined": 3, "Challenges Issued": 0, "Challenges Received": 3, "Matches Won": 6, "Matches Lost": 6})
+
+    def test_query_count_is_flat(self):
+        query_counts = []
+        for username, ladders, matches in (("small", 1, 1), ("large", 12, 30)):
+            player = self._make_player(username, ladders, matches)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('user:profile', args = [player.username]))
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+
+class CommonLaddersTests(TestCase):
+    def _make_ladders(self, prefix, count, *players):
+        game = Game.objects.create(name = "{0} game".format(prefix), abv = "G{0}".format(Game.objects.count()))
+        Ladder.objects.bulk_create([Ladder(name = "{0} {1:03}".format(prefix, i), slug = "{0}-{1:03}".format(prefix, i), game = game) for i in range(count)])
+        ladders = list(Ladder.objects.filter(game = game).order_by('name'))
+        Rank.objects.bulk_create([Rank(ladder = ladder, player = player, rank = i + 1) for ladder in ladders for i, player in enumerate(players)])
+        return ladders
+
+    def test_common_and_invite_ladders(self):
+        query_counts = []
+        for prefix, size in (("few", 2), ("many", 300)):
+            viewer = User.objects.create(username = "{0}-viewer".format(prefix))
+            player = User.objects.create(username = "{0}-player".format(prefix))
+            common = self._make_ladders("{0}-both".format(prefix), size, viewer, player)
+            invite = self._make_ladders("{0}-viewer".format(prefix), size, viewer)
+            self._make_ladders("{0}-player".format(prefix), size, player)
+
+            # The page header links to the viewer's profile by handle
+            UserProfile.objects.filter(user = viewer).update(handle = viewer.username)
+            self.client.force_login(viewer)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('user:profile', args = [player.username]))
+            query_counts.append(len(queries))
+
+            self.assertEqual(set(response.context['common']), set(common))
+            self.assertEqual(response.context['invite'], invite)
+
+        self.assertEqual(query_counts[0], query_counts[1])
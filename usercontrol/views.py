@@ -3,50 +3,67 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
-from django.db.models import Q
+from django.db.models import OuterRef, Q
 from django.shortcuts import get_object_or_404, render
-from ladder.models import Rank, Challenge, Match, _get_user_challenges
-from ladder.exceptions import PlayerNotInvolved
+from ladder.models import Rank, Challenge, Ladder, Match, _get_user_challenges
+from ladder.exceptions import ChallengeStatusConflict, PlayerNotInvolved
+from ladder.helpers import _count_subquery
+from ladder.paging import _get_match_page
+from ladder.series import _sparkline, player_rank_series
 
 PROFILE_RECENT_MATCHES    = 5         # How many matches to show under the "Recent Matches" header
 PROFILE_ACTIVE_LADDERS    = 5         # How many ladders to show under the "Active Ladders" header
+PROFILE_CHART_POINTS      = 60        # Points in the rank history chart beside each active ladder
+PROFILE_CHART_SIZE        = (120, 30) # Width and height of the rank history chart, as drawn in profile.html
 
 def profile( request, username ) :
-    # Get our user object or bail
-    user              = get_object_or_404( User, username = username )
+    # Get our user object, with all of their stats counted in the same query, or bail
+    user              = get_object_or_404( User.objects.select_related( 'userprofile' ).annotate(
+        ladders_joined        = _count_subquery( Rank.objects.filter( player = OuterRef( 'pk' ) ) ),
+        challenges_issued     = _count_subquery( Challenge.objects.filter( challenger = OuterRef( 'pk' ) ) ),
+        challenges_received   = _count_subquery( Challenge.objects.filter( challengee = OuterRef( 'pk' ) ) ),
+        matches_won           = _count_subquery( Match.objects.filter( winner = OuterRef( 'pk' ) ) ),
+        # Lost as the challenger plus lost as the defender, so each side uses its own index
+        matches_lost          = _count_subquery( Match.objects.filter( challenger = OuterRef( 'pk' ), winner__isnull = False ).exclude( winner = OuterRef( 'pk' ) ) )
+                              + _count_subquery( Match.objects.filter( challengee = OuterRef( 'pk' ), winner__isnull = False ).exclude( winner = OuterRef( 'pk' ) ) ),
+    ), username = username )
 
     # Get user info
     stats             = { 
-        "Ladders Joined":         Rank.objects.filter( player_id = user.pk ).count(), 
-        "Challenges Issued":      Challenge.objects.filter( challenger_id = user.pk ).count(), 
-        "Challenges Received":    Challenge.objects.filter( challengee_id = user.pk ).count(), 
-        "Matches Won":            Match.objects.filter( winner_id = user.pk ).count(), 
-        "Matches Lost":           Match.objects.filter( Q(winner_id__isnull = False) & ( Q(challengee = user) | Q(challenger = user) ) & ~Q(winner_id = user.pk) ).count(),
+        "Ladders Joined":         user.ladders_joined, 
+        "Challenges Issued":      user.challenges_issued, 
+        "Challenges Received":    user.challenges_received, 
+        "Matches Won":            user.matches_won, 
+        "Matches Lost":           user.matches_lost,
     }
-    matches           = Match.objects.filter( winner_id__isnull = False ).filter( Q(challengee = user) | Q(challenger = user) ).order_by( '-date_complete' )[:PROFILE_RECENT_MATCHES]
-    ladders           = user.rank_set.order_by( '-ladder__created' )
-    ranks             = [(r,r.ladder.latest_match()) for r in ladders[:PROFILE_ACTIVE_LADDERS]]
+    recent_matches    = Match.objects.select_related( 'ladder__game', 'challenger__userprofile', 'challengee__userprofile' )
+    matches           = _get_match_page( [recent_matches.filter( challenger = user ), recent_matches.filter( challengee = user )], per_page = PROFILE_RECENT_MATCHES ).matches
+    ladders           = user.rank_set.select_related( 'ladder__game' ).order_by( '-ladder__created' )
+    active            = list( ladders[:PROFILE_ACTIVE_LADDERS] )
+    charts            = player_rank_series( user.pk, [r.ladder_id for r in active], PROFILE_CHART_POINTS )
+    ranks             = [(r,r.ladder.latest_activity,_sparkline( charts[r.ladder_id], *PROFILE_CHART_SIZE )) for r in active]
 
     # Get common ladders
     if request.user.is_authenticated and not user == request.user :
-        # TODO : find these more efficiently
         # common_ladders is the intersection of user's ladders and request.user's ladders
         # invite_ladders is the difference of request.user's ladders (that they can invite to) and user's ladders
-        common_ladders    = [r.ladder for r in ladders if r.ladder.rank_set.filter( player = request.user ).count()]
-        invite_ladders    = [r.ladder for r in request.user.rank_set.order_by( 'ladder__name' ) if not r.ladder.rank_set.filter( player = user ).count()]
+        user_ladder_ids   = set( ladders.values_list( 'ladder_id', flat = True ) )
+        viewer_ladders    = list( Ladder.objects.filter( rank__player = request.user ).select_related( 'game' ).order_by( 'name' ) )
+        common_ladders    = sorted( [l for l in viewer_ladders if l.pk in user_ladder_ids], key = lambda l : l.created, reverse = True )
+        invite_ladders    = [l for l in viewer_ladders if l.pk not in user_ladder_ids]
     else :
         common_ladders    = []
         invite_ladders    = []
 
     return render( request, "profile.html", { 'userp':user, 'stats':stats, 'matches':matches, 'ranks':ranks, 'common':common_ladders, 'invite':invite_ladders } )
 
-def match_list( request, username, page_info ) :
-    user            = get_object_or_404( User, username = username )
-    all_matches     = Match.objects.filter( Q( challenger = user ) | Q( challengee = user ) )
-    matches         = all_matches.order_by( '-date_complete' )[page_info.get_item_slice()]
-    page_info.set_item_count( all_matches.count() )
+def match_list( request, username ) :
+    user            = get_object_or_404( User.objects.select_related( 'userprofile' ), username = username )
+    all_matches     = Match.objects.select_related( 'ladder', 'challenger__userprofile', 'challengee__userprofile', 'winner__userprofile' )
+    # Challenged and defended matches are paged separately and merged, so each can use its own index
+    page            = _get_match_page( [all_matches.filter( challenger = user ), all_matches.filter( challengee = user )], request.GET.get( 'cursor' ) )
 
-    return render(request, 'user_match_list.html', { 'userp':user, 'pageinfo':page_info, 'matches':matches })
+    return render(request, 'user_match_list.html', { 'userp':user, 'page':page, 'matches':page.matches })
 
 @login_required
 def message_list( request ) :
@@ -61,20 +78,18 @@ def message_challenges( request ) :
             action    = request.POST['action']
             notice_id = request.POST['note_id']
 
-            challenge = Challenge.objects.get( pk = notice_id )
+            challenge = Challenge.objects.select_related( 'challenger__userprofile', 'challengee__userprofile', 'ladder' ).get( pk = notice_id )
 
-            if challenge.challengee == request.user :
+            if challenge.challengee_id == request.user.pk :
                 if action == "accept_challenge" :
                     challenge.accept()
-                    challenge.save()
                     messages.success( request, "You accepted the challenge against {}".format( challenge.challenger.userprofile.handle ) )
                 elif action == "decline_challenge" :
                     challenge.forfeit()
-                    challenge.save()
                     messages.success( request, "You forfeited the challenge against {}".format( challenge.challenger.userprofile.handle ) )
                 else :
                     messages.error( request, "Invalid command" )
-            elif challenge.challenger == request.user :
+            elif challenge.challenger_id == request.user.pk :
                 if action == "cancel_challenge" :
                     if challenge.accepted == Challenge.STATUS_NOT_ACCEPTED :
                         challenge.cancel()
@@ -92,8 +107,10 @@ def message_challenges( request ) :
             messages.error( request, "Challenge not found." )
         except ObjectDoesNotExist :
             messages.error( request, "Challenge not found." )
+        except ChallengeStatusConflict :
+            messages.warning( request, "The challenge has already been answered." )
 
-    challenges = _get_user_challenges( request.user )
+    challenges = _get_user_challenges( request.user ).select_related( 'challenger__userprofile', 'challengee__userprofile', 'ladder' )
 
     # status = 1
     # Accepted
@@ -116,7 +133,7 @@ def message_matches( request ) :
             action    = request.POST['action']
             notice_id = request.POST['note_id']
 
-            match     = Match.objects.get( pk = notice_id )
+            match     = Match.objects.select_related( 'ladder', 'challenger__userprofile', 'challengee__userprofile' ).get( pk = notice_id )
             other     = match.challenger if request.user == match.challengee else match.challengee
 
             if request.user == match.challenger or request.user == match.challengee :
@@ -144,8 +161,11 @@ def message_matches( request ) :
             messages.error( request, "Not enough information to complete request." )
         except PlayerNotInvolved :
             messages.error( request, "Match not found" )
+        except ObjectDoesNotExist :
+            messages.error( request, "Match not found" )
 
     matches = Match.objects.filter( Q(winner__isnull = True) & ( Q(challengee = request.user) | Q(challenger = request.user) ) ).order_by( '-date_challenged' )
+    matches = matches.select_related( 'ladder__game', 'challenger__userprofile', 'challengee__userprofile' )
     return render( request, "matches.html", { 'matches':matches } )
 
 def message_detail( request ) :